@@ -0,0 +1,51 @@
+'''
+filename: lazy_tasks.py
+functions: lazy_task
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import importlib
+import sys
+
+
+###############################################################################
+# Define the function creating the callables of the DAG tasks
+# ##############################################################################
+
+def lazy_task(module_name, function_name):
+    '''
+    This function returns a callable for a PythonOperator which imports the
+    module of the task function only when the task runs. The Airflow scheduler
+    parses the DAG files every few seconds, and importing the utils of the
+    pipelines there loads pandas, sqlite3, mlflow, lightgbm and sklearn on
+    every parse.
+
+    The callable takes the name of the function and the module it is assigned
+    in, so that it can be pickled by reference like the function itself, e.g.
+    by the process pool of the local runner.
+
+
+    INPUTS
+        module_name : module defining the task function, e.g.
+                      'Lead_scoring_data_pipeline.utils'
+        function_name : name of the task function in the module
+
+
+    OUTPUT
+        function calling the task function with its arguments
+
+
+    SAMPLE USAGE
+        # in Lead_scoring_data_pipeline/tasks.py
+        build_dbs = lazy_task('Lead_scoring_data_pipeline.utils', 'build_dbs')
+    '''
+    def task(*args, **kwargs):
+        return getattr(importlib.import_module(module_name), function_name)(*args, **kwargs)
+
+    task.__name__ = task.__qualname__ = function_name
+    task.__module__ = sys._getframe(1).f_globals.get('__name__', __name__)
+    task.__doc__ = f"Runs {module_name}.{function_name}, imported when the task runs."
+    return task
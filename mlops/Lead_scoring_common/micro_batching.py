@@ -0,0 +1,192 @@
+'''
+filename: micro_batching.py
+classes: LatencyStats, MicroBatcher
+Coalescing of concurrent asyncio requests into micro-batches, bounded by
+their number of items and by the time the first request of a batch waits,
+with the latency and throughput counters of the requests.
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import asyncio
+import collections
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+###############################################################################
+# Define the latency and throughput counters
+# ##############################################################################
+
+class LatencyStats:
+    '''
+    Counters of the requests and batches, and the latencies of the last
+    'window' requests, from which the percentiles are computed. Updated from
+    the event loop only, so no lock is needed.
+    '''
+
+    def __init__(self, window=10000):
+        self.latencies = collections.deque(maxlen=window)
+        self.started = time.perf_counter()
+        self.requests = 0
+        self.items = 0
+        self.errors = 0
+        self.batches = 0
+        self.batch_seconds = 0.0
+
+    def record_request(self, seconds, items, error=False):
+        self.latencies.append(seconds)
+        self.requests += 1
+        self.items += items
+        self.errors += int(error)
+
+    def record_batch(self, seconds):
+        self.batches += 1
+        self.batch_seconds += seconds
+
+    def snapshot(self):
+        '''
+        Returns the counters, the throughput since the start and the p50, p95,
+        p99 and max latency in milliseconds of the requests of the window.
+        '''
+        uptime = time.perf_counter() - self.started
+        latencies = np.array(self.latencies) * 1000
+        percentiles = np.percentile(latencies, [50, 95, 99]) if len(latencies) else [None] * 3
+        return {
+            'requests': self.requests,
+            'items': self.items,
+            'errors': self.errors,
+            'batches': self.batches,
+            'mean_batch_items': self.items / self.batches if self.batches else None,
+            'mean_batch_ms': self.batch_seconds / self.batches * 1000 if self.batches else None,
+            'uptime_seconds': uptime,
+            'requests_per_second': self.requests / uptime,
+            'items_per_second': self.items / uptime,
+            'latency_ms': {
+                'p50': None if percentiles[0] is None else float(percentiles[0]),
+                'p95': None if percentiles[1] is None else float(percentiles[1]),
+                'p99': None if percentiles[2] is None else float(percentiles[2]),
+                'max': float(latencies.max()) if len(latencies) else None,
+                'window': len(latencies),
+            },
+        }
+
+
+###############################################################################
+# Define the micro-batcher
+# ##############################################################################
+
+class MicroBatcher:
+    '''
+    This class coalesces the items of concurrent requests into micro-batches.
+    A batch starts with the oldest waiting request and takes the following
+    ones, whole, until it holds at least 'max_batch_size' items or its first
+    request waited 'max_wait' seconds. The batches are predicted one at a
+    time in a worker thread, so the event loop keeps accepting requests
+    meanwhile, and those requests make up the next batch.
+
+
+    INPUTS
+        predict : function of the list of the items of a batch returning the
+                  list, or array, of their results in the same order
+        max_batch_size : maximum number of items of a batch
+        max_wait : maximum seconds the first request of a batch waits for
+                   others, 0 batches only the requests already waiting
+        stats : LatencyStats the requests and batches are recorded in
+
+
+    SAMPLE USAGE
+        batcher = MicroBatcher(lambda leads: model.predict(encode(leads)), 256, 0.005)
+        batcher.start()
+        scores = await batcher.submit(leads)
+    '''
+
+    def __init__(self, predict, max_batch_size=256, max_wait=0.005, stats=None):
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.stats = stats or LatencyStats()
+        self.queue = None
+        self.task = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='micro-batch')
+
+    def start(self):
+        '''
+        Starts the batching loop in the running event loop.
+        '''
+        self.queue = asyncio.Queue()
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.executor.shutdown(wait=False)
+
+    async def submit(self, items):
+        '''
+        Queues the items of a request and returns their results once their
+        batch is predicted. The exception of a failed batch is raised to all
+        of its requests.
+        '''
+        start = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((list(items), future))
+        try:
+            results = await future
+        except Exception:
+            self.stats.record_request(time.perf_counter() - start, len(items), error=True)
+            raise
+        self.stats.record_request(time.perf_counter() - start, len(items))
+        return results
+
+    async def next_batch(self):
+        '''
+        Waits for the oldest request and returns it with the requests that
+        join its batch.
+        '''
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        size = len(batch[0][0])
+        deadline = loop.time() + self.max_wait
+        while size < self.max_batch_size:
+            if not self.queue.empty():
+                entry = self.queue.get_nowait()
+            else:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    entry = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            batch.append(entry)
+            size += len(entry[0])
+        return batch
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self.next_batch()
+            items = [item for request_items, _ in batch for item in request_items]
+            start = time.perf_counter()
+            try:
+                results = await loop.run_in_executor(self.executor, self.predict, items)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            finally:
+                self.stats.record_batch(time.perf_counter() - start)
+            offset = 0
+            for request_items, future in batch:
+                if not future.done():
+                    future.set_result(results[offset:offset + len(request_items)])
+                offset += len(request_items)
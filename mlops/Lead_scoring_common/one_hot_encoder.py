@@ -0,0 +1,131 @@
+'''
+filename: one_hot_encoder.py
+functions: compile_one_hot_encoder, one_hot_encode, encode_features_frame
+The one hot encoding of the 'features' table, shared by the training and the
+inference pipelines so that both always give the model the same columns.
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import numpy as np
+import pandas as pd
+
+
+###############################################################################
+# Define the functions to compile and apply the encoder
+# ##############################################################################
+
+def compile_one_hot_encoder(output_columns, features_to_encode):
+    '''
+    This function maps every level of the features to encode, and every other
+    column, to its index in the output columns, once, so that encoding a frame
+    is a single scatter into a preallocated matrix. An output column
+    '<feature>_<level>' is the indicator of the level of the feature, and any
+    other output column is copied from the column of the same name.
+
+
+    INPUTS
+        output_columns : list of the columns of the encoded features, e.g.
+                         ONE_HOT_ENCODED_FEATURES
+        features_to_encode : list of the categorical columns one hot encoded,
+                             e.g. FEATURES_TO_ENCODE
+
+
+    OUTPUT
+        dictionary with the output columns, the index of the columns copied
+        ('passthrough') and, for every feature to encode, its levels and the
+        index of their indicator column
+
+
+    SAMPLE USAGE
+        ONE_HOT_ENCODER = compile_one_hot_encoder(ONE_HOT_ENCODED_FEATURES, FEATURES_TO_ENCODE)
+    '''
+    passthrough = {}
+    levels = {feature: ([], []) for feature in features_to_encode}
+    for index, column in enumerate(output_columns):
+        # the longest feature prefix, in case a feature name is the prefix of another
+        features = [feature for feature in features_to_encode if column.startswith(feature + '_')]
+        if features:
+            feature = max(features, key=len)
+            levels[feature][0].append(column[len(feature) + 1:])
+            levels[feature][1].append(index)
+        else:
+            passthrough[column] = index
+    return {
+        'columns': list(output_columns),
+        'passthrough': passthrough,
+        'levels': {feature: (pd.Index(names), np.array(indices, dtype=np.intp))
+                   for feature, (names, indices) in levels.items()},
+    }
+
+
+def one_hot_encode(df, encoder, sparse=False):
+    '''
+    This function encodes the frame with a compiled encoder. The columns
+    copied are cast to float32 with nulls as 0, and the indicators of the
+    levels are set with a single scatter of all the features. Levels that
+    have no output column, and nulls, have no indicator, as with
+    pd.get_dummies followed by the selection of the output columns.
+
+
+    INPUTS
+        df : frame with the features to encode and the columns copied, a
+             missing column gives a column of 0
+        encoder : encoder returned by compile_one_hot_encoder
+        sparse : if True a scipy.sparse CSR matrix is returned, built from the
+                 non zero values only, else a dense numpy matrix
+
+
+    OUTPUT
+        float32 matrix of one row per row of df and one column per output
+        column of the encoder, in column major order if dense
+
+
+    SAMPLE USAGE
+        matrix = one_hot_encode(df, ONE_HOT_ENCODER)
+    '''
+    rows, columns = [], []
+    for feature, (levels, indices) in encoder['levels'].items():
+        if feature not in df.columns:
+            print(feature + ', Feature not found')
+            continue
+        # the levels are looked up once per distinct value, -1 (null) maps to -1
+        codes, uniques = pd.factorize(df[feature])
+        lookup = np.append(levels.get_indexer(pd.Index(uniques).astype(str)), -1)
+        codes = lookup[codes]
+        matched = np.flatnonzero(codes >= 0)
+        rows.append(matched)
+        columns.append(indices[codes[matched]])
+    rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.intp)
+    columns = np.concatenate(columns) if columns else np.empty(0, dtype=np.intp)
+    passthrough = [(column, index) for column, index in encoder['passthrough'].items() if column in df.columns]
+    shape = (len(df), len(encoder['columns']))
+
+    if not sparse:
+        # column major, so that a column is contiguous as in a dataframe
+        matrix = np.zeros(shape, dtype=np.float32, order='F')
+        for column, index in passthrough:
+            matrix[:, index] = df[column].to_numpy(dtype=np.float32, na_value=0)
+        matrix.reshape(-1, order='F')[columns * shape[0] + rows] = 1
+        return matrix
+
+    # scipy is only needed for the sparse output
+    from scipy import sparse as scipy_sparse
+    data = [np.ones(len(rows), dtype=np.float32)]
+    for column, index in passthrough:
+        values = df[column].to_numpy(dtype=np.float32, na_value=0)
+        non_zero = np.flatnonzero(values)
+        rows = np.concatenate([rows, non_zero])
+        columns = np.concatenate([columns, np.full(len(non_zero), index, dtype=np.intp)])
+        data.append(values[non_zero])
+    return scipy_sparse.csr_matrix((np.concatenate(data), (rows, columns)), shape=shape)
+
+
+def encode_features_frame(df, encoder):
+    '''
+    Returns the encoded features of the frame as a float32 dataframe with the
+    output columns of the encoder, as written to the 'features' table.
+    '''
+    return pd.DataFrame(one_hot_encode(df, encoder), columns=encoder['columns'], copy=False)
@@ -0,0 +1,108 @@
+'''
+filename: sqlite_connection.py
+functions: connect, get_connection
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# settings applied to every connection. WAL lets the readers of a table run
+# while a task writes to it, and with it synchronous=NORMAL only syncs at
+# checkpoints while the db stays consistent after a crash.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -65536,       # negative values are in KiB, i.e. 64 MiB
+    'mmap_size': 268435456,     # 256 MiB of the db file read through mmap
+    'temp_store': 'MEMORY',
+    'busy_timeout': 30000,      # ms to wait for a lock held by another task
+}
+
+# connections opened by get_connection, per thread and db file, so that the
+# functions called by a task share the connection of the task
+_task_connections = threading.local()
+
+
+###############################################################################
+# Define the function to open a tuned connection
+# ##############################################################################
+
+def connect(db_path, pragmas=SQLITE_PRAGMAS):
+    '''
+    Opens a sqlite3 connection to the db file and applies the pragmas to it.
+    The caller owns the connection and has to close it, prefer get_connection
+    which also takes care of the commit, rollback and close.
+    '''
+    conn = sqlite3.connect(db_path, timeout=pragmas.get('busy_timeout', 5000) / 1000)
+    for pragma, value in pragmas.items():
+        conn.execute(f'PRAGMA {pragma} = {value}')
+    return conn
+
+
+###############################################################################
+# Define the context manager used by the tasks
+# ##############################################################################
+
+@contextmanager
+def get_connection(db_path, pragmas=SQLITE_PRAGMAS, report=True):
+    '''
+    This context manager yields a tuned connection to the db file. Nested uses
+    within the same thread reuse the open connection of the outermost one, so
+    a task and the helpers it calls share a single connection. The outermost
+    use commits on success, rolls back on error and always closes the
+    connection, then logs how long it took to open and how long it was held.
+
+
+    INPUTS
+        db_path : path of the sqlite db file
+        pragmas : settings applied when the connection is opened, defaults to
+                  SQLITE_PRAGMAS
+        report : if False the timings of the connection are not logged
+
+
+    OUTPUT
+        open sqlite3 connection
+
+
+    SAMPLE USAGE
+        with get_connection(os.path.join(DB_PATH, DB_FILE_NAME)) as conn:
+            df = pd.read_sql('select * from model_input', conn)
+    '''
+    key = os.path.abspath(db_path)
+    connections = getattr(_task_connections, 'connections', None)
+    if connections is None:
+        connections = _task_connections.connections = {}
+
+    if key in connections:
+        yield connections[key]
+        return
+
+    start = time.perf_counter()
+    conn = connect(db_path, pragmas)
+    opened = time.perf_counter()
+    connections[key] = conn
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        del connections[key]
+        changes = conn.total_changes
+        conn.close()
+        if report:
+            message = (f'SQLite connection to {os.path.basename(db_path)}: opened in {opened - start:.4f}s, '
+                       f'held for {time.perf_counter() - opened:.3f}s, {changes} row(s) changed.')
+            logger.info(message)
+            print(message)
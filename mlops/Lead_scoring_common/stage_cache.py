@@ -0,0 +1,147 @@
+'''
+filename: stage_cache.py
+functions: file_fingerprint, compute_fingerprint, get_table_fingerprint,
+           is_stage_cached, record_stage_run, invalidate_table_fingerprints
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import hashlib
+import logging
+
+from Lead_scoring_common.storage import SQLiteStorage
+
+logger = logging.getLogger(__name__)
+
+# tables holding the fingerprint of the last run of every stage and of the
+# tables they wrote
+DB_STAGE_CACHE_TABLE_NAME = 'stage_cache'
+DB_TABLE_FINGERPRINTS_TABLE_NAME = 'table_fingerprints'
+
+
+###############################################################################
+# Define the functions to fingerprint the inputs of a stage
+# ##############################################################################
+
+def file_fingerprint(path, block_size=1 << 20):
+    '''
+    Returns the sha256 hex digest of the content of the file. The file is read
+    in blocks so that large csv files are never held in memory.
+    '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def compute_fingerprint(*parts):
+    '''
+    Combines the given parts (file fingerprints, upstream table fingerprints,
+    mappings, parameters...) into a single sha256 hex digest. The parts are
+    hashed through their repr, so they must have a deterministic one.
+    '''
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(repr(part).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def create_cache_tables(conn):
+    conn.execute(f'CREATE TABLE IF NOT EXISTS {DB_STAGE_CACHE_TABLE_NAME} '
+                 '(stage TEXT PRIMARY KEY, fingerprint TEXT, hits INTEGER, misses INTEGER, '
+                 'last_run_at TEXT, last_hit_at TEXT)')
+    conn.execute(f'CREATE TABLE IF NOT EXISTS {DB_TABLE_FINGERPRINTS_TABLE_NAME} '
+                 '(table_name TEXT PRIMARY KEY, fingerprint TEXT, updated_at TEXT)')
+
+
+def get_table_fingerprint(conn, table_name):
+    '''
+    Returns the fingerprint of the inputs of the stage that last wrote the
+    table, or None if the table wasn't written by a cached stage.
+    '''
+    create_cache_tables(conn)
+    query = f'SELECT fingerprint FROM {DB_TABLE_FINGERPRINTS_TABLE_NAME} WHERE table_name = ?'
+    row = conn.execute(query, (table_name,)).fetchone()
+    return row[0] if row else None
+
+
+###############################################################################
+# Define the functions to look up and record the runs of a stage
+# ##############################################################################
+
+def is_stage_cached(conn, stage, fingerprint, output_tables, storage=None):
+    '''
+    This function checks if the last successful run of the stage had the same
+    input fingerprint and if all of its output tables are still the ones that
+    run wrote. The outcome is logged and counted in the stage cache table as a
+    hit or a miss.
+
+
+    INPUTS
+        conn : open sqlite3 connection to the pipeline's database
+        stage : name of the stage, e.g. 'map_city_tier'
+        fingerprint : fingerprint of the inputs of the current run
+        output_tables : tables written by the stage
+        storage : storage backend holding the output tables, defaults to the
+                  sqlite db
+
+
+    OUTPUT
+        True if the stage can be skipped, else False
+
+
+    SAMPLE USAGE
+        if is_stage_cached(conn, 'map_city_tier', fingerprint, ['city_tier_mapped']):
+            return
+    '''
+    storage = storage or SQLiteStorage()
+    create_cache_tables(conn)
+    query = f'SELECT fingerprint FROM {DB_STAGE_CACHE_TABLE_NAME} WHERE stage = ?'
+    row = conn.execute(query, (stage,)).fetchone()
+    # the outputs must still exist and not have been rewritten by another stage
+    outputs_unchanged = all(
+        storage.exists(conn, table)
+        and get_table_fingerprint(conn, table) == fingerprint
+        for table in output_tables)
+    hit = row is not None and row[0] == fingerprint and outputs_unchanged
+
+    if hit:
+        conn.execute(f"UPDATE {DB_STAGE_CACHE_TABLE_NAME} SET hits = hits + 1, last_hit_at = datetime('now') "
+                     'WHERE stage = ?', (stage,))
+        conn.commit()
+        message = f'Stage cache hit for {stage}, inputs unchanged since the last run. Skipping.'
+    else:
+        message = f'Stage cache miss for {stage}, running it.'
+    logger.info(message)
+    print(message)
+    return hit
+
+
+def record_stage_run(conn, stage, fingerprint, output_tables):
+    '''
+    Records a successful run of the stage along with the fingerprint of its
+    inputs, which also becomes the fingerprint of the tables it wrote so that
+    the downstream stages can chain on it.
+    '''
+    create_cache_tables(conn)
+    conn.execute(f'INSERT INTO {DB_STAGE_CACHE_TABLE_NAME} VALUES (?, ?, 0, 1, datetime(\'now\'), NULL) '
+                 'ON CONFLICT(stage) DO UPDATE SET fingerprint = excluded.fingerprint, '
+                 'misses = misses + 1, last_run_at = excluded.last_run_at', (stage, fingerprint))
+    conn.executemany(f"INSERT OR REPLACE INTO {DB_TABLE_FINGERPRINTS_TABLE_NAME} VALUES (?, ?, datetime('now'))",
+                     [(table, fingerprint) for table in output_tables])
+    conn.commit()
+
+
+def invalidate_table_fingerprints(conn, tables):
+    '''
+    Forgets the fingerprints of the tables. Writers which are not cached stages
+    call it so that the stages which produced these tables run again.
+    '''
+    create_cache_tables(conn)
+    conn.executemany(f'DELETE FROM {DB_TABLE_FINGERPRINTS_TABLE_NAME} WHERE table_name = ?',
+                     [(table,) for table in tables])
+    conn.commit()
@@ -33,6 +33,88 @@ DB_DATA_TABLE_NAME = 'loaded_data'
 DB_MAPPING_TABLE_NAME = 'city_tier_mapped'
 DB_CAT_MAP_TABLE_NAME = 'categorical_variables_mapped'
 DB_INTER_MAP_TABLE_NAME = 'interactions_mapped'
+# cities missing from city_tier_mapping with their number of leads
+DB_UNMAPPED_CITIES_TABLE_NAME = 'unmapped_cities'
+
+# Streaming ingestion: read the raw csv in bounded chunks instead of all at once
+STREAMING_INGESTION = False
+INGESTION_CHUNK_SIZE = 50000
+
+# Fused runner: also write the intermediate mapping tables (for debugging)
+MATERIALIZE_INTERMEDIATE_TABLES = False
+
+# Partitioned execution of the fused runner: with more than one worker the
+# leads are split by PARTITION_KEY, the month of 'created_date' ('month') or
+# a hash of it into PARTITION_COUNT buckets ('hash'), and the partitions are
+# mapped in a pool of PARALLEL_WORKERS processes
+PARALLEL_WORKERS = 1
+PARTITION_KEY = 'month'
+PARTITION_COUNT = 16
+
+# Deduplication on load: the duplicate rows of the csv are dropped using one
+# 64-bit hash per row, across the chunks of a streaming load. Off by default
+# as it changes the number of rows of 'loaded_data' from the csv's. The rows
+# loaded by earlier runs never reach it, the watermark already filters them
+DEDUPLICATE_ON_LOAD = False
+
+# Level frequencies: the levels of LEVEL_COUNT_COLUMNS are counted as the
+# leads are loaded and the counts are kept in the db. With LEVEL_SKETCH_SIZE
+# set at most that many counters are kept per column (a Misra-Gries heavy
+# hitters summary) instead of exact counts. refresh_significant_levels
+# regenerates the significant levels from the counts, the most frequent
+# levels covering SIGNIFICANT_LEVEL_COVERAGE of the leads, and the mapping
+# stages use them instead of significant_categorical_level.py when
+# USE_REFRESHED_SIGNIFICANT_LEVELS is set. ONE_HOT_ENCODED_FEATURES of the
+# training and inference pipelines has to list the refreshed levels too
+TRACK_LEVEL_COUNTS = True
+LEVEL_COUNT_COLUMNS = ['first_platform_c', 'first_utm_medium_c', 'first_utm_source_c']
+LEVEL_SKETCH_SIZE = None
+SIGNIFICANT_LEVEL_COVERAGE = 0.9
+USE_REFRESHED_SIGNIFICANT_LEVELS = False
+DB_LEVEL_COUNTS_TABLE_NAME = 'level_counts'
+DB_LEVEL_TOTALS_TABLE_NAME = 'level_count_totals'
+DB_SIGNIFICANT_LEVELS_TABLE_NAME = 'significant_levels'
+
+# Incremental processing: only the leads created after the high-water mark of
+# every table flow through the pipeline, set to False for a full rebuild
+INCREMENTAL_PROCESSING = False
+DB_WATERMARK_TABLE_NAME = 'watermarks'
+
+# Stage cache: skip a stage when the fingerprint of its inputs (source file,
+# upstream tables, mappings and code) matches the one of its last run
+STAGE_CACHE_ENABLED = True
+
+# Storage backend of the data tables: 'sqlite' keeps every table in the db,
+# 'parquet' stores the tables in PARQUET_TABLES as parquet datasets under
+# PARQUET_DIRECTORY (shared with the training and inference pipelines)
+STORAGE_BACKEND = 'sqlite'
+PARQUET_DIRECTORY = '/home/database/parquet'
+PARQUET_TABLES = ['loaded_data', 'model_input', 'features', 'target', 'predictions']
+
+# Data validation: the raw csv and 'model_input' are checked against the
+# expectations in schema.py in one streamed pass of VALIDATION_CHUNK_SIZE rows
+# per chunk and the outcome is written to the validation report table. Set
+# VALIDATION_FAIL_ON_ERROR to fail the task when a column fails its checks
+DB_VALIDATION_REPORT_TABLE_NAME = 'validation_report'
+VALIDATION_CHUNK_SIZE = 50000
+VALIDATION_FAIL_ON_ERROR = False
+
+# Dtype policy: from load_data_into_db onward the columns are held in memory
+# with the dtypes below (a nullable UInt when an integer column has nulls).
+# Every other float column except created_date is an interaction count and
+# uses INTERACTION_DTYPE. A column whose values don't fit is left unchanged
+APPLY_DTYPE_POLICY = True
+DTYPE_POLICY = {
+    'city_mapped': 'category',
+    'first_platform_c': 'category',
+    'first_utm_medium_c': 'category',
+    'first_utm_source_c': 'category',
+    'city_tier': 'uint8',
+    'referred_lead': 'uint8',
+    'app_complete_flag': 'uint8',
+    'total_leads_droppped': 'uint16',
+}
+INTERACTION_DTYPE = 'uint16'
 
 #Test Properties
 UNIT_TEST_DB_PATH = '/home/Assignment/01_data_pipeline/scripts'
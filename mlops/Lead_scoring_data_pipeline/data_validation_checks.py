@@ -7,11 +7,28 @@ import pandas as pd
 # Import the schema from schema.py
 from Lead_scoring_data_pipeline.schema import *
 from Lead_scoring_data_pipeline.constants import *
+from Lead_scoring_common.storage import get_storage
+from Lead_scoring_common.sqlite_connection import get_connection
+from Lead_scoring_common.instrumentation import instrument_task
+import os
 import sqlite3
+import numpy as np
+from datetime import datetime
+
+
+def metrics_db_path():
+    '''
+    Returns the path of the db the metrics of the checks are written to, see
+    instrument_task.
+    '''
+    return os.path.join(DB_PATH, DB_FILE_NAME)
+
+
 ###############################################################################
 # Define function to validate raw data's schema
 # ############################################################################## 
 
+@instrument_task(metrics_db_path)
 def raw_data_schema_check():
     '''
     This function check if all the columns mentioned in schema.py are present in
@@ -39,15 +56,15 @@ def raw_data_schema_check():
     # Define the path to the CSV file
     csv_file_path = f"{DATA_DIRECTORY}/{DATA_FILE_NAME}"
 
-    # Load the CSV file
+    # Read only the header of the CSV file, its cost doesn't depend on the file size
     try:
-        df = pd.read_csv(csv_file_path)
+        header = pd.read_csv(csv_file_path, nrows=0)
     except FileNotFoundError:
         print(f"File not found: {csv_file_path}")
         return
 
     # Get the columns present in the CSV file
-    csv_columns = set(df.columns)
+    csv_columns = set(header.columns)
     
     # Check if all schema columns are in the CSV columns
     schema_columns = set(raw_data_schema)
@@ -65,10 +82,12 @@ def raw_data_schema_check():
 """
 
 
+@instrument_task(metrics_db_path)
 def model_input_schema_check():
     '''
     This function check if all the columns mentioned in model_input_schema in 
-    schema.py are present in table named in 'model_input' in db file.
+    schema.py are present in table named in 'model_input' in db file, or in
+    the 'model_input' parquet dataset when STORAGE_BACKEND is 'parquet'.
 
    
     INPUTS
@@ -92,18 +111,10 @@ def model_input_schema_check():
 
     # Connect to the SQLite database
     try:
-        conn = sqlite3.connect(db_file_path)
-        cursor = conn.cursor()
-
-        # Query to get the columns of the 'model_input' table
-        cursor.execute("PRAGMA table_info(model_input);")
-        columns_info = cursor.fetchall()
-
-        # Extract column names from the query result
-        db_columns = {col[1] for col in columns_info}  # col[1] is the column name
-
-        # Close the database connection
-        conn.close()
+        with get_connection(db_file_path) as conn:
+            # Get the columns of the 'model_input' table from the storage backend
+            storage = get_storage(STORAGE_BACKEND, PARQUET_DIRECTORY, PARQUET_TABLES)
+            db_columns = set(storage.columns(conn, 'model_input'))
 
     except sqlite3.Error as e:
         print(f"SQLite error: {e}")
@@ -125,3 +136,196 @@ def model_input_schema_check():
 
     
     
+
+
+"""
+###############################################################################
+# Define the streaming validation engine
+############################################################################### 
+"""
+
+
+def update_column_stats(stats, values, expectation):
+    '''
+    Adds a chunk of the values of a column to its running statistics: rows,
+    nulls, kinds of non null values seen, numeric range and the number of non
+    null values that are one of the expected levels.
+    '''
+    non_null = values.dropna()
+    stats['rows'] += len(values)
+    stats['nulls'] += len(values) - len(non_null)
+    if len(non_null) == 0:
+        return
+    stats['non_null'] += len(non_null)
+    if pd.api.types.is_numeric_dtype(non_null.dtype) and not pd.api.types.is_bool_dtype(non_null.dtype):
+        stats['kinds'].add('numeric')
+        stats['min'] = min(stats['min'], non_null.min())
+        stats['max'] = max(stats['max'], non_null.max())
+    else:
+        stats['kinds'].add('string')
+    if 'levels' in expectation:
+        stats['in_levels'] += int(non_null.isin(expectation['levels']).sum())
+
+
+def summarize_column_stats(column, stats, expectation):
+    '''
+    Compares the statistics of a column with its expectation and returns a
+    row of the validation report.
+    '''
+    issues = []
+    if stats is None:
+        issues.append('missing column')
+        stats = {'rows': 0, 'nulls': 0, 'non_null': 0, 'kinds': set(),
+                 'min': np.inf, 'max': -np.inf, 'in_levels': 0}
+
+    null_rate = stats['nulls'] / stats['rows'] if stats['rows'] else None
+    observed_dtype = '/'.join(sorted(stats['kinds'])) or 'empty'
+    numeric = stats['kinds'] == {'numeric'}
+    col_min = float(stats['min']) if numeric else None
+    col_max = float(stats['max']) if numeric else None
+    coverage = stats['in_levels'] / stats['non_null'] if 'levels' in expectation and stats['non_null'] else None
+
+    if stats['kinds'] and stats['kinds'] != {expectation['dtype']}:
+        issues.append(f"dtype {observed_dtype} instead of {expectation['dtype']}")
+    if null_rate is not None and null_rate > expectation.get('max_null_rate', 1.0):
+        issues.append(f"null rate {null_rate:.3f} above {expectation['max_null_rate']}")
+    if numeric and 'min' in expectation and col_min < expectation['min']:
+        issues.append(f"min {col_min} below {expectation['min']}")
+    if numeric and 'max' in expectation and col_max > expectation['max']:
+        issues.append(f"max {col_max} above {expectation['max']}")
+    if coverage is not None and coverage < expectation.get('min_level_coverage', 0.0):
+        issues.append(f"level coverage {coverage:.3f} below {expectation['min_level_coverage']}")
+
+    return {'column_name': column, 'expected_dtype': expectation['dtype'], 'observed_dtype': observed_dtype,
+            'rows': stats['rows'], 'null_rate': null_rate, 'min': col_min, 'max': col_max,
+            'level_coverage': coverage, 'status': 'fail' if issues else 'pass', 'issues': '; '.join(issues)}
+
+
+def validate_chunks(chunks, expectations):
+    '''
+    This function validates the data in a single pass over its chunks. Only
+    the running statistics of every expected column are kept between chunks,
+    so the memory used doesn't depend on the size of the data.
+
+
+    INPUTS
+        chunks : iterable of dataframes, e.g. pd.read_csv(..., chunksize=...)
+        expectations : dictionary mapping every expected column to its
+                       expectation, as raw_data_expectations in schema.py
+
+
+    OUTPUT
+        dataframe with one row per expected column holding its dtype, null
+        rate, range, level coverage, status ('pass' or 'fail') and issues.
+        Columns missing from the data fail with the issue 'missing column'.
+
+
+    SAMPLE USAGE
+        validate_chunks(pd.read_csv(csv_file_path, chunksize=50000), raw_data_expectations)
+    '''
+    column_stats = None
+    for chunk in chunks:
+        if column_stats is None:
+            column_stats = {column: {'rows': 0, 'nulls': 0, 'non_null': 0, 'kinds': set(),
+                                     'min': np.inf, 'max': -np.inf, 'in_levels': 0}
+                            for column in expectations if column in chunk.columns}
+        for column, stats in column_stats.items():
+            update_column_stats(stats, chunk[column], expectations[column])
+    column_stats = column_stats or {}
+    return pd.DataFrame([summarize_column_stats(column, column_stats.get(column), expectation)
+                         for column, expectation in expectations.items()])
+
+
+def write_validation_report(report, dataset):
+    '''
+    Replaces the rows of the dataset in the validation report table with the
+    report, prints a summary and raises a ValueError if a column failed and
+    VALIDATION_FAIL_ON_ERROR is set.
+    '''
+    report = report.assign(dataset=dataset, validated_at=datetime.now().isoformat(timespec='seconds'))
+    with get_connection(f"{DB_PATH}/{DB_FILE_NAME}") as conn:
+        conn.execute(f'CREATE TABLE IF NOT EXISTS {DB_VALIDATION_REPORT_TABLE_NAME} '
+                     '(column_name TEXT, expected_dtype TEXT, observed_dtype TEXT, rows INTEGER, '
+                     'null_rate REAL, min REAL, max REAL, level_coverage REAL, status TEXT, '
+                     'issues TEXT, dataset TEXT, validated_at TEXT)')
+        conn.execute(f'DELETE FROM {DB_VALIDATION_REPORT_TABLE_NAME} WHERE dataset = ?', (dataset,))
+        report.to_sql(DB_VALIDATION_REPORT_TABLE_NAME, conn, if_exists='append', index=False)
+
+    failed = report[report['status'] == 'fail']
+    print(f"{dataset} validation: {len(failed)} of {len(report)} columns failed, "
+          f"report saved to {DB_VALIDATION_REPORT_TABLE_NAME} table.")
+    for row in failed.itertuples():
+        print(f"  {row.column_name}: {row.issues}")
+    if VALIDATION_FAIL_ON_ERROR and len(failed):
+        raise ValueError(f"{len(failed)} column(s) of {dataset} failed validation")
+    return report
+
+
+"""
+###############################################################################
+# Define functions to validate the raw data and the model's input
+############################################################################### 
+"""
+
+
+@instrument_task(metrics_db_path)
+def raw_data_validation():
+    '''
+    This function validates leadscoring.csv against raw_data_expectations in
+    schema.py. The header is checked first, then the file is streamed in
+    chunks of VALIDATION_CHUNK_SIZE rows to compute the dtype, null rate,
+    range and level coverage of every column.
+
+
+    INPUTS
+        DATA_DIRECTORY : path of the directory where 'leadscoring.csv'
+                        file is present
+        raw_data_expectations : expectations of every column as present in
+                                'schema.py'
+
+    OUTPUT
+        Writes the report in the validation report table with dataset
+        'raw_data', prints the columns that failed and returns the report.
+
+
+    SAMPLE USAGE
+        raw_data_validation()
+    '''
+    csv_file_path = f"{DATA_DIRECTORY}/{DATA_FILE_NAME}"
+    raw_data_schema_check()
+    report = validate_chunks(pd.read_csv(csv_file_path, chunksize=VALIDATION_CHUNK_SIZE),
+                             raw_data_expectations)
+    return write_validation_report(report, 'raw_data')
+
+
+@instrument_task(metrics_db_path)
+def model_input_validation():
+    '''
+    This function validates the 'model_input' table against
+    model_input_expectations in schema.py. The column names are checked first,
+    then the table is streamed in chunks of VALIDATION_CHUNK_SIZE rows from the
+    storage backend to compute the statistics of every column.
+
+
+    INPUTS
+        DB_FILE_NAME : Name of the database file
+        DB_PATH : path where the db file should be present
+        model_input_expectations : expectations of every column as present in
+                                   'schema.py'
+
+    OUTPUT
+        Writes the report in the validation report table with dataset
+        'model_input', prints the columns that failed and returns the report.
+
+
+    SAMPLE USAGE
+        model_input_validation()
+    '''
+    model_input_schema_check()
+    storage = get_storage(STORAGE_BACKEND, PARQUET_DIRECTORY, PARQUET_TABLES)
+    with get_connection(f"{DB_PATH}/{DB_FILE_NAME}") as conn:
+        columns = [column for column in model_input_expectations
+                   if column in storage.columns(conn, 'model_input')]
+        report = validate_chunks(storage.read_chunks(conn, 'model_input', VALIDATION_CHUNK_SIZE, columns),
+                                 model_input_expectations)
+    return write_validation_report(report, 'model_input')
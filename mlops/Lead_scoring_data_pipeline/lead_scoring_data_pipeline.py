@@ -7,8 +7,7 @@ from airflow import DAG
 from airflow.operators.python import PythonOperator
 
 from datetime import datetime, timedelta
-from Lead_scoring_data_pipeline.utils import *
-from Lead_scoring_data_pipeline.data_validation_checks import *
+from Lead_scoring_data_pipeline.tasks import *
 
 ###############################################################################
 # Define default arguments and DAG
@@ -50,6 +49,17 @@ raw_data_schema_check_task = PythonOperator(
 )
 
 
+###############################################################################
+# Create a task for raw_data_validation() function with task_id 'validating_raw_data'
+# ##############################################################################
+raw_data_validation_task = PythonOperator(
+    task_id='validating_raw_data',
+    python_callable=raw_data_validation,
+    dag=ML_data_cleaning_dag
+)
+
+
+
 ###############################################################################
 # Create a task for load_data_into_db() function with task_id 'loading_data'
 # #############################################################################
@@ -101,11 +111,22 @@ model_input_schema_check_task = PythonOperator(
 )
 
 
+###############################################################################
+# Create a task for model_input_validation() function with task_id 'validating_model_inputs'
+# ##############################################################################
+model_input_validation_task = PythonOperator(
+    task_id='validating_model_inputs',
+    python_callable=model_input_validation,
+    dag=ML_data_cleaning_dag
+)
+
+
 
 ###############################################################################
 # Define the relation between the tasks
 # ##############################################################################
-build_dbs_task >> raw_data_schema_check_task >> load_data_into_db_task
+build_dbs_task >> raw_data_schema_check_task >> raw_data_validation_task >> load_data_into_db_task
 load_data_into_db_task >> map_city_tier_task >> map_categorical_vars_task
 map_categorical_vars_task >> interactions_mapping_task >> model_input_schema_check_task
+model_input_schema_check_task >> model_input_validation_task
 
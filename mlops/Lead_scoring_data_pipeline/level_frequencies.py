@@ -0,0 +1,229 @@
+'''
+filename: level_frequencies.py
+functions: count_levels, merge_level_counts, update_level_counts, read_level_counts,
+           select_significant_levels, refresh_significant_levels, load_significant_levels,
+           current_significant_levels
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import pandas as pd
+
+from Lead_scoring_data_pipeline.mapping.significant_categorical_level import significant_levels
+from Lead_scoring_data_pipeline.constants import (
+    LEVEL_COUNT_COLUMNS,
+    LEVEL_SKETCH_SIZE,
+    SIGNIFICANT_LEVEL_COVERAGE,
+    USE_REFRESHED_SIGNIFICANT_LEVELS,
+    DB_LEVEL_COUNTS_TABLE_NAME,
+    DB_LEVEL_TOTALS_TABLE_NAME,
+    DB_SIGNIFICANT_LEVELS_TABLE_NAME
+)
+
+
+###############################################################################
+# Define functions to count the levels of the categorical columns
+# ##############################################################################
+
+def count_levels(values):
+    '''
+    Returns the number of occurrences of every non null level of the values as
+    an int64 series indexed by the level, most frequent first.
+    '''
+    counts = values.value_counts(dropna=True)
+    counts = counts[counts > 0]
+    counts.index = counts.index.astype(str)
+    return counts.astype('int64')
+
+
+def merge_level_counts(counts, new_counts, sketch_size=None):
+    '''
+    Adds the new counts to the counts. With a sketch size the result is a
+    Misra-Gries summary of at most 'sketch_size' counters: the (sketch_size+1)th
+    largest count is subtracted from every counter and the counters that are no
+    longer positive are dropped. Every count then underestimates the true
+    count of its level by at most the sum of the decrements, which is at most
+    total / (sketch_size + 1), so every level more frequent than that is kept.
+
+
+    INPUTS
+        counts : counts of the levels seen so far, indexed by level
+        new_counts : counts of the levels of the new rows, indexed by level
+        sketch_size : maximum number of counters kept, or None for exact counts
+
+
+    OUTPUT
+        tuple (merged counts, decrement) where decrement is the value that was
+        subtracted from the counters, 0 for exact counts
+
+
+    SAMPLE USAGE
+        counts, decrement = merge_level_counts(counts, count_levels(df['first_platform_c']), 100)
+    '''
+    merged = counts.add(new_counts, fill_value=0).astype('int64')
+    if sketch_size is None or len(merged) <= sketch_size:
+        return merged, 0
+    decrement = int(merged.nlargest(sketch_size + 1).iloc[-1])
+    merged = merged - decrement
+    return merged[merged > 0], decrement
+
+
+def update_level_counts(conn, df, reset=False, columns=LEVEL_COUNT_COLUMNS, sketch_size=LEVEL_SKETCH_SIZE):
+    '''
+    This function adds the levels of the new rows to the level counts kept in
+    the db, so that the frequencies of the levels over all the leads ingested
+    are known without scanning them again. Only the counts of the levels
+    present in the new rows are read and written.
+
+
+    INPUTS
+        conn : open sqlite3 connection to the database
+        df : new rows, as they are loaded into 'loaded_data'
+        reset : if True the counts of the columns are dropped first, e.g. when
+                'loaded_data' is rebuilt
+        columns : categorical columns whose levels are counted. Defaults to
+                  LEVEL_COUNT_COLUMNS
+        sketch_size : maximum number of counters kept per column, see
+                      merge_level_counts, or None for exact counts. Defaults
+                      to LEVEL_SKETCH_SIZE
+
+
+    OUTPUT
+        Updates the counts in the level counts table and the number of rows,
+        non null rows and maximum error of every column in the level totals
+        table.
+
+
+    SAMPLE USAGE
+        update_level_counts(conn, df, reset=watermark is None)
+    '''
+    conn.execute(f'CREATE TABLE IF NOT EXISTS {DB_LEVEL_COUNTS_TABLE_NAME} '
+                 '(column_name TEXT, level TEXT, count INTEGER, PRIMARY KEY (column_name, level)) WITHOUT ROWID')
+    conn.execute(f'CREATE TABLE IF NOT EXISTS {DB_LEVEL_TOTALS_TABLE_NAME} '
+                 '(column_name TEXT PRIMARY KEY, rows INTEGER, non_null INTEGER, max_error INTEGER)')
+    for column in columns:
+        if column not in df.columns:
+            continue
+        if reset:
+            conn.execute(f'DELETE FROM {DB_LEVEL_COUNTS_TABLE_NAME} WHERE column_name = ?', (column,))
+            conn.execute(f'DELETE FROM {DB_LEVEL_TOTALS_TABLE_NAME} WHERE column_name = ?', (column,))
+
+        new_counts = count_levels(df[column])
+        if sketch_size is None:
+            decrement = 0
+            conn.executemany(f'INSERT INTO {DB_LEVEL_COUNTS_TABLE_NAME} VALUES (?, ?, ?) '
+                             'ON CONFLICT(column_name, level) DO UPDATE SET count = count + excluded.count',
+                             ((column, level, count) for level, count in zip(new_counts.index, new_counts.tolist())))
+        else:
+            counts, decrement = merge_level_counts(read_level_counts(conn, column), new_counts, sketch_size)
+            conn.execute(f'DELETE FROM {DB_LEVEL_COUNTS_TABLE_NAME} WHERE column_name = ?', (column,))
+            conn.executemany(f'INSERT INTO {DB_LEVEL_COUNTS_TABLE_NAME} VALUES (?, ?, ?)',
+                             ((column, level, count) for level, count in zip(counts.index, counts.tolist())))
+
+        conn.execute(f'INSERT INTO {DB_LEVEL_TOTALS_TABLE_NAME} VALUES (?, ?, ?, ?) '
+                     'ON CONFLICT(column_name) DO UPDATE SET rows = rows + excluded.rows, '
+                     'non_null = non_null + excluded.non_null, max_error = max_error + excluded.max_error',
+                     (column, len(df), int(new_counts.sum()), decrement))
+
+
+def read_level_counts(conn, column):
+    '''
+    Returns the counts of the levels of the column kept in the db as an int64
+    series indexed by the level, empty if the column was never counted.
+    '''
+    counts = pd.read_sql(f'SELECT level, count FROM {DB_LEVEL_COUNTS_TABLE_NAME} WHERE column_name = ?',
+                         conn, params=(column,))
+    return pd.Series(counts['count'].to_numpy(), index=counts['level'].astype(str), dtype='int64')
+
+
+###############################################################################
+# Define functions to regenerate the significant levels
+# ##############################################################################
+
+def select_significant_levels(counts, total, coverage=SIGNIFICANT_LEVEL_COVERAGE):
+    '''
+    Returns the most frequent levels whose cumulative share of the 'total'
+    non null rows is at most 'coverage', the rule used in the data cleaning
+    notebook to build the lists of significant_categorical_level.py. Levels
+    with the same count are taken in the order of their names.
+    '''
+    if total == 0:
+        return []
+    shares = (counts.sort_index().sort_values(ascending=False, kind='stable') / total).cumsum()
+    return list(shares[shares <= coverage].index)
+
+
+def refresh_significant_levels(conn, coverage=SIGNIFICANT_LEVEL_COVERAGE, columns=LEVEL_COUNT_COLUMNS):
+    '''
+    This function regenerates the significant levels of the categorical
+    columns from the level counts kept in the db, without reading the leads,
+    and saves them in the significant levels table where the mapping stages
+    pick them up when USE_REFRESHED_SIGNIFICANT_LEVELS is set. The levels
+    added to and dropped from the lists of significant_categorical_level.py
+    are printed.
+
+
+    INPUTS
+        conn : open sqlite3 connection to the database
+        coverage : cumulative share of the leads covered by the significant
+                   levels. Defaults to SIGNIFICANT_LEVEL_COVERAGE
+        columns : categorical columns whose levels are refreshed. Defaults to
+                  LEVEL_COUNT_COLUMNS
+
+
+    OUTPUT
+        dictionary mapping each column that has counts to the list of its
+        significant levels, most frequent first
+
+
+    SAMPLE USAGE
+        with get_connection(os.path.join(DB_PATH, DB_FILE_NAME)) as conn:
+            refresh_significant_levels(conn)
+    '''
+    totals = dict(conn.execute(f'SELECT column_name, non_null FROM {DB_LEVEL_TOTALS_TABLE_NAME}').fetchall())
+    conn.execute(f'CREATE TABLE IF NOT EXISTS {DB_SIGNIFICANT_LEVELS_TABLE_NAME} '
+                 '(column_name TEXT, level TEXT, rank INTEGER, refreshed_at TEXT, PRIMARY KEY (column_name, level))')
+    levels = {}
+    for column in columns:
+        if column not in totals:
+            continue
+        levels[column] = select_significant_levels(read_level_counts(conn, column), totals[column], coverage)
+        conn.execute(f'DELETE FROM {DB_SIGNIFICANT_LEVELS_TABLE_NAME} WHERE column_name = ?', (column,))
+        conn.executemany(f'INSERT INTO {DB_SIGNIFICANT_LEVELS_TABLE_NAME} VALUES (?, ?, ?, datetime(\'now\'))',
+                         ((column, level, rank) for rank, level in enumerate(levels[column])))
+
+        previous = significant_levels.get(column, [])
+        added = [level for level in levels[column] if level not in previous]
+        dropped = [level for level in previous if level not in levels[column]]
+        print(f"{column}: {len(levels[column])} significant levels, added {added}, dropped {dropped}.")
+    return levels
+
+
+def load_significant_levels(conn, default=significant_levels):
+    '''
+    Returns the significant levels saved by refresh_significant_levels, with
+    the levels of 'default' for the columns that were never refreshed.
+    '''
+    levels = dict(default)
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
+                          (DB_SIGNIFICANT_LEVELS_TABLE_NAME,)).fetchone()
+    if exists is None:
+        return levels
+    rows = conn.execute(f'SELECT column_name, level FROM {DB_SIGNIFICANT_LEVELS_TABLE_NAME} '
+                        'ORDER BY column_name, rank').fetchall()
+    refreshed = {}
+    for column, level in rows:
+        refreshed.setdefault(column, []).append(level)
+    levels.update(refreshed)
+    return levels
+
+
+def current_significant_levels(conn, refreshed=USE_REFRESHED_SIGNIFICANT_LEVELS):
+    '''
+    Returns the significant levels the mapping stages collapse the categorical
+    columns with: the refreshed levels kept in the db if 'refreshed' is True,
+    else the lists of significant_categorical_level.py.
+    '''
+    return load_significant_levels(conn) if refreshed else significant_levels
@@ -1,3 +1,6 @@
+from Lead_scoring_data_pipeline.mapping.significant_categorical_level import significant_levels
+
+
 raw_data_schema = ['created_date', 'city_mapped', 'first_platform_c',
            'first_utm_medium_c', 'first_utm_source_c', 'total_leads_droppped',
            'referred_lead', '1_on_1_industry_mentorship', 'call_us_button_clicked',
@@ -21,3 +24,45 @@ raw_data_schema = ['created_date', 'city_mapped', 'first_platform_c',
 model_input_schema = ['total_leads_droppped', 'city_tier', 'referred_lead', 
                     'first_platform_c', 'first_utm_medium_c', 'first_utm_source_c', 
                     'app_complete_flag']
+
+
+# Expectations checked by the streaming validation pass, per column:
+#   dtype : 'numeric' or 'string'
+#   max_null_rate : highest share of null values allowed
+#   min / max : range of the values of a numeric column
+#   levels / min_level_coverage : lowest share of the non null values of a
+#                                 categorical column that must be one of levels
+raw_data_expectations = {
+    column: {'dtype': 'numeric', 'max_null_rate': 1.0, 'min': 0}
+    for column in raw_data_schema
+}
+raw_data_expectations.update({
+    'created_date': {'dtype': 'string', 'max_null_rate': 0.0},
+    'city_mapped': {'dtype': 'string', 'max_null_rate': 0.2},
+    'first_platform_c': {'dtype': 'string', 'max_null_rate': 0.0,
+                         'levels': significant_levels['first_platform_c'], 'min_level_coverage': 0.5},
+    'first_utm_medium_c': {'dtype': 'string', 'max_null_rate': 0.0,
+                           'levels': significant_levels['first_utm_medium_c'], 'min_level_coverage': 0.5},
+    'first_utm_source_c': {'dtype': 'string', 'max_null_rate': 0.0,
+                           'levels': significant_levels['first_utm_source_c'], 'min_level_coverage': 0.5},
+    'total_leads_droppped': {'dtype': 'numeric', 'max_null_rate': 0.05, 'min': 0},
+    'referred_lead': {'dtype': 'numeric', 'max_null_rate': 0.05, 'min': 0, 'max': 1},
+    'app_complete_flag': {'dtype': 'numeric', 'max_null_rate': 0.0, 'min': 0, 'max': 1},
+})
+
+
+model_input_expectations = {
+    'total_leads_droppped': {'dtype': 'numeric', 'max_null_rate': 0.0, 'min': 0},
+    'city_tier': {'dtype': 'numeric', 'max_null_rate': 0.0, 'min': 1, 'max': 3},
+    'referred_lead': {'dtype': 'numeric', 'max_null_rate': 0.0, 'min': 0, 'max': 1},
+    'first_platform_c': {'dtype': 'string', 'max_null_rate': 0.0,
+                         'levels': significant_levels['first_platform_c'] + ['others'],
+                         'min_level_coverage': 1.0},
+    'first_utm_medium_c': {'dtype': 'string', 'max_null_rate': 0.0,
+                           'levels': significant_levels['first_utm_medium_c'] + ['others'],
+                           'min_level_coverage': 1.0},
+    'first_utm_source_c': {'dtype': 'string', 'max_null_rate': 0.0,
+                           'levels': significant_levels['first_utm_source_c'] + ['others'],
+                           'min_level_coverage': 1.0},
+    'app_complete_flag': {'dtype': 'numeric', 'max_null_rate': 0.0, 'min': 0, 'max': 1},
+}
@@ -0,0 +1,29 @@
+'''
+filename: tasks.py
+functions: build_dbs, raw_data_schema_check, raw_data_validation, load_data_into_db, map_city_tier,
+           map_categorical_vars, interactions_mapping, model_input_schema_check, model_input_validation
+The callables of the tasks of lead_scoring_data_pipeline.py. They import utils
+and data_validation_checks, and pandas with them, only when a task runs, so
+that parsing the DAG file stays fast (see lazy_task).
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+from Lead_scoring_common.lazy_tasks import lazy_task
+
+
+###############################################################################
+# Define the callables of the tasks
+# ##############################################################################
+
+build_dbs = lazy_task('Lead_scoring_data_pipeline.utils', 'build_dbs')
+raw_data_schema_check = lazy_task('Lead_scoring_data_pipeline.data_validation_checks', 'raw_data_schema_check')
+raw_data_validation = lazy_task('Lead_scoring_data_pipeline.data_validation_checks', 'raw_data_validation')
+load_data_into_db = lazy_task('Lead_scoring_data_pipeline.utils', 'load_data_into_db')
+map_city_tier = lazy_task('Lead_scoring_data_pipeline.utils', 'map_city_tier')
+map_categorical_vars = lazy_task('Lead_scoring_data_pipeline.utils', 'map_categorical_vars')
+interactions_mapping = lazy_task('Lead_scoring_data_pipeline.utils', 'interactions_mapping')
+model_input_schema_check = lazy_task('Lead_scoring_data_pipeline.data_validation_checks', 'model_input_schema_check')
+model_input_validation = lazy_task('Lead_scoring_data_pipeline.data_validation_checks', 'model_input_validation')
@@ -4,11 +4,24 @@
 
 
 import pandas as pd
+import numpy as np
 import os
 import sqlite3
+from concurrent.futures import ProcessPoolExecutor
 from sqlite3 import Error
 from Lead_scoring_data_pipeline.mapping.city_tier_mapping import city_tier_mapping
 from Lead_scoring_data_pipeline.mapping.significant_categorical_level import *
+from Lead_scoring_common.stage_cache import (
+    file_fingerprint,
+    compute_fingerprint,
+    get_table_fingerprint,
+    is_stage_cached,
+    record_stage_run
+)
+from Lead_scoring_common.storage import get_storage
+from Lead_scoring_common.sqlite_connection import connect, get_connection
+from Lead_scoring_common.instrumentation import instrument_task, record_io
+from Lead_scoring_data_pipeline.level_frequencies import update_level_counts, current_significant_levels
 
 from Lead_scoring_data_pipeline.constants import (
     DB_PATH,
@@ -19,15 +32,49 @@ from Lead_scoring_data_pipeline.constants import (
     DB_MAPPING_TABLE_NAME,
     DB_CAT_MAP_TABLE_NAME,
     DB_INTER_MAP_TABLE_NAME,
+    DB_UNMAPPED_CITIES_TABLE_NAME,
+    STREAMING_INGESTION,
+    INGESTION_CHUNK_SIZE,
+    DEDUPLICATE_ON_LOAD,
+    TRACK_LEVEL_COUNTS,
+    MATERIALIZE_INTERMEDIATE_TABLES,
+    PARALLEL_WORKERS,
+    PARTITION_KEY,
+    PARTITION_COUNT,
+    INCREMENTAL_PROCESSING,
+    DB_WATERMARK_TABLE_NAME,
+    STAGE_CACHE_ENABLED,
+    STORAGE_BACKEND,
+    PARQUET_DIRECTORY,
+    PARQUET_TABLES,
+    APPLY_DTYPE_POLICY,
+    DTYPE_POLICY,
+    INTERACTION_DTYPE,
     INTERACTION_MAPPING,
     INDEX_COLUMNS_TRAINING,
     INDEX_COLUMNS_INFERENCE,
     NOT_FEATURES
 )
+
+# version of the code of the stages, part of the fingerprint of every stage
+CODE_VERSION = file_fingerprint(__file__)
+
+# backend the data tables are read from and written to, see STORAGE_BACKEND
+STORAGE = get_storage(STORAGE_BACKEND, PARQUET_DIRECTORY, PARQUET_TABLES)
+
+
+def metrics_db_path():
+    '''
+    Returns the path of the db the metrics of the tasks are written to, see
+    instrument_task.
+    '''
+    return os.path.join(DB_PATH, DB_FILE_NAME)
+
 ###############################################################################
 # Define the function to build database
 # ##############################################################################
 
+@instrument_task(metrics_db_path)
 def build_dbs():
     '''
     This function checks if the db file with specified name is present 
@@ -65,18 +112,301 @@ def build_dbs():
     else:
         print('Creating Database')
         # Create the database file
-        conn = sqlite3.connect(db_full_path)
-        conn.close()
+        connect(db_full_path).close()
         print('New DB Created')
         return 'DB created'
     
     
 
+###############################################################################
+# Define functions to apply the dtype policy
+# ##############################################################################
+
+def to_unsigned(values, dtype):
+    '''
+    Converts the values to the unsigned integer dtype, or to its nullable
+    variant if they have nulls. The values are returned unchanged if they are
+    not all non negative integers that fit in the dtype.
+    '''
+    non_null = values.dropna()
+    if len(non_null):
+        if not pd.api.types.is_numeric_dtype(non_null.dtype):
+            return values
+        if non_null.min() < 0 or non_null.max() > np.iinfo(dtype).max or (non_null % 1 != 0).any():
+            return values
+    if len(non_null) < len(values):
+        return values.astype(dtype.replace('uint', 'UInt'))
+    return values.astype(dtype)
+
+
+def apply_dtype_policy(df, policy=DTYPE_POLICY, interaction_dtype=INTERACTION_DTYPE):
+    '''
+    Returns the dataframe with the dtypes of the dtype policy: the columns in
+    'policy' are converted to their dtype and every other float column except
+    'created_date' is an interaction count converted to 'interaction_dtype'.
+
+
+    INPUTS
+        df : dataframe read from the csv file or from one of the tables
+        policy : dictionary mapping columns to 'category' or to an unsigned
+                 integer dtype. Defaults to DTYPE_POLICY
+        interaction_dtype : unsigned integer dtype of the interaction counts.
+                            Defaults to INTERACTION_DTYPE
+
+
+    OUTPUT
+        dataframe with the converted columns
+
+
+    SAMPLE USAGE
+        apply_dtype_policy(pd.read_csv(csv_file_path))
+    '''
+    converted = {}
+    for column in df.columns:
+        dtype = policy.get(column)
+        if dtype is None and column != 'created_date' and pd.api.types.is_float_dtype(df[column].dtype):
+            dtype = interaction_dtype
+        if dtype is None or str(df[column].dtype).lower() == dtype:
+            continue
+        if dtype == 'category':
+            converted[column] = df[column].astype('category')
+        else:
+            converted[column] = to_unsigned(df[column], dtype)
+    return df.assign(**converted) if converted else df
+
+
+def enforce_dtype_policy(df, description):
+    '''
+    Applies the dtype policy to the dataframe if APPLY_DTYPE_POLICY is set and
+    prints its memory usage before and after.
+    '''
+    if not APPLY_DTYPE_POLICY:
+        return df
+    before = df.memory_usage(deep=True).sum()
+    df = apply_dtype_policy(df)
+    after = df.memory_usage(deep=True).sum()
+    print(f"{description}: {before / 2**20:.2f} MiB before and {after / 2**20:.2f} MiB after the dtype policy.")
+    return df
+
+
+###############################################################################
+# Define functions to keep track of the leads that are already processed
+# ##############################################################################
+
+def table_exists(conn, table_name):
+    '''
+    Returns True if a table named 'table_name' is present in the storage
+    backend.
+    '''
+    return STORAGE.exists(conn, table_name)
+
+
+def get_watermark(conn, table_name):
+    '''
+    Returns the high-water mark of 'table_name', which is the latest
+    'created_date' the table holds, as recorded in the watermark table. None
+    is returned if the table or its mark doesn't exist yet, in which case the
+    table has to be built from scratch.
+    '''
+    watermarks = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
+                              (DB_WATERMARK_TABLE_NAME,)).fetchone()
+    if watermarks is None or not table_exists(conn, table_name):
+        return None
+    query = f'SELECT high_water_mark FROM {DB_WATERMARK_TABLE_NAME} WHERE table_name = ?'
+    row = conn.execute(query, (table_name,)).fetchone()
+    return row[0] if row else None
+
+
+def update_watermark(conn, table_name):
+    '''
+    Records the latest 'created_date' present in 'table_name' as its
+    high-water mark. In the db 'created_date' is indexed so that the mark and
+    the leads newer than it are looked up without scanning the table. The
+    watermarks themselves are always kept in the db.
+    '''
+    STORAGE.create_index(conn, table_name, 'created_date')
+    high_water_mark = STORAGE.max_value(conn, table_name, 'created_date')
+    conn.execute(f'CREATE TABLE IF NOT EXISTS {DB_WATERMARK_TABLE_NAME} '
+                 '(table_name TEXT PRIMARY KEY, high_water_mark TEXT, updated_at TEXT)')
+    conn.execute(f'INSERT OR REPLACE INTO {DB_WATERMARK_TABLE_NAME} VALUES (?, ?, datetime(\'now\'))',
+                 (table_name, high_water_mark))
+    conn.commit()
+
+
+def read_new_rows(conn, table_name, watermark):
+    '''
+    Reads the rows of 'table_name' whose 'created_date' is newer than the
+    watermark, or the whole table if the watermark is None. The dtype policy
+    is enforced on the rows read.
+    '''
+    df = STORAGE.read(conn, table_name, created_after=watermark)
+    return enforce_dtype_policy(df, f"Read {len(df)} rows of {table_name}")
+
+
+def write_new_rows(conn, df, table_name, watermark):
+    '''
+    Appends the dataframe to 'table_name' if a watermark is given, else
+    replaces the table with it, and then moves the watermark of the table.
+    '''
+    if APPLY_DTYPE_POLICY:
+        df = apply_dtype_policy(df)
+    if_exists = 'replace' if watermark is None else 'append'
+    STORAGE.write(conn, df, table_name, if_exists)
+    update_watermark(conn, table_name)
+
+
 ###############################################################################
 # Define function to load the csv file to the database
 # ############################################################################## 
 
-def load_data_into_db():
+def fill_null_lead_counts(df):
+    '''
+    Replaces the null values present in 'total_leads_droppped' and 'referred_lead'
+    columns with 0 and returns the dataframe.
+    '''
+    df['total_leads_droppped'] = df['total_leads_droppped'].fillna(0)
+    df['referred_lead'] = df['referred_lead'].fillna(0)
+    return df
+
+
+###############################################################################
+# Define functions to drop duplicate rows by their fingerprint
+# ##############################################################################
+
+def row_hashes(df):
+    '''
+    Returns a uint64 array with a 64-bit hash of every row of the dataframe.
+    The rows are normalized first so that the hash only depends on their
+    values: the columns are taken in sorted order, numeric columns are hashed
+    as float64 (nulls as NaN) and string and categorical columns by value.
+    '''
+    normalized = {}
+    for column in sorted(df.columns):
+        values = df[column]
+        if pd.api.types.is_numeric_dtype(values.dtype):
+            values = values.to_numpy(dtype='float64', na_value=np.nan)
+        else:
+            values = values.array
+        normalized[column] = values
+    normalized = pd.DataFrame(normalized, copy=False)
+    return pd.util.hash_pandas_object(normalized, index=False).to_numpy()
+
+
+def drop_duplicate_rows(df, conn=None, reset=False):
+    '''
+    This function drops the duplicate rows of the dataframe using one 64-bit
+    hash per row instead of comparing the rows column by column. With a
+    connection the hashes of the rows kept are also recorded in a temporary
+    table of the connection, and the rows whose hash was recorded by an
+    earlier call are dropped too, so that the chunks of a streaming load are
+    deduplicated against each other without holding the earlier chunks. Only
+    the hashes of the new rows are looked up in the table, through its
+    primary key. The first occurrence of a row is kept, as drop_duplicates
+    does.
+
+
+    INPUTS
+        df : dataframe to deduplicate
+        conn : open sqlite3 connection, or None to only drop the duplicates
+               within the dataframe
+        reset : if True the hashes recorded on the connection are forgotten
+                first, e.g. at the first chunk of a load
+
+
+    OUTPUT
+        dataframe without the duplicate rows
+
+
+    SAMPLE USAGE
+        df = drop_duplicate_rows(df)
+        chunk = drop_duplicate_rows(chunk, conn, reset=chunks == 1)
+    '''
+    hashes = row_hashes(df)
+    keep = ~pd.Index(hashes).duplicated()
+    if conn is not None:
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS load_row_hashes (row_hash INTEGER PRIMARY KEY) WITHOUT ROWID')
+        if reset:
+            conn.execute('DELETE FROM temp.load_row_hashes')
+
+        # sqlite integers are signed, so the hashes are stored as int64
+        new_hashes = hashes[keep].view('int64')
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS batch_row_hashes (row_hash INTEGER PRIMARY KEY)')
+        conn.executemany('INSERT INTO batch_row_hashes VALUES (?)', ((h,) for h in new_hashes.tolist()))
+        seen = conn.execute('SELECT b.row_hash FROM batch_row_hashes b JOIN temp.load_row_hashes s '
+                            'ON s.row_hash = b.row_hash').fetchall()
+        conn.execute('INSERT OR IGNORE INTO temp.load_row_hashes SELECT row_hash FROM batch_row_hashes')
+        conn.execute('DROP TABLE batch_row_hashes')
+        if seen:
+            keep[keep] = ~np.isin(new_hashes, np.array([row[0] for row in seen], dtype='int64'))
+    return df[keep]
+
+
+def load_data_in_chunks(csv_file_path, conn, table_name, chunksize, watermark=None,
+                        deduplicate=DEDUPLICATE_ON_LOAD):
+    '''
+    This function streams the csv file into the given table chunk by chunk so
+    that only one chunk of the file is held in memory at a time. The table is
+    replaced atomically by the storage backend, so readers either see the
+    previous table or the fully loaded one. If a watermark is given the table
+    is kept and only the leads created after the watermark are appended.
+
+
+    INPUTS
+        csv_file_path : path of the csv file to be loaded
+        conn : open sqlite3 connection to the database
+        table_name : name of the table the rows are written to
+        chunksize : number of csv rows read and written per chunk
+        watermark : 'created_date' of the latest lead already in the table, or
+                    None to rebuild the table from scratch
+        deduplicate : if True the duplicate rows of the csv, within a chunk or
+                      across chunks, are dropped (see drop_duplicate_rows).
+                      Defaults to DEDUPLICATE_ON_LOAD
+
+
+    OUTPUT
+        Returns a tuple (rows, chunks) with the number of rows and chunks loaded.
+
+
+    SAMPLE USAGE
+        rows, chunks = load_data_in_chunks(csv_file_path, conn, 'loaded_data', 50000)
+    '''
+    chunks, duplicates = 0, 0
+    memory_before, memory_after = 0, 0
+
+    def read_chunks():
+        nonlocal chunks, duplicates, memory_before, memory_after
+        for chunk in pd.read_csv(csv_file_path, chunksize=chunksize):
+            chunks += 1
+            record_io(read=chunk)
+            chunk = fill_null_lead_counts(chunk)
+            if watermark is not None:
+                chunk = chunk[chunk['created_date'] > watermark]
+            if deduplicate:
+                rows_read = len(chunk)
+                chunk = drop_duplicate_rows(chunk, conn, reset=chunks == 1)
+                duplicates += rows_read - len(chunk)
+            if TRACK_LEVEL_COUNTS:
+                update_level_counts(conn, chunk, reset=watermark is None and chunks == 1)
+            if APPLY_DTYPE_POLICY:
+                memory_before += chunk.memory_usage(deep=True).sum()
+                chunk = apply_dtype_policy(chunk)
+                memory_after += chunk.memory_usage(deep=True).sum()
+            yield chunk
+
+    if_exists = 'replace' if watermark is None else 'append'
+    rows = STORAGE.write_chunks(conn, read_chunks(), table_name, if_exists)
+    if APPLY_DTYPE_POLICY:
+        print(f"Loaded chunks: {memory_before / 2**20:.2f} MiB before and "
+              f"{memory_after / 2**20:.2f} MiB after the dtype policy.")
+    if deduplicate:
+        conn.execute('DROP TABLE IF EXISTS temp.load_row_hashes')
+        print(f"Dropped {duplicates} duplicate row(s) of {table_name}.")
+    return rows, chunks
+
+
+@instrument_task(metrics_db_path)
+def load_data_into_db(streaming=STREAMING_INGESTION, chunksize=INGESTION_CHUNK_SIZE,
+                      incremental=INCREMENTAL_PROCESSING, deduplicate=DEDUPLICATE_ON_LOAD):
     '''
     Thie function loads the data present in data directory into the db
     which was created previously.
@@ -89,16 +419,32 @@ def load_data_into_db():
         DB_PATH : path where the db file should be
         DATA_DIRECTORY : path of the directory where 'leadscoring.csv' 
                         file is present
-        
+        streaming : if True the csv file is read and written in chunks of
+                    'chunksize' rows so that memory stays flat irrespective
+                    of the file size. Defaults to STREAMING_INGESTION
+        chunksize : number of rows per chunk in streaming mode. Defaults to
+                    INGESTION_CHUNK_SIZE
+        incremental : if True only the leads created after the high-water mark
+                      of 'loaded_data' are appended to it, else the table is
+                      rebuilt. Defaults to INCREMENTAL_PROCESSING
+        deduplicate : if True the duplicate rows of the csv are dropped
+                      (see drop_duplicate_rows). Defaults to
+                      DEDUPLICATE_ON_LOAD
+
 
     OUTPUT
         Saves the processed dataframe in the db in a table named 'loaded_data'.
         If the table with the same name already exsists then the function 
-        replaces it.
+        replaces it, or appends the new leads to it in incremental mode.
+        Returns a tuple (rows, chunks) with the number of rows and chunks loaded,
+        which is (0, 0) when the csv and the options are unchanged since the
+        last load and the stage is skipped.
 
 
     SAMPLE USAGE
         load_data_into_db()
+        load_data_into_db(streaming=True, chunksize=100000)
+        load_data_into_db(incremental=True)
     '''
     
     
@@ -112,49 +458,187 @@ def load_data_into_db():
     if not os.path.isfile(db_full_path):
         raise FileNotFoundError(f"Database file '{db_full_path}' does not exist. Please create it first.")
 
-    # Load data from CSV
-    df = pd.read_csv(csv_file_path)
+    # Connect to the database
+    with get_connection(db_full_path) as conn:
+        # Skip the load if the csv and the options are the same as the last run
+        fingerprint = compute_fingerprint(file_fingerprint(csv_file_path), CODE_VERSION,
+                                          streaming, chunksize, incremental, deduplicate, TRACK_LEVEL_COUNTS)
+        if STAGE_CACHE_ENABLED and is_stage_cached(conn, 'load_data_into_db', fingerprint,
+                                                    [DB_DATA_TABLE_NAME], STORAGE):
+            return 0, 0
 
-    # Replace null values with 0 in specified columns
-    df['total_leads_droppped'].fillna(0, inplace=True)
-    df['referred_lead'].fillna(0, inplace=True)
+        # Leads created up to the watermark are already loaded
+        watermark = get_watermark(conn, DB_DATA_TABLE_NAME) if incremental else None
 
-    # Connect to the database
-    conn = sqlite3.connect(db_full_path)
-    
-    # Load data into the database table 'loaded_data'
-    df.to_sql(DB_DATA_TABLE_NAME, conn, if_exists='replace', index=False)
-    
-    # Close the connection
-    conn.close()
+        if streaming:
+            # Stream the csv into 'loaded_data' chunk by chunk in one transaction
+            rows, chunks = load_data_in_chunks(csv_file_path, conn, DB_DATA_TABLE_NAME, chunksize,
+                                               watermark, deduplicate)
+            update_watermark(conn, DB_DATA_TABLE_NAME)
+        else:
+            # Load data from CSV
+            df = pd.read_csv(csv_file_path)
+            record_io(read=df)
+
+            # Replace null values with 0 in specified columns
+            df = fill_null_lead_counts(df)
+            df = enforce_dtype_policy(df, f"Loaded {len(df)} rows of {DATA_FILE_NAME}")
+            if watermark is not None:
+                df = df[df['created_date'] > watermark]
+
+            # Drop the rows present twice in the csv
+            if deduplicate:
+                rows_read = len(df)
+                df = drop_duplicate_rows(df)
+                print(f"Dropped {rows_read - len(df)} duplicate row(s) of {DB_DATA_TABLE_NAME}.")
+
+            # Count the levels of the categorical columns of the new leads
+            if TRACK_LEVEL_COUNTS:
+                update_level_counts(conn, df, reset=watermark is None)
+
+            # Load data into the database table 'loaded_data'
+            write_new_rows(conn, df, DB_DATA_TABLE_NAME, watermark)
+            rows, chunks = len(df), 1
+
+        record_stage_run(conn, 'load_data_into_db', fingerprint, [DB_DATA_TABLE_NAME])
     
     print("Data successfully loaded into the database.", DB_DATA_TABLE_NAME)
+    print(f"Loaded {rows} rows in {chunks} chunk(s).")
+    return rows, chunks
 
 
 ###############################################################################
 # Define function to map cities to their respective tiers
 # ##############################################################################
 
+def normalize_city_names(cities):
+    '''
+    Returns the city names as a pandas Index of lower case strings without
+    leading, trailing or repeated whitespace, so that 'Mumbai ' and 'mumbai'
+    are looked up as the same city.
+    '''
+    return pd.Index(cities).astype(str).str.strip().str.lower().str.split().str.join(' ')
+
+
+def compile_city_tier_mapping(mapping):
+    '''
+    Compiles city_tier_mapping into a pandas Series of float64 tiers indexed by
+    the normalized city names, so that a whole array of cities is resolved with
+    a single hash lookup of its index.
+    '''
+    tiers = pd.Series(list(mapping.values()), index=normalize_city_names(list(mapping.keys())), dtype='float64')
+    return tiers[~tiers.index.duplicated()]
+
+
+# city_tier_mapping resolved once, when the module is imported
+CITY_TIER_LOOKUP = compile_city_tier_mapping(city_tier_mapping)
+
+
+def lookup_city_tiers(cities, lookup=CITY_TIER_LOOKUP, default_tier=3.0):
+    '''
+    This function resolves the tier of every city. The cities are factorized
+    into their unique values, which are normalized and looked up once, and the
+    tiers are broadcast back to the rows by their codes, so the cost of the
+    lookup depends on the number of distinct cities rather than on the number
+    of rows.
+
+
+    INPUTS
+        cities : series of city names, e.g. the 'city_mapped' column
+        lookup : tiers indexed by the normalized city names. Defaults to
+                 CITY_TIER_LOOKUP
+        default_tier : tier of the cities which are not mapped and of the
+                       null cities. Defaults to 3.0
+
+
+    OUTPUT
+        tuple (tiers, unmapped) where tiers is a float64 array with the tier of
+        every row and unmapped is a dataframe with the cities which are not
+        mapped, by their normalized name, and their number of leads, most
+        frequent first. Null cities are not reported.
+
+
+    SAMPLE USAGE
+        city_tier, unmapped = lookup_city_tiers(df['city_mapped'])
+    '''
+    if isinstance(cities.dtype, pd.CategoricalDtype):
+        # the dtype policy already holds the cities factorized
+        codes, uniques = cities.cat.codes.to_numpy(), cities.cat.categories
+    else:
+        codes, uniques = pd.factorize(cities)
+    normalized = normalize_city_names(uniques)
+    positions = lookup.index.get_indexer(normalized)
+    unique_tiers = np.where(positions == -1, default_tier, lookup.to_numpy()[positions])
+    # nulls are factorized to -1, which picks the trailing default tier
+    tiers = np.append(unique_tiers, default_tier)[codes]
+
+    # the leads of the spellings of an unmapped city are counted together
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    missing = (positions == -1) & (counts > 0)
+    unmapped = pd.Series(counts[missing], index=normalized[missing]).groupby(level=0).sum()
+    unmapped = unmapped.rename_axis('city_mapped').reset_index(name='leads')
+    unmapped = unmapped.sort_values(['leads', 'city_mapped'], ascending=[False, True], ignore_index=True)
+    return tiers, unmapped
+
+
+def apply_city_tier_mapping(df):
+    '''
+    Returns a copy of the dataframe with a 'city_tier' column holding the tier
+    of 'city_mapped' as per city_tier_mapping. Cities which are not mapped are
+    assigned to tier 3.0.
+    '''
+    city_tier, _ = lookup_city_tiers(df['city_mapped'])
+    return df.assign(city_tier=city_tier)
+
+
+def record_unmapped_cities(conn, cities, reset):
+    '''
+    Adds the leads of the cities which are not present in city_tier_mapping,
+    and hence assigned to tier 3.0, to the unmapped cities table and prints how
+    many there are. The table keeps one row per city with its number of leads.
+    If 'reset' is True the counts of the earlier runs are dropped first.
+    '''
+    _, unmapped = lookup_city_tiers(cities)
+    conn.execute(f'CREATE TABLE IF NOT EXISTS {DB_UNMAPPED_CITIES_TABLE_NAME} '
+                 '(city_mapped TEXT PRIMARY KEY, leads INTEGER, last_seen TEXT)')
+    if reset:
+        conn.execute(f'DELETE FROM {DB_UNMAPPED_CITIES_TABLE_NAME}')
+    conn.executemany(f'INSERT INTO {DB_UNMAPPED_CITIES_TABLE_NAME} VALUES (?, ?, datetime(\'now\')) '
+                     'ON CONFLICT(city_mapped) DO UPDATE SET leads = leads + excluded.leads, '
+                     'last_seen = excluded.last_seen',
+                     zip(unmapped['city_mapped'], unmapped['leads'].tolist()))
+    print(f"{len(unmapped)} unmapped cities ({unmapped['leads'].sum()} leads) assigned to tier 3.0, "
+          f"see {DB_UNMAPPED_CITIES_TABLE_NAME} table.")
+    return unmapped
+
     
-def map_city_tier():
+@instrument_task(metrics_db_path)
+def map_city_tier(incremental=INCREMENTAL_PROCESSING):
     '''
     This function maps all the cities to their respective tier as per the
     mappings provided in the city_tier_mapping.py file. If a
     particular city's tier isn't mapped(present) in the city_tier_mapping.py 
     file then the function maps that particular city to 3.0 which represents
-    tier-3.
+    tier-3. City names are matched irrespective of their case and whitespace.
 
 
     INPUTS
         DB_FILE_NAME : Name of the database file
         DB_PATH : path where the db file should be
         city_tier_mapping : a dictionary that maps the cities to their tier
+        incremental : if True only the leads of 'loaded_data' created after the
+                      high-water mark of 'city_tier_mapped' are mapped and
+                      appended to it. Defaults to INCREMENTAL_PROCESSING
 
     
     OUTPUT
         Saves the processed dataframe in the db in a table named
         'city_tier_mapped'. If the table with the same name already 
-        exsists then the function replaces it.
+        exsists then the function replaces it, or appends the new leads to
+        it in incremental mode.
+
+        The cities which are not mapped are counted in the 'unmapped_cities'
+        table, see record_unmapped_cities.
 
     
     SAMPLE USAGE
@@ -171,19 +655,25 @@ def map_city_tier():
 
     
     # Connect to the database
-    conn = sqlite3.connect(db_full_path)
-    
-    # Load data from the 'loaded_data' table
-    df = pd.read_sql(f'SELECT * FROM {DB_DATA_TABLE_NAME}', conn)
-    
-    # Map cities to their respective tiers
-    df['city_tier'] = df['city_mapped'].map(city_tier_mapping).fillna(3.0)
-    
-    # Save the processed dataframe into the database table 'city_tier_mapped'
-    df.to_sql(DB_MAPPING_TABLE_NAME, conn, if_exists='replace', index=False)
-    
-    # Close the connection
-    conn.close()
+    with get_connection(db_full_path) as conn:
+        # Skip the mapping if neither 'loaded_data' nor the mapping changed
+        fingerprint = compute_fingerprint(get_table_fingerprint(conn, DB_DATA_TABLE_NAME),
+                                          city_tier_mapping, CODE_VERSION, incremental)
+        if STAGE_CACHE_ENABLED and is_stage_cached(conn, 'map_city_tier', fingerprint,
+                                                    [DB_MAPPING_TABLE_NAME], STORAGE):
+            return
+
+        # Load data from the 'loaded_data' table
+        watermark = get_watermark(conn, DB_MAPPING_TABLE_NAME) if incremental else None
+        df = read_new_rows(conn, DB_DATA_TABLE_NAME, watermark)
+
+        # Map cities to their respective tiers and report the unmapped ones
+        df = apply_city_tier_mapping(df)
+        record_unmapped_cities(conn, df['city_mapped'], reset=watermark is None)
+
+        # Save the processed dataframe into the database table 'city_tier_mapped'
+        write_new_rows(conn, df, DB_MAPPING_TABLE_NAME, watermark)
+        record_stage_run(conn, 'map_city_tier', fingerprint, [DB_MAPPING_TABLE_NAME])
     
     print(f"City tier mapping completed and data saved to {DB_MAPPING_TABLE_NAME} table.")
 
@@ -191,8 +681,79 @@ def map_city_tier():
 # Define function to map insignificant categorial variables to "others"
 # ##############################################################################
 
+def compile_categorical_levels(levels):
+    '''
+    Precomputes the categories used to collapse the categorical columns. For
+    every column in 'levels' it returns a tuple with the pandas Index of the
+    output categories (significant levels plus "others", sorted so that the
+    category codes follow the same order as the level names) and the code of
+    "others" in that Index.
+
+
+    INPUTS
+        levels : dictionary mapping each categorical column to the list of
+                 its significant levels
+
+
+    OUTPUT
+        dictionary mapping each column to (categories, others_code)
+
+
+    SAMPLE USAGE
+        compile_categorical_levels(significant_levels)
+    '''
+    compiled = {}
+    for column, column_levels in levels.items():
+        categories = pd.Index(sorted(set(column_levels) | {'others'}))
+        compiled[column] = (categories, categories.get_loc('others'))
+    return compiled
+
+
+CATEGORICAL_LEVEL_CODES = compile_categorical_levels(significant_levels)
+
+
+def collapse_categorical_levels(df, compiled_levels=CATEGORICAL_LEVEL_CODES):
+    '''
+    Returns a copy of the dataframe in which every column present in
+    'compiled_levels' is converted to a pandas Categorical whose levels that are
+    not significant (including nulls) are collapsed into "others". Only the
+    distinct values of a column are resolved against its categories, the rows
+    are then remapped with a single vectorized lookup of their codes, so they
+    keep their original order.
+    '''
+    collapsed = {}
+    for column, (categories, others_code) in compiled_levels.items():
+        row_codes, uniques = pd.factorize(df[column])
+        unique_codes = categories.get_indexer(uniques)
+        unique_codes[unique_codes == -1] = others_code
+        # nulls are factorized to -1, which picks the trailing "others" slot
+        unique_codes = np.append(unique_codes, others_code)
+        collapsed[column] = pd.Categorical.from_codes(unique_codes[row_codes], categories=categories)
+    return df.assign(**collapsed)
+
+
+def apply_categorical_mapping(df_lead_scoring, compiled_levels=CATEGORICAL_LEVEL_CODES):
+    '''
+    Returns a new dataframe in which the levels of 'first_platform_c',
+    'first_utm_medium_c' and 'first_utm_source_c' that are not present in
+    list_platform, list_medium and list_source (or the significant levels
+    compiled in 'compiled_levels') are replaced by "others".
+    'city_mapped' is dropped along with the duplicate rows.
+    '''
+    # all the levels below 90 percentage are assgined to a single level called others
+    df = collapse_categorical_levels(df_lead_scoring, compiled_levels)
+    
+    df['total_leads_droppped'] = df['total_leads_droppped'].fillna(0)
+    df['referred_lead'] = df['referred_lead'].fillna(0)
+    df = df.drop(['city_mapped'], axis = 1)
+    rows_mapped = len(df)
+    df = drop_duplicate_rows(df)
+    print(f"Dropped {rows_mapped - len(df)} duplicate row(s) of {rows_mapped} after collapsing the levels.")
+    return df
+
 
-def map_categorical_vars():
+@instrument_task(metrics_db_path)
+def map_categorical_vars(incremental=INCREMENTAL_PROCESSING):
     '''
     This function maps all the insignificant variables present in 'first_platform_c'
     'first_utm_medium_c' and 'first_utm_source_c'. The list of significant variables
@@ -212,12 +773,18 @@ def map_categorical_vars():
                  file. The significant levels are calculated by taking top 90
                  percentils of all the levels. For more information refer
                  'data_cleaning.ipynb' notebook.
+                 If USE_REFRESHED_SIGNIFICANT_LEVELS is set the levels saved
+                 by refresh_significant_levels are used instead.
+        incremental : if True only the leads of 'city_tier_mapped' created after
+                      the high-water mark of 'categorical_variables_mapped' are
+                      mapped and appended to it. Defaults to INCREMENTAL_PROCESSING
   
 
     OUTPUT
         Saves the processed dataframe in the db in a table named
         'categorical_variables_mapped'. If the table with the same name already 
-        exsists then the function replaces it.
+        exsists then the function replaces it, or appends the new leads to
+        it in incremental mode.
 
     
     SAMPLE USAGE
@@ -233,43 +800,25 @@ def map_categorical_vars():
         raise FileNotFoundError(f"Database file '{db_full_path}' does not exist. Please create it first.")
     
     # Connect to the database
-    conn = sqlite3.connect(db_full_path)
-    
-    # Load data
-    df_lead_scoring = pd.read_sql(f'SELECT * FROM {DB_MAPPING_TABLE_NAME}', conn)
-    
-    
-    # all the levels below 90 percentage are assgined to a single level called others
-    new_df = df_lead_scoring[~df_lead_scoring['first_platform_c'].isin(list_platform)] # get rows for levels which are not present in list_platform
-    new_df['first_platform_c'] = "others" # replace the value of these levels to others
-    old_df = df_lead_scoring[df_lead_scoring['first_platform_c'].isin(list_platform)] # get rows for levels which are present in list_platform
-    df = pd.concat([new_df, old_df]) # concatenate new_df and old_df to get the final dataframe
+    with get_connection(db_full_path) as conn:
+        # Skip the mapping if neither 'city_tier_mapped' nor the levels changed
+        levels = current_significant_levels(conn)
+        fingerprint = compute_fingerprint(get_table_fingerprint(conn, DB_MAPPING_TABLE_NAME),
+                                          levels, CODE_VERSION, incremental)
+        if STAGE_CACHE_ENABLED and is_stage_cached(conn, 'map_categorical_vars', fingerprint,
+                                                    [DB_CAT_MAP_TABLE_NAME], STORAGE):
+            return
 
-    
-    # all the levels below 90 percentage are assgined to a single level called others
-    new_df = df[~df['first_utm_medium_c'].isin(list_medium)] # get rows for levels which are not present in list_medium
-    new_df['first_utm_medium_c'] = "others" # replace the value of these levels to others
-    old_df = df[df['first_utm_medium_c'].isin(list_medium)] # get rows for levels which are present in list_medium
-    df = pd.concat([new_df, old_df]) # concatenate new_df and old_df to get the final dataframe
+        # Load data
+        watermark = get_watermark(conn, DB_CAT_MAP_TABLE_NAME) if incremental else None
+        df_lead_scoring = read_new_rows(conn, DB_MAPPING_TABLE_NAME, watermark)
 
-    # all the levels below 90 percentage are assgined to a single level called others
-    new_df = df[~df['first_utm_source_c'].isin(list_source)] # get rows for levels which are not present in list_source
-    new_df['first_utm_source_c'] = "others" # replace the value of these levels to others
-    old_df = df[df['first_utm_source_c'].isin(list_source)] # get rows for levels which are present in list_source
-    df = pd.concat([new_df, old_df]) # concatenate new_df and old_df to get the final dataframe
+        # Map the insignificant levels to others
+        df = apply_categorical_mapping(df_lead_scoring, compile_categorical_levels(levels))
 
-    
-    df['total_leads_droppped'] = df['total_leads_droppped'].fillna(0)
-    df['referred_lead'] = df['referred_lead'].fillna(0)
-    df = df.drop(['city_mapped'], axis = 1)
-    df = df.drop_duplicates()
-    
-    
-    # Save the processed dataframe into the database table 'categorical_variables_mapped'
-    df.to_sql(DB_CAT_MAP_TABLE_NAME, conn, if_exists='replace', index=False)
-    
-    # Close the connection
-    conn.close()
+        # Save the processed dataframe into the database table 'categorical_variables_mapped'
+        write_new_rows(conn, df, DB_CAT_MAP_TABLE_NAME, watermark)
+        record_stage_run(conn, 'map_categorical_vars', fingerprint, [DB_CAT_MAP_TABLE_NAME])
     
     print(f"Categorical variable mapping completed and data saved to {DB_CAT_MAP_TABLE_NAME} table.")
 
@@ -277,7 +826,67 @@ def map_categorical_vars():
 ##############################################################################
 # Define function that maps interaction columns into 4 types of interactions
 # #############################################################################
-def interactions_mapping():
+def compile_interaction_mapping(interaction_mapping_df, columns):
+    '''
+    Compiles the interaction mappings into a 0/1 matrix with one row per
+    interaction column and one column per interaction group, so that the
+    grouped interaction sums of a frame are a single matrix product.
+
+
+    INPUTS
+        interaction_mapping_df : dataframe read from 'interaction_mapping.csv'
+                                 with 'interaction_type' and 'interaction_mapping'
+                                 columns
+        columns : columns of the dataframe that is going to be mapped, the
+                  interactions which are not present in it are ignored
+
+
+    OUTPUT
+        tuple (interaction_columns, groups, matrix) where matrix[i, j] is 1 if
+        interaction_columns[i] belongs to groups[j]
+
+
+    SAMPLE USAGE
+        compile_interaction_mapping(pd.read_csv(INTERACTION_MAPPING), df.columns)
+    '''
+    mapping = interaction_mapping_df[interaction_mapping_df['interaction_type'].isin(columns)]
+    interaction_columns = mapping['interaction_type'].tolist()
+    # groups are sorted to keep the column order pivot_table used to produce
+    groups = pd.Index(sorted(mapping['interaction_mapping'].unique()))
+    matrix = np.zeros((len(interaction_columns), len(groups)))
+    matrix[np.arange(len(interaction_columns)), groups.get_indexer(mapping['interaction_mapping'])] = 1
+    return interaction_columns, list(groups), matrix
+
+
+def apply_interactions_mapping(df, interaction_mapping_df):
+    '''
+    Maps the interaction columns of the dataframe to the interaction groups
+    present in interaction_mapping_df and returns a tuple with the row level
+    (interactions_mapped) dataframe and the dataframe aggregated over the index
+    columns (model_input). Null interactions count as 0. 'app_complete_flag' is
+    only used as an index column when it is present, i.e. during training.
+    '''
+    index_columns = ['created_date', 'city_tier', 'first_platform_c',
+           'first_utm_medium_c', 'first_utm_source_c', 'total_leads_droppped',
+           'referred_lead']
+    if 'app_complete_flag' in df.columns:
+        index_columns = index_columns + ['app_complete_flag']
+
+    interaction_columns, groups, matrix = compile_interaction_mapping(interaction_mapping_df, df.columns)
+
+    # sum the interactions of every row into their groups in one matrix product
+    interactions = df[interaction_columns].to_numpy(dtype='float64', na_value=0.0)
+    group_sums = interactions @ matrix
+    df_mapped = df[index_columns].assign(**{group: group_sums[:, i] for i, group in enumerate(groups)})
+
+    # aggregate the rows sharing the same index columns
+    df_model_input = df_mapped.groupby(index_columns, sort=True, observed=True).sum()
+    df_model_input = df_model_input.reset_index()
+    return df_mapped, df_model_input
+
+
+@instrument_task(metrics_db_path)
+def interactions_mapping(incremental=INCREMENTAL_PROCESSING):
     '''
     This function maps the interaction columns into 4 unique interaction columns
     These mappings are present in 'interaction_mapping.csv' file. 
@@ -293,6 +902,10 @@ def interactions_mapping():
         INDEX_COLUMNS_INFERENCE: list of columns to be used as index while pivoting and
                                  unpivoting during inference
         NOT_FEATURES: Features which have less significance and needs to be dropped
+        incremental : if True only the leads of 'categorical_variables_mapped'
+                      created after the high-water mark of 'model_input' are
+                      mapped and appended to 'interactions_mapped' and
+                      'model_input'. Defaults to INCREMENTAL_PROCESSING
                                  
         NOTE : Since while inference we will not have 'app_complete_flag' which is
         our label, we will have to exculde it from our features list. It is recommended 
@@ -303,9 +916,10 @@ def interactions_mapping():
 
     
     OUTPUT
-        Saves the processed dataframe in the db in a table named 
-        'interactions_mapped'. If the table with the same name already exsists then 
-        the function replaces it.
+        Saves the processed dataframe, with one row per lead and one column per
+        interaction type, in the db in a table named 'interactions_mapped'.
+        If the table with the same name already exsists then the function
+        replaces it.
         
         It also drops all the features that are not requried for training model and 
         writes it in a table named 'model_input'
@@ -326,34 +940,205 @@ def interactions_mapping():
     interaction_mapping_df = pd.read_csv(INTERACTION_MAPPING)
 
     # Connect to the database
-    conn = sqlite3.connect(db_full_path)
-    
-    # Load data from the 'categorical_variables_mapped' table
-    df = pd.read_sql(f'SELECT * FROM {DB_CAT_MAP_TABLE_NAME}', conn)
-    
-    
-    df_unpivot = pd.melt(df, id_vars=['created_date', 'first_platform_c',
-       'first_utm_medium_c', 'first_utm_source_c', 'total_leads_droppped', 'city_tier',
-       'referred_lead', 'app_complete_flag'], var_name='interaction_type', value_name='interaction_value')
-    df_unpivot['interaction_value'] = df_unpivot['interaction_value'].fillna(0)
-    df = pd.merge(df_unpivot, interaction_mapping_df, on='interaction_type', how='left')
-    df = df.drop(['interaction_type'], axis=1)
-    
-    # Save the processed dataframe into the database table 'interactions_mapped'
-    df.to_sql(DB_INTER_MAP_TABLE_NAME, conn, if_exists='replace', index=False)
-    
-    # pivoting the interaction mapping column values to individual columns in the dataset
-    df_pivot = df.pivot_table(
-            values='interaction_value', index=['created_date', 'city_tier', 'first_platform_c',
-           'first_utm_medium_c', 'first_utm_source_c', 'total_leads_droppped',
-           'referred_lead', 'app_complete_flag'], columns='interaction_mapping', aggfunc='sum')
-    df_pivot = df_pivot.reset_index()
-    
-    # Save the cleaned dataframe into the database table 'model_input'
-    df_pivot.to_sql('model_input', conn, if_exists='replace', index=False)
-    
-    # Close the connection
-    conn.close()
+    with get_connection(db_full_path) as conn:
+        # Skip the mapping if neither 'categorical_variables_mapped' nor the
+        # interaction mappings changed
+        output_tables = [DB_INTER_MAP_TABLE_NAME, 'model_input']
+        fingerprint = compute_fingerprint(get_table_fingerprint(conn, DB_CAT_MAP_TABLE_NAME),
+                                          file_fingerprint(INTERACTION_MAPPING), CODE_VERSION, incremental)
+        if STAGE_CACHE_ENABLED and is_stage_cached(conn, 'interactions_mapping', fingerprint, output_tables, STORAGE):
+            return
+
+        # Load data from the 'categorical_variables_mapped' table
+        watermark = get_watermark(conn, 'model_input') if incremental else None
+        df = read_new_rows(conn, DB_CAT_MAP_TABLE_NAME, watermark)
+
+        # Map the interactions and aggregate them into the model input. As
+        # 'created_date' is part of the index, the new leads never fall in the
+        # groups that are already present in 'model_input'
+        df, df_pivot = apply_interactions_mapping(df, interaction_mapping_df)
+
+        # Save the processed dataframe into the database table 'interactions_mapped'
+        write_new_rows(conn, df, DB_INTER_MAP_TABLE_NAME, watermark)
+
+        # Save the cleaned dataframe into the database table 'model_input'
+        write_new_rows(conn, df_pivot, 'model_input', watermark)
+        record_stage_run(conn, 'interactions_mapping', fingerprint, output_tables)
     
     print(f"Interactions mapped and data saved to {DB_INTER_MAP_TABLE_NAME} and 'model_input' tables.")
-    
+
+
+##############################################################################
+# Define functions that run the mapping stages in memory
+# #############################################################################
+def partition_leads(df, partition_key=PARTITION_KEY, partitions=PARTITION_COUNT):
+    '''
+    Splits the leads into partitions by the month of their 'created_date'
+    ('month') or by a hash of it into 'partitions' buckets ('hash'). As
+    'created_date' is part of both the duplicate rows and the index columns of
+    'model_input', duplicates and groups never span two partitions.
+    '''
+    if partition_key == 'month':
+        keys = df['created_date'].astype(str).str[:7]
+    elif partition_key == 'hash':
+        keys = pd.util.hash_pandas_object(df['created_date'], index=False) % partitions
+    else:
+        raise ValueError(f"Unknown partition key '{partition_key}', expected 'month' or 'hash'")
+    return [partition for _, partition in df.groupby(keys, sort=True, dropna=False)]
+
+
+def transform_leads(df, interaction_mapping_df, materialize=False, compiled_levels=CATEGORICAL_LEVEL_CODES):
+    '''
+    Runs the city tier, categorical and interaction mappings on the leads and
+    returns a tuple (city_tier_mapped, categorical_variables_mapped,
+    interactions_mapped, model_input). The intermediate dataframes are None
+    unless 'materialize' is set.
+    '''
+    df_city_tier = apply_city_tier_mapping(df)
+    df_categorical = apply_categorical_mapping(df_city_tier, compiled_levels)
+    df_interactions, df_model_input = apply_interactions_mapping(df_categorical, interaction_mapping_df)
+    if not materialize:
+        return None, None, None, df_model_input
+    return df_city_tier, df_categorical, df_interactions, df_model_input
+
+
+def transform_leads_in_partitions(df, interaction_mapping_df, materialize=False,
+                                  workers=PARALLEL_WORKERS, partition_key=PARTITION_KEY,
+                                  partitions=PARTITION_COUNT, compiled_levels=CATEGORICAL_LEVEL_CODES):
+    '''
+    This function runs transform_leads on the partitions of the leads in a
+    pool of 'workers' processes and merges the results. The row level
+    dataframes keep the index of the leads, so they are put back in the order
+    of a serial run by sorting on it, and the groups of 'model_input' are
+    sorted on their index columns as groupby does.
+
+
+    INPUTS
+        df : leads read from 'loaded_data'
+        interaction_mapping_df : dataframe read from 'interaction_mapping.csv'
+        materialize : if True the intermediate dataframes are returned too
+        workers : number of worker processes, 1 runs serially. Defaults to
+                  PARALLEL_WORKERS
+        partition_key : 'month' or 'hash', see partition_leads. Defaults to
+                        PARTITION_KEY
+        partitions : number of buckets of the 'hash' key. Defaults to
+                     PARTITION_COUNT
+        compiled_levels : significant levels compiled by
+                          compile_categorical_levels. Defaults to
+                          CATEGORICAL_LEVEL_CODES
+
+
+    OUTPUT
+        same tuple as transform_leads, with the same contents as a serial run
+
+
+    SAMPLE USAGE
+        transform_leads_in_partitions(df, interaction_mapping_df, workers=8)
+    '''
+    leads_partitions = partition_leads(df, partition_key, partitions) if workers > 1 else []
+    if len(leads_partitions) <= 1:
+        return transform_leads(df, interaction_mapping_df, materialize, compiled_levels)
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(leads_partitions))) as executor:
+        results = list(executor.map(transform_leads, leads_partitions,
+                                    [interaction_mapping_df] * len(leads_partitions),
+                                    [materialize] * len(leads_partitions),
+                                    [compiled_levels] * len(leads_partitions)))
+    print(f"Mapped {len(df)} leads in {len(leads_partitions)} partitions by {partition_key} "
+          f"with {min(workers, len(leads_partitions))} workers.")
+
+    df_model_input = pd.concat([result[3] for result in results])
+    df_model_input = df_model_input.sort_values(list(df_model_input.columns)).reset_index(drop=True)
+    if not materialize:
+        return None, None, None, df_model_input
+    df_city_tier, df_categorical, df_interactions = (
+        pd.concat([result[i] for result in results]).sort_index() for i in range(3))
+    return df_city_tier, df_categorical, df_interactions, df_model_input
+
+
+@instrument_task(metrics_db_path)
+def run_fused_data_pipeline(materialize=MATERIALIZE_INTERMEDIATE_TABLES,
+                            incremental=INCREMENTAL_PROCESSING,
+                            workers=PARALLEL_WORKERS, partition_key=PARTITION_KEY):
+    '''
+    This function runs map_city_tier, map_categorical_vars and interactions_mapping
+    as a single in-memory step. 'loaded_data' is read from the db once and the
+    dataframe is handed from one mapping to the next instead of being written to
+    and read back from the db after every stage. The resulting 'model_input'
+    table is the same as the one produced by running the three stages separately.
+
+
+    INPUTS
+        DB_FILE_NAME : Name of the database file
+        DB_PATH : path where the db file should be present
+        INTERACTION_MAPPING : path to the csv file containing interaction's
+                              mappings
+        materialize : if True the intermediate tables 'city_tier_mapped',
+                      'categorical_variables_mapped' and 'interactions_mapped'
+                      are written as well, which is useful for debugging.
+                      Defaults to MATERIALIZE_INTERMEDIATE_TABLES
+        incremental : if True only the leads of 'loaded_data' created after the
+                      high-water mark of 'model_input' are mapped and appended
+                      to it. Defaults to INCREMENTAL_PROCESSING
+        workers : with more than one worker the leads are partitioned by
+                  'partition_key' and mapped in a process pool, see
+                  transform_leads_in_partitions. Defaults to PARALLEL_WORKERS
+        partition_key : 'month' or 'hash'. Defaults to PARTITION_KEY
+
+
+    OUTPUT
+        Saves the final dataframe in the db in a table named 'model_input'.
+        If the table with the same name already exsists then the function
+        replaces it.
+
+
+    SAMPLE USAGE
+        run_fused_data_pipeline()
+        run_fused_data_pipeline(materialize=True)
+        run_fused_data_pipeline(incremental=True)
+        run_fused_data_pipeline(workers=16, partition_key='hash')
+    '''
+
+    # Define full database path
+    db_full_path = os.path.join(DB_PATH, DB_FILE_NAME)
+
+    # Check if the database file exists
+    if not os.path.isfile(db_full_path):
+        raise FileNotFoundError(f"Database file '{db_full_path}' does not exist. Please create it first.")
+
+    # Load interaction mappings
+    interaction_mapping_df = pd.read_csv(INTERACTION_MAPPING)
+
+    # Connect to the database
+    with get_connection(db_full_path) as conn:
+        # Skip the run if neither 'loaded_data' nor any of the mappings changed
+        output_tables = ['model_input']
+        if materialize:
+            output_tables += [DB_MAPPING_TABLE_NAME, DB_CAT_MAP_TABLE_NAME, DB_INTER_MAP_TABLE_NAME]
+        levels = current_significant_levels(conn)
+        fingerprint = compute_fingerprint(get_table_fingerprint(conn, DB_DATA_TABLE_NAME),
+                                          city_tier_mapping, levels,
+                                          file_fingerprint(INTERACTION_MAPPING), CODE_VERSION,
+                                          materialize, incremental)
+        if STAGE_CACHE_ENABLED and is_stage_cached(conn, 'run_fused_data_pipeline', fingerprint,
+                                                    output_tables, STORAGE):
+            return
+
+        # Load data from the 'loaded_data' table
+        watermark = get_watermark(conn, 'model_input') if incremental else None
+        df = read_new_rows(conn, DB_DATA_TABLE_NAME, watermark)
+
+        df_city_tier, df_categorical, df_interactions, df_pivot = transform_leads_in_partitions(
+            df, interaction_mapping_df, materialize, workers, partition_key,
+            compiled_levels=compile_categorical_levels(levels))
+        record_unmapped_cities(conn, df['city_mapped'], reset=watermark is None)
+        if materialize:
+            write_new_rows(conn, df_city_tier, DB_MAPPING_TABLE_NAME, watermark)
+            write_new_rows(conn, df_categorical, DB_CAT_MAP_TABLE_NAME, watermark)
+            write_new_rows(conn, df_interactions, DB_INTER_MAP_TABLE_NAME, watermark)
+
+        # Save the cleaned dataframe into the database table 'model_input'
+        write_new_rows(conn, df_pivot, 'model_input', watermark)
+        record_stage_run(conn, 'run_fused_data_pipeline', fingerprint, output_tables)
+
+    print("Fused data pipeline completed and data saved to 'model_input' table.")
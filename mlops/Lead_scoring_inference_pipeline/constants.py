@@ -4,6 +4,13 @@ DB_MODEL_INPUT_TABLE_NAME = 'model_input'
 DB_PREDICTIONS_TABLE_NAME = 'predictions'
 DB_FEATURES_TABLE_NAME = 'features'
 
+# Storage backend of the data tables: 'sqlite' keeps every table in the db,
+# 'parquet' stores the tables in PARQUET_TABLES as parquet datasets under
+# PARQUET_DIRECTORY (shared with the data and training pipelines)
+STORAGE_BACKEND = 'sqlite'
+PARQUET_DIRECTORY = '/home/database/parquet'
+PARQUET_TABLES = ['loaded_data', 'model_input', 'features', 'target', 'predictions']
+
 FILE_PATH = '/home/airflow/dags/Lead_scoring_inference_pipeline'
 PREDICTIONS_FILE_NAME = 'prediction_distribution.txt'
 FEATURES_CHECK_FILE_NAME= 'input_features_check_log.txt'
@@ -20,6 +27,27 @@ EXPERIMENT = 'Lead_scoring_mlflow_production'
 
 MODEL_PATH = f"models:/{MODEL_NAME}/{STAGE}"
 
+# Model cache: the model of STAGE is downloaded from the registry once per
+# version into MODEL_CACHE_DIRECTORY and loaded from there while the version
+# of the stage is unchanged. The MODEL_CACHE_KEEP_VERSIONS most recently used
+# versions are kept, and every load is recorded in DB_MODEL_LOADS_TABLE_NAME
+MODEL_CACHE_DIRECTORY = '/home/database/model_cache'
+MODEL_CACHE_KEEP_VERSIONS = 2
+DB_MODEL_LOADS_TABLE_NAME = 'model_loads'
+
+# Scoring service (scoring_service.py): the raw leads of the concurrent
+# requests are scored in micro-batches of at most SCORING_MAX_BATCH_SIZE
+# leads, the first request of a batch waiting at most SCORING_MAX_WAIT_MS
+# for others. The latency percentiles are computed over the last
+# SCORING_LATENCY_WINDOW requests, and a model of the registry is reloaded
+# when the version of STAGE changed, checked every SCORING_RELOAD_SECONDS
+SCORING_HOST = '0.0.0.0'
+SCORING_PORT = 8080
+SCORING_MAX_BATCH_SIZE = 256
+SCORING_MAX_WAIT_MS = 5
+SCORING_LATENCY_WINDOW = 10000
+SCORING_RELOAD_SECONDS = 60
+
 
 # list of the features that needs to be there in the final encoded dataframe
 ONE_HOT_ENCODED_FEATURES = [
@@ -6,7 +6,7 @@ from airflow import DAG
 from airflow.operators.python import PythonOperator
 from datetime import datetime, timedelta
 from Lead_scoring_inference_pipeline.constants import *
-from Lead_scoring_inference_pipeline.utils import *
+from Lead_scoring_inference_pipeline.tasks import *
 
 ###############################################################################
 # Define default arguments and create an instance of DAG
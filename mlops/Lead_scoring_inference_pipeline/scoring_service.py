@@ -0,0 +1,288 @@
+'''
+filename: scoring_service.py
+classes: ScoringService
+functions: load_scoring_model, score_leads, read_request, write_response, serve, main
+Long-lived HTTP service scoring raw leads with the Production model, as they
+are created, instead of waiting for the hourly batch of the inference
+pipeline. The model and the one hot encoder are loaded once and kept in
+memory, and the leads of concurrent requests are scored in micro-batches
+(see MicroBatcher).
+
+  POST /score    a raw lead, as a row of leadscoring.csv, a list of leads or
+                 {"leads": [...]}, returns the probability and the predicted
+                 'app_complete_flag' of every lead
+  GET  /metrics  latency percentiles, throughput and batching counters
+  GET  /health   version of the model served
+
+usage: python -m Lead_scoring_inference_pipeline.scoring_service --model-file /tmp/model.txt
+       python -m Lead_scoring_inference_pipeline.scoring_service --tracking-uri http://0.0.0.0:6006
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import argparse
+import asyncio
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from Lead_scoring_inference_pipeline.constants import *
+from Lead_scoring_data_pipeline.utils import apply_city_tier_mapping, collapse_categorical_levels
+from Lead_scoring_common.one_hot_encoder import compile_one_hot_encoder, one_hot_encode
+from Lead_scoring_common.model_cache import load_cached_model
+from Lead_scoring_common.micro_batching import LatencyStats, MicroBatcher
+
+# output column of every level of FEATURES_TO_ENCODE, resolved once
+ONE_HOT_ENCODER = compile_one_hot_encoder(ONE_HOT_ENCODED_FEATURES, FEATURES_TO_ENCODE)
+
+# columns of the raw leads the features are computed from
+LEAD_COLUMNS = ['city_mapped', 'total_leads_droppped', 'referred_lead'] + FEATURES_TO_ENCODE
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                500: 'Internal Server Error'}
+
+
+###############################################################################
+# Define the functions to load the model and score the leads
+# ##############################################################################
+
+def load_scoring_model(model_file=None):
+    '''
+    Returns the booster to serve and its version: the native LightGBM model
+    file if one is given, so the service runs offline, else the model of
+    STAGE from the registry of the tracking uri, through the model cache.
+    '''
+    if model_file is not None:
+        import lightgbm as lgb
+        return lgb.Booster(model_file=model_file), 'file:' + os.path.basename(model_file)
+    model, version, _, _ = load_cached_model(MODEL_NAME, STAGE, MODEL_CACHE_DIRECTORY, MODEL_CACHE_KEEP_VERSIONS)
+    return model, version
+
+
+def score_leads(leads, model, encoder=ONE_HOT_ENCODER):
+    '''
+    This function scores raw leads with the transformations of the data
+    pipeline: the tier of the city, the collapse of the insignificant levels
+    and the null lead counts as 0, followed by the one hot encoding of the
+    training pipeline. Missing fields are treated as nulls.
+
+
+    INPUTS
+        leads : list of dictionaries of the fields of the raw leads
+        model : booster predicting the probability of 'app_complete_flag'
+        encoder : encoder returned by compile_one_hot_encoder
+
+
+    OUTPUT
+        float64 array of the probability of every lead
+
+
+    SAMPLE USAGE
+        probabilities = score_leads([{'city_mapped': 'Mumbai', 'first_platform_c': 'Level0'}], model)
+    '''
+    df = pd.DataFrame.from_records(leads).reindex(columns=LEAD_COLUMNS)
+    for column in ('total_leads_droppped', 'referred_lead'):
+        df[column] = pd.to_numeric(df[column], errors='coerce').fillna(0)
+    df = collapse_categorical_levels(apply_city_tier_mapping(df))
+    return model.predict(one_hot_encode(df, encoder))
+
+
+###############################################################################
+# Define the HTTP functions
+# ##############################################################################
+
+async def read_request(reader):
+    '''
+    Reads an HTTP/1.1 request and returns its method, path, headers and body,
+    or None if the client closed the connection.
+    '''
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    method, path, _ = request_line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return method, path.split('?', 1)[0], headers, body
+
+
+async def write_response(writer, status, payload, keep_alive=True):
+    body = json.dumps(payload).encode()
+    writer.write(f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(body)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+                 .encode('latin-1') + body)
+    await writer.drain()
+
+
+###############################################################################
+# Define the scoring service
+# ##############################################################################
+
+class ScoringService:
+    '''
+    This class serves the scoring requests. The model, its version and the
+    batcher are shared by all the connections, and a model of the registry
+    is swapped for the new version of STAGE by reload_model, the batches
+    already queued are then scored with the new model. The model and its
+    version are swapped together and read once per batch, so that every
+    response reports the version of the model that scored it.
+
+
+    INPUTS
+        model_file : native LightGBM model file to serve, else the model of
+                     STAGE in the registry
+        max_batch_size : maximum number of leads of a batch
+        max_wait_ms : maximum milliseconds the first request of a batch
+                      waits for others
+        latency_window : number of requests of the latency percentiles
+
+
+    SAMPLE USAGE
+        service = ScoringService('/tmp/model.txt')
+        asyncio.run(serve(service, '127.0.0.1', 8080))
+    '''
+
+    def __init__(self, model_file=None, max_batch_size=SCORING_MAX_BATCH_SIZE, max_wait_ms=SCORING_MAX_WAIT_MS,
+                 latency_window=SCORING_LATENCY_WINDOW):
+        self.model_file = model_file
+        # tuple (booster, version), replaced as a whole by reload_model
+        self.served = load_scoring_model(model_file)
+        self.batcher = MicroBatcher(self.predict, max_batch_size, max_wait_ms / 1000,
+                                    LatencyStats(latency_window))
+
+    @property
+    def version(self):
+        return self.served[1]
+
+    def predict(self, leads):
+        '''
+        Scores the leads of a batch, in the worker thread of the batcher, and
+        returns the tuple (version, probability) of every lead.
+        '''
+        model, version = self.served
+        return [(version, probability) for probability in score_leads(leads, model)]
+
+    async def reload_model(self, interval):
+        '''
+        Checks the version of STAGE every 'interval' seconds and swaps the
+        model when it changed, the model cache loads it in a worker thread.
+        '''
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                model, version = await asyncio.get_running_loop().run_in_executor(None, load_scoring_model)
+            except Exception as e:
+                print(f"Model reload failed, still serving version {self.version}: {e}")
+                continue
+            if version != self.version:
+                print(f"Serving model version {version} instead of {self.version}")
+                self.served = (model, version)
+
+    async def handle(self, reader, writer):
+        '''
+        Serves the requests of a connection until the client closes it.
+        '''
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except (asyncio.IncompleteReadError, ValueError):
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                status, payload = await self.route(method, path, body)
+                await write_response(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method, path, body):
+        if path == '/score':
+            if method != 'POST':
+                return 405, {'error': 'use POST'}
+            try:
+                leads = json.loads(body)
+            except ValueError as e:
+                return 400, {'error': f'invalid JSON: {e}'}
+            if isinstance(leads, dict):
+                leads = leads['leads'] if 'leads' in leads else [leads]
+            if not isinstance(leads, list) or not leads or not all(isinstance(lead, dict) for lead in leads):
+                return 400, {'error': 'expected a lead, a list of leads or {"leads": [...]}'}
+            try:
+                results = await self.batcher.submit(leads)
+            except Exception as e:
+                return 500, {'error': str(e)}
+            # the leads of a request are scored in one batch, by one model
+            probabilities = np.array([probability for _, probability in results])
+            return 200, {'model_version': results[0][0], 'probability': probabilities.tolist(),
+                         'app_complete_flag': (probabilities > 0.5).astype(int).tolist()}
+        if path == '/metrics':
+            return 200, dict(self.batcher.stats.snapshot(), model_version=self.version,
+                             max_batch_size=self.batcher.max_batch_size,
+                             max_wait_ms=self.batcher.max_wait * 1000)
+        if path == '/health':
+            return 200, {'status': 'ok', 'model_version': self.version}
+        return 404, {'error': f'unknown path {path}'}
+
+
+async def serve(service, host=SCORING_HOST, port=SCORING_PORT, reload_seconds=SCORING_RELOAD_SECONDS,
+                started=None):
+    '''
+    Serves the scoring service on host:port until cancelled. A model of the
+    registry is checked for a new version every 'reload_seconds', and
+    'started', an asyncio.Event, is set once the port is listening.
+    '''
+    service.batcher.start()
+    server = await asyncio.start_server(service.handle, host, port)
+    reload_task = None
+    if service.model_file is None and reload_seconds:
+        reload_task = asyncio.get_running_loop().create_task(service.reload_model(reload_seconds))
+    print(f"Scoring leads with model version {service.version} on http://{host}:{port}")
+    if started is not None:
+        started.set()
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if reload_task is not None:
+            reload_task.cancel()
+        await service.batcher.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model-file', help='native LightGBM model file, else the model of the registry')
+    parser.add_argument('--tracking-uri', default=TRACKING_URI, help='tracking uri of the model registry')
+    parser.add_argument('--host', default=SCORING_HOST)
+    parser.add_argument('--port', type=int, default=SCORING_PORT)
+    parser.add_argument('--max-batch-size', type=int, default=SCORING_MAX_BATCH_SIZE)
+    parser.add_argument('--max-wait-ms', type=float, default=SCORING_MAX_WAIT_MS)
+    parser.add_argument('--reload-seconds', type=float, default=SCORING_RELOAD_SECONDS)
+    args = parser.parse_args()
+
+    if args.model_file is None:
+        import mlflow
+        mlflow.set_tracking_uri(args.tracking_uri)
+    service = ScoringService(args.model_file, args.max_batch_size, args.max_wait_ms)
+    try:
+        asyncio.run(serve(service, args.host, args.port, args.reload_seconds))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
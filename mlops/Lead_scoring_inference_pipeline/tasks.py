@@ -0,0 +1,23 @@
+'''
+filename: tasks.py
+functions: encode_features, get_models_prediction, prediction_ratio_check, input_features_check
+The callables of the tasks of lead_scoring_inference_pipeline.py. They import
+utils, and pandas and mlflow with it, only when a task runs, so that parsing
+the DAG file stays fast (see lazy_task).
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+from Lead_scoring_common.lazy_tasks import lazy_task
+
+
+###############################################################################
+# Define the callables of the tasks
+# ##############################################################################
+
+encode_features = lazy_task('Lead_scoring_inference_pipeline.utils', 'encode_features')
+get_models_prediction = lazy_task('Lead_scoring_inference_pipeline.utils', 'get_models_prediction')
+prediction_ratio_check = lazy_task('Lead_scoring_inference_pipeline.utils', 'prediction_ratio_check')
+input_features_check = lazy_task('Lead_scoring_inference_pipeline.utils', 'input_features_check')
@@ -20,24 +20,41 @@ import logging
 
 from datetime import datetime
 from Lead_scoring_inference_pipeline.constants import *
+from Lead_scoring_common.stage_cache import invalidate_table_fingerprints
+from Lead_scoring_common.storage import get_storage
+from Lead_scoring_common.sqlite_connection import get_connection
+from Lead_scoring_common.instrumentation import instrument_task
+from Lead_scoring_common.one_hot_encoder import compile_one_hot_encoder, encode_features_frame
+from Lead_scoring_common.model_cache import load_cached_model, record_model_load
 # from constants import *
 import time
 
+# backend the tables are read from and written to, see STORAGE_BACKEND
+STORAGE = get_storage(STORAGE_BACKEND, PARQUET_DIRECTORY, PARQUET_TABLES)
+
+# output column of every level of FEATURES_TO_ENCODE, resolved once
+ONE_HOT_ENCODER = compile_one_hot_encoder(ONE_HOT_ENCODED_FEATURES, FEATURES_TO_ENCODE)
+
+
+def metrics_db_path():
+    '''
+    Returns the path of the db the metrics of the tasks are written to, see
+    instrument_task.
+    '''
+    return os.path.join(DB_PATH, DB_FILE_NAME)
+
 
 
 def check_if_table_has_value(cnx, table_name):
     # cnx = sqlite3.connect(db_path+db_file_name)
-    check_table = pd.read_sql(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}';", cnx).shape[0]
-    if check_table == 1:
-        return True
-    else:
-        return False
+    return STORAGE.exists(cnx, table_name)
 
 ###############################################################################
 # Define the function to train the model
 # ##############################################################################
 
 
+@instrument_task(metrics_db_path)
 def encode_features():
     '''
     This function one hot encodes the categorical features present in our  
@@ -60,50 +77,29 @@ def encode_features():
     '''
     try:
         db_full_path = os.path.join(DB_PATH, DB_FILE_NAME)
-        cnx = sqlite3.connect(db_full_path)
-        if not check_if_table_has_value(cnx,'features'):
-                print("model_input Exists")
-                df = pd.read_sql('select * from model_input', cnx)
-
-
-                # Implement these steps to prevent dimension mismatch during inference
-                encoded_df = pd.DataFrame(columns= ONE_HOT_ENCODED_FEATURES) # from constants.py
-                placeholder_df = pd.DataFrame()
-
-                # One-Hot Encoding using get_dummies for the specified categorical features
-                for f in FEATURES_TO_ENCODE:
-                    if(f in df.columns):
-                        encoded = pd.get_dummies(df[f])
-                        encoded = encoded.add_prefix(f + '_')
-                        placeholder_df = pd.concat([placeholder_df, encoded], axis=1)
-                    else:
-                        print('Feature not found')
-                        # return df
-
-                # Implement these steps to prevent dimension mismatch during inference
-                for feature in encoded_df.columns:
-                    if feature in df.columns:
-                        encoded_df[feature] = df[feature]
-                    if feature in placeholder_df.columns:
-                        encoded_df[feature] = placeholder_df[feature]
-
-                encoded_df.fillna(0,inplace=True)
-
-
-                encoded_df.to_sql(name='features', con=cnx,if_exists='replace',index=False)
-                print('features created/replaced')
-        else:
-            print("features already exists")
+        with get_connection(db_full_path) as cnx:
+            if not check_if_table_has_value(cnx,'features'):
+                    print("model_input Exists")
+                    df = STORAGE.read(cnx, DB_MODEL_INPUT_TABLE_NAME)
+
+
+                    # same encoder as the training pipeline, to prevent dimension mismatch during inference
+                    encoded_df = encode_features_frame(df, ONE_HOT_ENCODER)
+
+                    STORAGE.write(cnx, encoded_df, DB_FEATURES_TABLE_NAME, if_exists='replace')
+                    # the training features have been overwritten
+                    invalidate_table_fingerprints(cnx, ['features'])
+                    print('features created/replaced')
+            else:
+                print("features already exists")
     except Exception as e:
         print (f'Exception thrown in encode_features : {e}')
-    finally:
-        if cnx:        
-            cnx.close()
 
 ###############################################################################
 # Define the function to load the model from mlflow model registry
 # ##############################################################################
 
+@instrument_task(metrics_db_path)
 def get_models_prediction():
     '''
     This function loads the model which is in production from mlflow registry and 
@@ -121,46 +117,48 @@ def get_models_prediction():
     OUTPUT
         Store the predicted values along with input data into a table
 
+        The model is loaded through the model cache (see load_cached_model),
+        the registry is only asked for the version of the stage unless that
+        version isn't cached yet. The version, cache status and load time
+        are recorded in the 'model_loads' table.
+
     SAMPLE USAGE
         load_model()
     '''
     db_full_path = os.path.join(DB_PATH, DB_FILE_NAME)
-    cnx = sqlite3.connect(db_full_path)
-    
-    
+
     try:
         mlflow.set_tracking_uri(TRACKING_URI)
 
-        # Load model as a PyFuncModel.
+        # Load the production model, downloaded only when its version changed
         print('Loading model from mlflow, using production model')
-        model_uri = f"models:/{MODEL_NAME}/{STAGE}"
-        #model_uri = "file:/home/mlruns/1/35bf97c0bc30484aa2cad67cb49f0c8b/artifacts/LightGBM"
-        print('Model url ' + model_uri)
-        loaded_model = mlflow.lightgbm.load_model(model_uri)
-        mlflow.lightgbm.log_model(lgb_model=loaded_model,artifact_path="LightGBM model", registered_model_name='LightGBM')
+        print('Model url ' + MODEL_PATH)
+        loaded_model, version, status, load_seconds = load_cached_model(
+            MODEL_NAME, STAGE, MODEL_CACHE_DIRECTORY, MODEL_CACHE_KEEP_VERSIONS)
         print('Model Loaded')
-        
-        
-        # Predict on a Pandas DataFrame.
-        print('Loading features  from table')
-        X = pd.read_sql(f'select * from {DB_FEATURES_TABLE_NAME}', cnx)
-        print('Making Prediction')
-        predictions = loaded_model.predict(pd.DataFrame(X))
-        pred_df = X.copy()
-
-        pred_df['app_complete_flag'] = predictions
-        pred_df.to_sql(name=DB_PREDICTIONS_TABLE_NAME, con=cnx,if_exists='replace',index=False)
+
+
+        with get_connection(db_full_path) as cnx:
+            record_model_load(cnx, DB_MODEL_LOADS_TABLE_NAME, MODEL_NAME, version, status, load_seconds)
+            # Predict on a Pandas DataFrame.
+            print('Loading features  from table')
+            X = STORAGE.read(cnx, DB_FEATURES_TABLE_NAME)
+            print('Making Prediction')
+            # the booster predicts the probability of class 1
+            predictions = (loaded_model.predict(pd.DataFrame(X)) > 0.5).astype(int)
+            pred_df = X.copy()
+
+            pred_df['app_complete_flag'] = predictions
+            STORAGE.write(cnx, pred_df, DB_PREDICTIONS_TABLE_NAME, if_exists='replace')
         print("Predictions are done and create/replaced Table")
     except Exception as e:
         print (f'Exception thrown in get_models_prediction : {e}')
-    finally:
-        if cnx:        
-            cnx.close()
 
 ###############################################################################
 # Define the function to check the distribution of output column
 # ##############################################################################
 
+@instrument_task(metrics_db_path)
 def prediction_ratio_check():
     '''
     This function calculates the % of 1 and 0 predicted by the model and  
@@ -185,9 +183,10 @@ def prediction_ratio_check():
     '''
     try:
         db_full_path = os.path.join(DB_PATH, DB_FILE_NAME)
-        cnx = sqlite3.connect(db_full_path)
-        print('Loading predictions table')
-        pred = pd.read_sql(f'select * from {DB_PREDICTIONS_TABLE_NAME}', cnx)
+        with get_connection(db_full_path) as cnx:
+            print('Loading predictions table')
+            # only the predicted column is read
+            pred = STORAGE.read(cnx, DB_PREDICTIONS_TABLE_NAME, columns=['app_complete_flag'])
         pct_ones = round(pred['app_complete_flag'].sum() / pred['app_complete_flag'].count() * 100, 2) 
         pct_zeroes = 100 - pct_ones
         full_file_path = os.path.join(FILE_PATH, PREDICTIONS_FILE_NAME)
@@ -197,15 +196,13 @@ def prediction_ratio_check():
         print(f"Prediction ratio for the date {time.ctime()} for Ones % {pct_ones} and Zeroes % {pct_zeroes}")
     except Exception as e:
         print (f'Exception thrown in prediction_ratio_check : {e}')
-    finally:
-        if cnx:        
-            cnx.close()
 
 ###############################################################################
 # Define the function to check the columns of input features
 # ##############################################################################
 
 
+@instrument_task(metrics_db_path)
 def input_features_check():
     '''
     This function checks whether all the input columns are present in our new
@@ -233,12 +230,12 @@ def input_features_check():
         logger = logging.getLogger()
 
         db_full_path = os.path.join(DB_PATH, DB_FILE_NAME)
-        cnx = sqlite3.connect(db_full_path)
-        print('Loading features table')
-        features = pd.read_sql(f'select * from {DB_FEATURES_TABLE_NAME}', cnx)
-        cnx.close()
+        with get_connection(db_full_path) as cnx:
+            print('Loading features table')
+            # only the column names are needed, no row is read
+            feature_columns = STORAGE.columns(cnx, DB_FEATURES_TABLE_NAME)
 
-        if list(features.columns) == ONE_HOT_ENCODED_FEATURES:
+        if feature_columns == ONE_HOT_ENCODED_FEATURES:
             logger.info('All the models input are present')
             print('All the models input are present')
         else:
@@ -247,7 +244,4 @@ def input_features_check():
 
     except Exception as e:
         print (f'Exception thrown in input_col_check : {e}')
-    finally:
-        if cnx:        
-            cnx.close()
    
@@ -8,16 +8,88 @@ DB_FEATURES_TABLE_NAME = 'features'
 DB_TARGET_TABLE_NAME = 'target'
 DB_MODEL_INPUT_TABLE_NAME = 'model_input'
 
+# Stage cache: skip encode_features when 'model_input' and the encoding
+# constants are unchanged since its last run
+STAGE_CACHE_ENABLED = True
+
+# Storage backend of the data tables: 'sqlite' keeps every table in the db,
+# 'parquet' stores the tables in PARQUET_TABLES as parquet datasets under
+# PARQUET_DIRECTORY (shared with the data and inference pipelines)
+STORAGE_BACKEND = 'sqlite'
+PARQUET_DIRECTORY = '/home/database/parquet'
+PARQUET_TABLES = ['loaded_data', 'model_input', 'features', 'target', 'predictions']
+
+# LightGBM dataset cache: the binned training Dataset is saved in
+# DATASET_CACHE_DIRECTORY and reused while the features and target are the
+# same, or extended by at most DATASET_CACHE_MAX_GROWTH times as many rows
+DATASET_CACHE_ENABLED = True
+DATASET_CACHE_DIRECTORY = '/home/database/lgb_dataset_cache'
+DATASET_CACHE_MAX_GROWTH = 0.5
+
+# Hyperparameter tuning: get_trained_model searches the parameters of the
+# booster by successive halving (see tuning.py) before training it. The
+# TUNING_CANDIDATES candidates of TUNING_SEARCH_SPACE are trained with
+# TUNING_MIN_ROUNDS rounds, and the best 1/TUNING_ETA of each rung with
+# TUNING_ETA times as many, up to 'n_estimators' of model_config. They are
+# evaluated on TUNING_VALIDATION_SIZE of the training rows, in a pool of
+# TUNING_WORKERS processes (None: one per core), on CPU
+TUNING_ENABLED = False
+TUNING_CANDIDATES = 27
+TUNING_MIN_ROUNDS = 12
+TUNING_ETA = 3
+TUNING_WORKERS = None
+TUNING_VALIDATION_SIZE = 0.2
+TUNING_SEARCH_SPACE = {
+    'num_leaves': ('int', 8, 128),
+    'learning_rate': ('log_uniform', 0.01, 0.3),
+    'min_child_samples': ('int', 5, 100),
+    'colsample_bytree': ('uniform', 0.5, 1.0),
+    'subsample': ('uniform', 0.5, 1.0),
+    'subsample_freq': [0, 1],
+    'reg_alpha': ('log_uniform', 1e-3, 10.0),
+    'reg_lambda': ('log_uniform', 1e-3, 10.0),
+}
+
+# Cross validation: get_trained_model also evaluates the model by stratified
+# k-fold cross validation with CV_FOLDS folds, trained in a pool of
+# CV_WORKERS processes (None: one per core) on CPU. The out-of-fold
+# predictions and the metrics of the folds are saved under CV_CACHE_DIRECTORY
+# by the fingerprint of the data and the configuration, and reused by the
+# runs with the same fingerprint
+CV_ENABLED = False
+CV_FOLDS = 5
+CV_WORKERS = None
+CV_CACHE_DIRECTORY = '/home/database/cv_cache'
+
+# Incremental training: get_trained_model continues boosting the booster of
+# the Production model for INCREMENTAL_ROUNDS rounds on the leads created
+# after its training watermark, the latest 'created_date' it was trained on.
+# The newest INCREMENTAL_HOLDOUT_SIZE of these leads are held out to compare
+# it with a full retrain on all the other leads, or only with the Production
+# model if INCREMENTAL_COMPARE_FULL_RETRAIN is False, and the best model is
+# moved to the Production stage
+INCREMENTAL_TRAINING_ENABLED = False
+INCREMENTAL_ROUNDS = 20
+INCREMENTAL_HOLDOUT_SIZE = 0.2
+INCREMENTAL_COMPARE_FULL_RETRAIN = True
+MODEL_NAME = 'LightGBM'
+
 TRACKING_URI = 'http://0.0.0.0:6006'
 EXPERIMENT = 'Lead_scoring_mlflow_production'
 
 
+# LightGBM device of the models the pipeline trains. The pycaret experiment
+# ran on 'gpu', but the workers of the pipeline are CPU-only and a booster
+# asking for a device LightGBM wasn't built with fails to train. The tuning
+# trials and the cross validation folds always run on CPU
+MODEL_DEVICE = 'cpu'
+
 # model config imported from pycaret experimentation
 model_config = {
     'boosting_type': 'gbdt',
     'class_weight': None,
     'colsample_bytree': 1.0,
-    'device': 'gpu',
+    'device': MODEL_DEVICE,
     'importance_type': 'split',
     'learning_rate': 0.1,
     'max_depth': -1,
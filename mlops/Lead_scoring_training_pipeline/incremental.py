@@ -0,0 +1,159 @@
+'''
+filename: incremental.py
+functions: get_production_model, split_new_leads, train_incremental_model
+Continued training of the Production model on the leads created after its
+training watermark, run by get_trained_model when
+INCREMENTAL_TRAINING_ENABLED is set. The continued model is compared on the
+newest of these leads with a full retrain, or with the Production model, and
+only the best one is moved to the Production stage.
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import time
+
+import lightgbm as lgb
+import numpy as np
+from sklearn.metrics import roc_auc_score
+
+
+###############################################################################
+# Define the function to get the Production model
+# ##############################################################################
+
+def get_production_model(model_name, client=None):
+    '''
+    Returns the booster of the model of the Production stage, its version and
+    its training watermark, the latest 'created_date' of the leads it was
+    trained on, or None if there is no Production model or its run didn't log
+    a watermark.
+    '''
+    import mlflow
+    import mlflow.lightgbm
+    client = client or mlflow.tracking.MlflowClient()
+    try:
+        versions = client.get_latest_versions(model_name, stages=['Production'])
+    except mlflow.exceptions.MlflowException:
+        versions = []
+    if not versions:
+        print("No Production model to continue, training from scratch")
+        return None
+    version = versions[0]
+    watermark = client.get_run(version.run_id).data.params.get('training_watermark')
+    if watermark is None:
+        print(f"Production model version {version.version} has no training watermark, training from scratch")
+        return None
+    booster = mlflow.lightgbm.load_model(f"models:/{model_name}/{version.version}")
+    # a model registered as an LGBMClassifier is continued through its booster
+    return getattr(booster, 'booster_', booster), version.version, watermark
+
+
+###############################################################################
+# Define the functions to continue the Production model
+# ##############################################################################
+
+def split_new_leads(created_dates, watermark, holdout_size):
+    '''
+    Returns the positions of the leads created after the watermark, oldest
+    first, split into the leads to train on and the newest 'holdout_size' of
+    them, held out, as a tuple (train_new, holdout).
+    '''
+    new_indices = np.flatnonzero((created_dates > watermark).to_numpy())
+    new_indices = new_indices[np.argsort(created_dates.to_numpy()[new_indices], kind='stable')]
+    n_holdout = int(round(len(new_indices) * holdout_size))
+    return new_indices[:len(new_indices) - n_holdout], new_indices[len(new_indices) - n_holdout:]
+
+
+def train_incremental_model(X, y, created_dates, params, num_boost_round, production, model_name,
+                            rounds=20, holdout_size=0.2, compare_full_retrain=True, build_dataset=None):
+    '''
+    This function continues boosting the Production booster for 'rounds'
+    rounds on the leads created after its training watermark, within the
+    active mlflow run. The newest 'holdout_size' of these leads are held out:
+    the continued model is compared on them with a full retrain on all the
+    other leads, or with the Production model if 'compare_full_retrain' is
+    False. The model with the best holdout AUC is registered and moved to the
+    Production stage, the continued model winning ties, and nothing is
+    registered if the Production model stays the best.
+
+
+    INPUTS
+        X, y : features and target tables
+        created_dates : 'created_date' of every row of the features
+        params : parameters of lgb.train
+        num_boost_round : boosting rounds of the full retrain
+        production : tuple returned by get_production_model
+        model_name : name of the registered model
+        rounds : boosting rounds added to the Production booster
+        holdout_size : share of the new leads held out
+        compare_full_retrain : if False the continued model is only compared
+                               with the Production model
+        build_dataset : function of the positions of the rows of the full
+                        retrain returning their LightGBM Dataset, e.g.
+                        through the dataset cache. The held out leads are
+                        never part of them, so they don't shape its bins
+
+
+    OUTPUT
+        name of the promoted model ('incremental', 'full_retrain' or
+        'production'), or None if there are not enough new leads. The
+        holdout AUC and the training time of every candidate, the promoted
+        model and the new training watermark are logged into the mlflow run
+
+
+    SAMPLE USAGE
+        promoted = train_incremental_model(X, y, created_dates, params, num_boost_round, production,
+                                           'LightGBM')
+    '''
+    import mlflow
+    import mlflow.lightgbm
+    booster, version, watermark = production
+    train_new, holdout = split_new_leads(created_dates, watermark, holdout_size)
+    if len(train_new) == 0 or y.iloc[holdout, 0].nunique() < 2:
+        print(f"Not enough leads created after {watermark} to continue the Production model")
+        return None
+    X_holdout, y_holdout = X.iloc[holdout], y.iloc[holdout, 0]
+    print(f"Continuing Production model version {version} on {len(train_new)} new leads, "
+          f"{len(holdout)} held out")
+
+    models, aucs, seconds = {}, {}, {}
+    start = time.perf_counter()
+    train_set = lgb.Dataset(X.iloc[train_new], label=y.iloc[train_new, 0], params=params)
+    models['incremental'] = lgb.train(params, train_set, num_boost_round=rounds, init_model=booster)
+    seconds['incremental'] = time.perf_counter() - start
+    if compare_full_retrain:
+        start = time.perf_counter()
+        full_indices = np.setdiff1d(np.arange(len(X)), holdout)
+        if build_dataset is None:
+            full_set = lgb.Dataset(X.iloc[full_indices], label=y.iloc[full_indices, 0], params=params)
+        else:
+            full_set = build_dataset(full_indices)
+        models['full_retrain'] = lgb.train(params, full_set, num_boost_round=num_boost_round)
+        seconds['full_retrain'] = time.perf_counter() - start
+    else:
+        models['production'] = booster
+    for name, model in models.items():
+        aucs[name] = roc_auc_score(y_holdout, model.predict(X_holdout))
+        print(f"Holdout AUC of the {name} model: {aucs[name]:.4f}")
+
+    # the first best, the continued model wins ties
+    promoted = max(aucs, key=lambda name: aucs[name])
+    mlflow.log_params({'incremental_base_version': version, 'incremental_new_leads': len(train_new),
+                       'incremental_holdout_leads': len(holdout), 'promoted_model': promoted})
+    for name in models:
+        mlflow.log_metric(f'holdout_auc_{name}', aucs[name])
+    for name in seconds:
+        mlflow.log_metric(f'{name}_train_seconds', seconds[name])
+    if promoted == 'production':
+        print(f"Production model version {version} kept")
+        return promoted
+    # both candidates were trained on the leads up to the holdout
+    mlflow.log_param('training_watermark', created_dates.iloc[train_new].max())
+    model_info = mlflow.lightgbm.log_model(lgb_model=models[promoted], artifact_path=model_name,
+                                           registered_model_name=model_name)
+    mlflow.tracking.MlflowClient().transition_model_version_stage(
+        model_name, str(model_info.registered_model_version), 'Production', archive_existing_versions=True)
+    print(f"Promoted the {promoted} model as version {model_info.registered_model_version}")
+    return promoted
@@ -6,7 +6,7 @@ from airflow.operators.python import PythonOperator
 from airflow.operators.bash import BashOperator
 
 from datetime import datetime, timedelta
-from Lead_scoring_training_pipeline.utils import *
+from Lead_scoring_training_pipeline.tasks import *
 
 ###############################################################################
 # Define default arguments and DAG
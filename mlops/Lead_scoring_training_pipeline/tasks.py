@@ -0,0 +1,21 @@
+'''
+filename: tasks.py
+functions: encode_features, get_trained_model
+The callables of the tasks of lead_scoring_training_pipeline.py. They import
+utils, and pandas, mlflow, lightgbm and sklearn with it, only when a task runs,
+so that parsing the DAG file stays fast (see lazy_task).
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+from Lead_scoring_common.lazy_tasks import lazy_task
+
+
+###############################################################################
+# Define the callables of the tasks
+# ##############################################################################
+
+encode_features = lazy_task('Lead_scoring_training_pipeline.utils', 'encode_features')
+get_trained_model = lazy_task('Lead_scoring_training_pipeline.utils', 'get_trained_model')
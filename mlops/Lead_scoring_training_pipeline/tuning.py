@@ -0,0 +1,162 @@
+'''
+filename: tuning.py
+functions: sample_candidates, successive_halving
+Successive halving search of the parameters of the LightGBM booster, run by
+get_trained_model when TUNING_ENABLED is set.
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import lightgbm as lgb
+import numpy as np
+from sklearn.metrics import roc_auc_score
+
+# training and validation rows of the trials, set once in every worker of the pool
+_trial_data = {}
+
+
+###############################################################################
+# Define the function to sample the candidates
+# ##############################################################################
+
+def sample_candidates(search_space, n_candidates, seed=100):
+    '''
+    This function draws the parameters of the candidates from the search
+    space.
+
+
+    INPUTS
+        search_space : dictionary mapping every parameter to its distribution,
+                       ('uniform', low, high), ('log_uniform', low, high),
+                       ('int', low, high) with high included, or a list of
+                       values to choose from
+        n_candidates : number of candidates
+        seed : seed of the random generator
+
+
+    OUTPUT
+        list of dictionaries of parameters, one per candidate
+
+
+    SAMPLE USAGE
+        candidates = sample_candidates({'num_leaves': ('int', 8, 128)}, 27)
+    '''
+    rng = np.random.default_rng(seed)
+    candidates = []
+    for _ in range(n_candidates):
+        candidate = {}
+        for name, distribution in search_space.items():
+            if isinstance(distribution, list):
+                candidate[name] = distribution[rng.integers(len(distribution))]
+            elif distribution[0] == 'uniform':
+                candidate[name] = float(rng.uniform(distribution[1], distribution[2]))
+            elif distribution[0] == 'log_uniform':
+                candidate[name] = float(np.exp(rng.uniform(np.log(distribution[1]), np.log(distribution[2]))))
+            elif distribution[0] == 'int':
+                candidate[name] = int(rng.integers(distribution[1], distribution[2] + 1))
+            else:
+                raise ValueError(f"Unknown distribution {distribution[0]} of {name}")
+        candidates.append(candidate)
+    return candidates
+
+
+###############################################################################
+# Define the functions running the trials in the pool
+# ##############################################################################
+
+def _init_trial_worker(X_train, y_train, X_valid, y_valid):
+    _trial_data.update(X_train=X_train, y_train=y_train, X_valid=X_valid, y_valid=y_valid)
+
+
+def _run_trial(trial, params, num_boost_round):
+    '''
+    Trains a booster on the training rows of the worker and returns its AUC on
+    the validation rows.
+    '''
+    start = time.perf_counter()
+    train_set = lgb.Dataset(_trial_data['X_train'], label=_trial_data['y_train'], params=params)
+    booster = lgb.train(params, train_set, num_boost_round=num_boost_round)
+    auc = roc_auc_score(_trial_data['y_valid'], booster.predict(_trial_data['X_valid']))
+    return {'trial': trial, 'auc': float(auc), 'seconds': time.perf_counter() - start}
+
+
+def successive_halving(X_train, y_train, X_valid, y_valid, base_params, search_space, n_candidates=27,
+                       min_rounds=12, max_rounds=100, eta=3, workers=None, seed=100, log_rung=None):
+    '''
+    This function searches the parameters of the booster by successive
+    halving: every candidate is trained with 'min_rounds' boosting rounds, the
+    best 1/eta of them by validation AUC are trained again with eta times as
+    many rounds, and so on until one candidate is left or the rounds reach
+    'max_rounds'. The trials of a rung run concurrently in a process pool,
+    the number of threads of each trial is capped so that the pool uses the
+    cores of the machine without oversubscribing them.
+
+
+    INPUTS
+        X_train, y_train : rows the trials are trained on
+        X_valid, y_valid : rows the trials are evaluated on
+        base_params : parameters of lgb.train the candidates override
+        search_space : distributions of the parameters, see sample_candidates
+        n_candidates : number of candidates of the first rung
+        min_rounds : boosting rounds of the first rung
+        max_rounds : maximum boosting rounds of a trial
+        eta : factor by which the candidates are cut and the rounds increased
+              at every rung
+        workers : number of processes of the pool, defaults to the number of
+                  cores
+        seed : seed of the candidates
+        log_rung : function called with the rung number, its rounds and the
+                   list of its trials, once all the trials of the rung ended,
+                   e.g. to log them to mlflow in one batch
+
+
+    OUTPUT
+        tuple (parameters of the best candidate, its boosting rounds, list of
+        all the trials with their rung, rounds, parameters and AUC)
+
+
+    SAMPLE USAGE
+        best_params, rounds, trials = successive_halving(X_train, y_train, X_valid, y_valid,
+                                                         params, TUNING_SEARCH_SPACE)
+    '''
+    cores = os.cpu_count() or 1
+    workers = min(workers or cores, n_candidates)
+    # n_jobs is the alias of num_threads the model config sets
+    threads = max(1, cores // workers)
+    candidates = [dict(base_params, **candidate, n_jobs=threads)
+                  for candidate in sample_candidates(search_space, n_candidates, seed)]
+
+    trials, alive, rung, rounds = [], list(range(n_candidates)), 0, min_rounds
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_trial_worker,
+                             initargs=(X_train, y_train, X_valid, y_valid)) as pool:
+        while True:
+            futures = [pool.submit(_run_trial, candidate, candidates[candidate], rounds) for candidate in alive]
+            rung_trials = [dict(future.result(), rung=rung, rounds=rounds, params=candidates[candidate])
+                           for candidate, future in zip(alive, futures)]
+            trials += rung_trials
+            if log_rung is not None:
+                log_rung(rung, rounds, rung_trials)
+            print(f"Rung {rung}: {len(alive)} candidate(s) with {rounds} rounds, "
+                  f"best validation AUC {max(trial['auc'] for trial in rung_trials):.4f}")
+
+            if len(alive) == 1 or rounds >= max_rounds:
+                break
+            # ties are broken by the candidate number, so that the search is reproducible
+            ranked = sorted(rung_trials, key=lambda trial: (-trial['auc'], trial['trial']))
+            alive = [trial['trial'] for trial in ranked[:max(1, math.ceil(len(alive) / eta))]]
+            rung, rounds = rung + 1, min(rounds * eta, max_rounds)
+
+    best = min(rung_trials, key=lambda trial: (-trial['auc'], trial['trial']))
+    # the full data fit runs alone, with the threads of the base parameters
+    best_params = dict(candidates[best['trial']])
+    best_params.pop('n_jobs')
+    if 'n_jobs' in base_params:
+        best_params['n_jobs'] = base_params['n_jobs']
+    return best_params, rounds, trials
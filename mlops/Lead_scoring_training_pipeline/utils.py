@@ -26,18 +26,52 @@ from sklearn.metrics import *
 from datetime import datetime
 from datetime import date
 from Lead_scoring_training_pipeline.constants import *
+from Lead_scoring_common.stage_cache import (
+    file_fingerprint,
+    compute_fingerprint,
+    get_table_fingerprint,
+    is_stage_cached,
+    record_stage_run
+)
+from Lead_scoring_common.storage import get_storage
+from Lead_scoring_common.sqlite_connection import get_connection
+from Lead_scoring_common.instrumentation import instrument_task
+from Lead_scoring_common import one_hot_encoder
+from Lead_scoring_common.dataset_cache import load_or_build_dataset, row_hashes, rows_fingerprint
+from Lead_scoring_training_pipeline.tuning import successive_halving
+from Lead_scoring_training_pipeline import cross_validation, incremental
+from mlflow.entities import Metric, Param
+from Lead_scoring_common.one_hot_encoder import compile_one_hot_encoder, encode_features_frame
 import os
+import time
+
+# version of the code of the stages, part of the fingerprint of every stage
+CODE_VERSION = compute_fingerprint(file_fingerprint(__file__), file_fingerprint(one_hot_encoder.__file__))
+
+# backend the tables are read from and written to, see STORAGE_BACKEND
+STORAGE = get_storage(STORAGE_BACKEND, PARQUET_DIRECTORY, PARQUET_TABLES)
+
+# output column of every level of FEATURES_TO_ENCODE, resolved once
+ONE_HOT_ENCODER = compile_one_hot_encoder(ONE_HOT_ENCODED_FEATURES, FEATURES_TO_ENCODE)
+
+
+def metrics_db_path():
+    '''
+    Returns the path of the db the metrics of the tasks are written to, see
+    instrument_task.
+    '''
+    return os.path.join(DB_PATH, DB_FILE_NAME)
+
+
 ###############################################################################
 # Define the function to encode features
 # ##############################################################################
 def is_table_has_value(cnx, table_name):
     # Check if the table exists
-    check_table = pd.read_sql(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}';", cnx).shape[0]
     print(table_name)
-    if check_table == 1:
+    if STORAGE.exists(cnx, table_name):
         # Check if the table has any rows
-        check_rows = pd.read_sql(f"SELECT COUNT(*) as count FROM {table_name};", cnx)
-        row_count = check_rows['count'].iloc[0]
+        row_count = STORAGE.count(cnx, table_name)
         if row_count > 0:
             print("Table has values")
             return True
@@ -48,6 +82,7 @@ def is_table_has_value(cnx, table_name):
         print("Table doesn't exist")
         return False
     
+@instrument_task(metrics_db_path)
 def encode_features():
     '''
     This function one hot encodes the categorical features present in our  
@@ -65,6 +100,9 @@ def encode_features():
         1. Save the encoded features in a table - features
         2. Save the target variable in a separate table - target
 
+        The encoding is skipped if 'model_input' and the encoding constants are
+        unchanged since the last run (see STAGE_CACHE_ENABLED).
+
 
     SAMPLE USAGE
         encode_features()
@@ -73,40 +111,27 @@ def encode_features():
         pipeline from the pre-requisite module for this.
     '''
     db_full_path = os.path.join(DB_PATH, DB_FILE_NAME)
-    cnx = sqlite3.connect(db_full_path)
-    if is_table_has_value(cnx, DB_MODEL_INPUT_TABLE_NAME):
-        print("Loading model_input table")
-        df = pd.read_sql(f'select * from {DB_MODEL_INPUT_TABLE_NAME}', cnx)        
-         
-        print("One hot encoding features")
-       # Implement these steps to prevent dimension mismatch during inference
-        encoded_df = pd.DataFrame(columns= ONE_HOT_ENCODED_FEATURES) # from constants.py
-        placeholder_df = pd.DataFrame()
-
-        # One-Hot Encoding using get_dummies for the specified categorical features
-        for f in FEATURES_TO_ENCODE:
-            if(f in df.columns):
-                encoded = pd.get_dummies(df[f])
-                encoded = encoded.add_prefix(f + '_')
-                placeholder_df = pd.concat([placeholder_df, encoded], axis=1)
-            else:
-                print(f + ',Feature not found')
-                #return df
-
-        # Implement these steps to prevent dimension mismatch during inference
-        for feature in encoded_df.columns:
-            if feature in df.columns:
-                encoded_df[feature] = df[feature]
-            if feature in placeholder_df.columns:
-                encoded_df[feature] = placeholder_df[feature]
-        
-        encoded_df.fillna(0, inplace=True)
-        target = df[['app_complete_flag']]
-        print("Storing target features to 'target' table")            
-        target.to_sql(name=DB_TARGET_TABLE_NAME, con=cnx, if_exists='replace', index=False)   
-        print("Storing rest of features to 'feature' table")            
-        encoded_df.to_sql(name=DB_FEATURES_TABLE_NAME, con=cnx, if_exists='replace', index=False)   
-    cnx.close()
+    with get_connection(db_full_path) as cnx:
+        output_tables = [DB_FEATURES_TABLE_NAME, DB_TARGET_TABLE_NAME]
+        fingerprint = compute_fingerprint(get_table_fingerprint(cnx, DB_MODEL_INPUT_TABLE_NAME), CODE_VERSION,
+                                          ONE_HOT_ENCODED_FEATURES, FEATURES_TO_ENCODE)
+        if STAGE_CACHE_ENABLED and is_stage_cached(cnx, 'training_encode_features', fingerprint,
+                                                    output_tables, STORAGE):
+            return
+
+        if is_table_has_value(cnx, DB_MODEL_INPUT_TABLE_NAME):
+            print("Loading model_input table")
+            df = STORAGE.read(cnx, DB_MODEL_INPUT_TABLE_NAME)
+
+            print("One hot encoding features")
+            # same encoder as the inference pipeline, to prevent dimension mismatch during inference
+            encoded_df = encode_features_frame(df, ONE_HOT_ENCODER)
+            target = df[['app_complete_flag']]
+            print("Storing target features to 'target' table")
+            STORAGE.write(cnx, target, DB_TARGET_TABLE_NAME, if_exists='replace')
+            print("Storing rest of features to 'feature' table")
+            STORAGE.write(cnx, encoded_df, DB_FEATURES_TABLE_NAME, if_exists='replace')
+            record_stage_run(cnx, 'training_encode_features', fingerprint, output_tables)
     print("Features and target variables have been successfully encoded and saved to the database.")
 
 
@@ -114,6 +139,134 @@ def encode_features():
 # Define the function to train the model
 # ##############################################################################
 
+def booster_params(config):
+    '''
+    Converts the parameters of the LGBMClassifier in 'model_config' into the
+    parameters of lgb.train, which takes the cached Dataset, and the number
+    of boosting rounds. The names of the classifier are aliases LightGBM
+    accepts, except for the ones only the classifier uses.
+    '''
+    params = {key: value for key, value in config.items()
+              if key not in ('n_estimators', 'class_weight', 'importance_type', 'silent', 'objective')}
+    params['objective'] = config.get('objective') or 'binary'
+    params['verbosity'] = -1
+    return params, config.get('n_estimators', 100)
+
+
+def build_training_dataset(X, y, params):
+    '''
+    Returns the constructed LightGBM Dataset of the rows, through the dataset
+    cache if DATASET_CACHE_ENABLED (see load_or_build_dataset), with its
+    cache status and construction time, as a tuple (dataset, status,
+    construct_seconds). Only the rows the model is trained on are passed, so
+    that the rows it is evaluated on don't shape its bins.
+    '''
+    if DATASET_CACHE_ENABLED:
+        return load_or_build_dataset(X, y, params, DATASET_CACHE_DIRECTORY, DATASET_CACHE_MAX_GROWTH)
+    start = time.perf_counter()
+    dataset = lgb.Dataset(X, label=y.iloc[:, 0], params=params).construct()
+    return dataset, 'disabled', time.perf_counter() - start
+
+
+def tune_booster_params(X, y, train_indices, params, num_boost_round):
+    '''
+    This function searches the parameters of the booster by successive
+    halving on the training rows (see successive_halving), within the active
+    mlflow run. The validation AUC of the trials of every rung is logged in a
+    single batch, and the trials, the best parameters, the tuning wall time
+    and the trials per minute once the search ended.
+
+
+    INPUTS
+        X, y : features and target tables
+        train_indices : positions of the training rows, split again into the
+                        rows the trials are trained and evaluated on
+        params : parameters of lgb.train the candidates override
+        num_boost_round : maximum boosting rounds of a trial
+
+
+    OUTPUT
+        tuple (parameters of the best candidate, on CPU, its boosting rounds)
+
+
+    SAMPLE USAGE
+        params, num_boost_round = tune_booster_params(X, y, train_indices, params, num_boost_round)
+    '''
+    client = mlflow.tracking.MlflowClient()
+    run_id = mlflow.active_run().info.run_id
+
+    def log_rung(rung, rounds, trials):
+        timestamp = int(time.time() * 1000)
+        client.log_batch(run_id, metrics=[Metric(f"trial_{trial['trial']:03d}_valid_auc", trial['auc'], timestamp, rung)
+                                          for trial in trials])
+
+    fit_indices, valid_indices = train_test_split(train_indices, test_size=TUNING_VALIDATION_SIZE, random_state=100)
+    start = time.perf_counter()
+    best_params, best_rounds, trials = successive_halving(
+        X.iloc[fit_indices].to_numpy(), y.iloc[fit_indices, 0].to_numpy(),
+        X.iloc[valid_indices].to_numpy(), y.iloc[valid_indices, 0].to_numpy(),
+        dict(params, device='cpu'), TUNING_SEARCH_SPACE, n_candidates=TUNING_CANDIDATES,
+        min_rounds=TUNING_MIN_ROUNDS, max_rounds=num_boost_round, eta=TUNING_ETA, workers=TUNING_WORKERS,
+        log_rung=log_rung)
+    tuning_seconds = time.perf_counter() - start
+    trials_per_minute = len(trials) / tuning_seconds * 60
+
+    print(f"Tuning: {len(trials)} trials in {tuning_seconds:.1f}s ({trials_per_minute:.1f} trials per minute), "
+          f"best parameters {best_params} with {best_rounds} rounds")
+    mlflow.log_dict({'trials': trials}, 'tuning_trials.json')
+    client.log_batch(run_id,
+                     metrics=[Metric('tuning_seconds', tuning_seconds, int(time.time() * 1000), 0),
+                              Metric('tuning_trials_per_minute', trials_per_minute, int(time.time() * 1000), 0)],
+                     params=[Param(f'tuned_{name}', str(best_params[name])) for name in TUNING_SEARCH_SPACE]
+                            + [Param('tuned_num_boost_round', str(best_rounds))])
+    return best_params, best_rounds
+
+
+def log_cross_validation(X, y, params, num_boost_round):
+    '''
+    This function cross validates the booster (see cross_validate) within the
+    active mlflow run, on CPU, and logs the metrics of every fold as the
+    steps of the 'cv_fold_<metric>' metrics, their mean and standard
+    deviation, the AUC of the out-of-fold predictions and the predictions
+    themselves. The results are reused from CV_CACHE_DIRECTORY when the rows,
+    the parameters and the code of the cross validation are unchanged.
+
+
+    INPUTS
+        X, y : features and target tables
+        params : parameters of lgb.train
+        num_boost_round : boosting rounds of every fold
+
+
+    OUTPUT
+        dictionary of the results returned by cross_validate
+
+
+    SAMPLE USAGE
+        results = log_cross_validation(X, y, params, num_boost_round)
+    '''
+    params = dict(params, device='cpu')
+    # the threads of the folds depend on the pool, not on the configuration
+    fingerprint = compute_fingerprint(rows_fingerprint(row_hashes(X, y), X.columns),
+                                      sorted((key, value) for key, value in params.items() if key != 'n_jobs'),
+                                      num_boost_round, CV_FOLDS, file_fingerprint(cross_validation.__file__))
+    results = cross_validation.cross_validate(X, y, params, num_boost_round, CV_FOLDS, CV_CACHE_DIRECTORY,
+                                              fingerprint, workers=CV_WORKERS)
+
+    timestamp = int(time.time() * 1000)
+    metrics = [Metric(f'cv_fold_{name}', value, timestamp, fold_result['fold'])
+               for fold_result in results['fold_results'] for name, value in fold_result['metrics'].items()]
+    metrics += [Metric(f'cv_{name}_mean', value, timestamp, 0) for name, value in results['mean'].items()]
+    metrics += [Metric(f'cv_{name}_std', value, timestamp, 0) for name, value in results['std'].items()]
+    metrics.append(Metric('cv_oof_auc', results['oof_auc'], timestamp, 0))
+    mlflow.tracking.MlflowClient().log_batch(mlflow.active_run().info.run_id, metrics=metrics,
+                                             params=[Param('cv_folds', str(CV_FOLDS)),
+                                                     Param('cv_cache', results['status'])])
+    mlflow.log_artifact(results['predictions_path'], 'cross_validation')
+    return results
+
+
+@instrument_task(metrics_db_path)
 def get_trained_model():
     '''
     This function setups mlflow experiment to track the run of the training pipeline. It 
@@ -133,78 +286,127 @@ def get_trained_model():
         Logs the metrics and parameters into mlflow run
         Calculate auc from the test data and log into mlflow run  
 
+        The binned LightGBM Dataset of the training rows is reused from the
+        previous run when these rows are unchanged or extended (see
+        DATASET_CACHE_ENABLED), its construction time is logged into the run.
+        With TUNING_ENABLED the parameters of the model are searched first,
+        see tune_booster_params, and with CV_ENABLED the model is also
+        evaluated by k-fold cross validation, see log_cross_validation.
+        The latest 'created_date' of the leads is logged as the training
+        watermark of the model. With INCREMENTAL_TRAINING_ENABLED the
+        Production model is continued on the leads created after its
+        watermark instead, see incremental.train_incremental_model.
+
     SAMPLE USAGE
         get_trained_model()
     '''
 
     db_full_path = os.path.join(DB_PATH, DB_FILE_NAME)
-    cnx = sqlite3.connect(db_full_path)
-    print(DB_PATH , DB_FILE_NAME)
-    if is_table_has_value(cnx, DB_FEATURES_TABLE_NAME):
+    with get_connection(db_full_path) as cnx:
+        print(DB_PATH , DB_FILE_NAME)
+        if not is_table_has_value(cnx, DB_FEATURES_TABLE_NAME):
+            return
+
         print("Loading 'features' table")
-        X = pd.read_sql(f'select * from {DB_FEATURES_TABLE_NAME}', cnx)        
+        X = STORAGE.read(cnx, DB_FEATURES_TABLE_NAME)
 
         print("Loading 'target' table")
-        y = pd.read_sql(f'select * from {DB_TARGET_TABLE_NAME}', cnx)        
+        y = STORAGE.read(cnx, DB_TARGET_TABLE_NAME)
 
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size = 0.2, random_state = 100)
-        
+        # the rows of 'features' are the rows of 'model_input', in the same order
+        created_dates = None
+        if STORAGE.exists(cnx, DB_MODEL_INPUT_TABLE_NAME):
+            created_dates = STORAGE.read(cnx, DB_MODEL_INPUT_TABLE_NAME, columns=['created_date'])['created_date']
+            if len(created_dates) != len(X):
+                created_dates = None
 
-        #Model Training
+    # the same split as train_test_split(X, y), as positions of the rows
+    train_indices, test_indices = train_test_split(np.arange(len(X)), test_size = 0.2, random_state = 100)
+    X_test, y_test = X.iloc[test_indices], y.iloc[test_indices]
 
-        #make sure to run mlflow server before this. 
-        
-        run_name = EXPERIMENT + '_' + date.today().strftime("%d_%m_%Y")
-        mlflow.set_tracking_uri(TRACKING_URI)
-
-        try:
-            # Creating an experiment
-            print("Creating mlflow experiment")
-            logging.info("Creating mlflow experiment")
-            mlflow.create_experiment(EXPERIMENT)
-        except:
-            pass
-        # Setting the environment with the created experiment
-        mlflow.set_experiment(EXPERIMENT)
-        
-        with mlflow.start_run(run_name=run_name) as run:
-            #Model Training
-            clf = lgb.LGBMClassifier()
-            clf.set_params(**model_config) 
-            clf.fit(X_train, y_train)
-
-            mlflow.lightgbm.log_model(lgb_model=clf,artifact_path="LightGBM", registered_model_name='LightGBM')
-            mlflow.log_params(model_config)    
-
-            # predict the results on training dataset
-            y_pred=clf.predict(X_test)
-
-            #Log metrics
-            acc=accuracy_score(y_pred, y_test)
-            precision = precision_score(y_pred, y_test,average= 'macro')
-            recall = recall_score(y_pred, y_test, average= 'macro')
-            f1 = f1_score(y_pred, y_test, average='macro')
-            auc = roc_auc_score(y_pred, y_test, average='weighted', multi_class='ovr')
-            cm = confusion_matrix(y_test, y_pred)
-            tn = cm[0][0]
-            fn = cm[1][0]
-            tp = cm[1][1]
-            fp = cm[0][1]
-
-            print("Precision=", precision)
-            print("Recall=", recall)
-            print("AUC=", auc)
-
-            mlflow.log_metric('test_accuracy', acc)            
-            mlflow.log_metric("Precision", precision)
-            mlflow.log_metric("Recall", recall)
-            mlflow.log_metric("f1", f1)           
-            mlflow.log_metric("AUC", auc)          
-            mlflow.log_metric("True Negative", tn)            
-            mlflow.log_metric("False Negative", fn)
-            mlflow.log_metric("True Positive", tp)  
-            mlflow.log_metric("False Positive", fp)
-
-            runID = run.info.run_uuid
-            print("Inside MLflow Run with id {}".format(runID))        
-    cnx.close()
+    params, num_boost_round = booster_params(model_config)
+
+
+    #Model Training
+
+    #make sure to run mlflow server before this.
+
+    run_name = EXPERIMENT + '_' + date.today().strftime("%d_%m_%Y")
+    mlflow.set_tracking_uri(TRACKING_URI)
+
+    try:
+        # Creating an experiment
+        print("Creating mlflow experiment")
+        logging.info("Creating mlflow experiment")
+        mlflow.create_experiment(EXPERIMENT)
+    except:
+        pass
+    # Setting the environment with the created experiment
+    mlflow.set_experiment(EXPERIMENT)
+
+    production = None
+    if INCREMENTAL_TRAINING_ENABLED and created_dates is not None:
+        production = incremental.get_production_model(MODEL_NAME)
+
+    # the bins are computed from the training rows only, the test rows are
+    # predicted from their values with the thresholds of these bins
+    if production is None:
+        training_rows = np.sort(train_indices)
+        dataset, dataset_cache_status, construct_seconds = build_training_dataset(
+            X.iloc[training_rows], y.iloc[training_rows], params)
+
+    with mlflow.start_run(run_name=run_name) as run:
+        if production is not None:
+            mlflow.log_params(model_config)
+            incremental.train_incremental_model(
+                X, y, created_dates, dict(params, device=MODEL_DEVICE), num_boost_round, production,
+                MODEL_NAME, INCREMENTAL_ROUNDS, INCREMENTAL_HOLDOUT_SIZE, INCREMENTAL_COMPARE_FULL_RETRAIN,
+                build_dataset=lambda rows: build_training_dataset(X.iloc[rows], y.iloc[rows], params)[0])
+            return
+
+        if TUNING_ENABLED:
+            params, num_boost_round = tune_booster_params(X, y, train_indices, params, num_boost_round)
+        if CV_ENABLED:
+            log_cross_validation(X, y, params, num_boost_round)
+
+        #Model Training on the rows of the split
+        clf = lgb.train(params, dataset, num_boost_round=num_boost_round)
+
+        mlflow.lightgbm.log_model(lgb_model=clf,artifact_path="LightGBM", registered_model_name='LightGBM')
+        mlflow.log_params(model_config)
+        mlflow.log_param('dataset_cache', dataset_cache_status)
+        if created_dates is not None:
+            mlflow.log_param('training_watermark', created_dates.max())
+        mlflow.log_metric('dataset_construct_seconds', construct_seconds)
+
+        # predict the results on training dataset, the booster predicts the probability of class 1
+        y_pred = (clf.predict(X_test) > 0.5).astype(int)
+
+        #Log metrics
+        acc=accuracy_score(y_pred, y_test)
+        precision = precision_score(y_pred, y_test,average= 'macro')
+        recall = recall_score(y_pred, y_test, average= 'macro')
+        f1 = f1_score(y_pred, y_test, average='macro')
+        auc = roc_auc_score(y_pred, y_test, average='weighted', multi_class='ovr')
+        cm = confusion_matrix(y_test, y_pred)
+        tn = cm[0][0]
+        fn = cm[1][0]
+        tp = cm[1][1]
+        fp = cm[0][1]
+
+        print("Precision=", precision)
+        print("Recall=", recall)
+        print("AUC=", auc)
+
+        mlflow.log_metric('test_accuracy', acc)
+        mlflow.log_metric("Precision", precision)
+        mlflow.log_metric("Recall", recall)
+        mlflow.log_metric("f1", f1)
+        mlflow.log_metric("AUC", auc)
+        mlflow.log_metric("True Negative", tn)
+        mlflow.log_metric("False Negative", fn)
+        mlflow.log_metric("True Positive", tp)
+        mlflow.log_metric("False Positive", fp)
+
+        runID = run.info.run_id
+        print("Inside MLflow Run with id {}".format(runID))
@@ -0,0 +1,89 @@
+'''
+filename: bench_dag_parse_time.py
+Import time of the DAG files, as the Airflow scheduler pays it on every parse.
+Each DAG file is imported in a fresh interpreter, with the airflow modules
+replaced by the stand-ins of the local runner so that the time is the time of
+the pipeline code, and compared with the import of the utils modules the DAG
+files imported before their tasks were made lazy (see lazy_tasks.py). The heavy
+libraries loaded by the parse are listed, sqlite3 is loaded by the runner
+before the import is timed.
+
+usage: python benchmarks/bench_dag_parse_time.py --repeat 5
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+MLOPS_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# DAG files, with the modules they imported with 'from ... import *'
+# before their tasks were made lazy
+DAG_FILES = {
+    'Lead_scoring_data_pipeline/lead_scoring_data_pipeline.py': [
+        'Lead_scoring_data_pipeline.utils', 'Lead_scoring_data_pipeline.data_validation_checks'],
+    'Lead_scoring_training_pipeline/lead_scoring_training_pipeline.py': [
+        'Lead_scoring_training_pipeline.utils'],
+    'Lead_scoring_inference_pipeline/lead_scoring_inference_pipeline.py': [
+        'Lead_scoring_inference_pipeline.constants', 'Lead_scoring_inference_pipeline.utils'],
+}
+
+HEAVY_MODULES = ['pandas', 'numpy', 'sqlite3', 'mlflow', 'lightgbm', 'sklearn']
+
+# run in the fresh interpreter, prints the import time and the heavy modules
+PARSE_SCRIPT = '''
+import importlib, json, sys, time
+sys.path.insert(0, {mlops_directory!r})
+from Lead_scoring_common.local_runner import load_dags
+loaded = set(sys.modules)
+start = time.perf_counter()
+for module_name in {eager_modules!r}:
+    importlib.import_module(module_name)
+dags = load_dags({dag_file!r})
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'tasks': sum(len(dag.tasks) for dag in dags),
+                  'heavy': [name for name in {heavy_modules!r} if name in set(sys.modules) - loaded]}}))
+'''
+
+
+###############################################################################
+# Define the benchmark
+# ##############################################################################
+
+def parse_time(dag_file, eager_modules=()):
+    '''
+    Imports the DAG file, after the eager modules, in a fresh interpreter and
+    returns its import time in seconds, its number of tasks and the heavy
+    modules it loaded.
+    '''
+    script = PARSE_SCRIPT.format(mlops_directory=MLOPS_DIRECTORY, eager_modules=list(eager_modules),
+                                 dag_file=os.path.join(MLOPS_DIRECTORY, dag_file), heavy_modules=HEAVY_MODULES)
+    output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                            env=dict(os.environ, MLFLOW_DISABLE_AGENT_HINT='1'))
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='imports of every DAG file, the median is reported')
+    args = parser.parse_args()
+
+    print(f"{'DAG file':<68} {'eager (s)':>10} {'lazy (s)':>10} {'speedup':>8}  heavy modules loaded (lazy)")
+    for dag_file, eager_modules in DAG_FILES.items():
+        eager = [parse_time(dag_file, eager_modules) for _ in range(args.repeat)]
+        lazy = [parse_time(dag_file) for _ in range(args.repeat)]
+        eager_time = statistics.median(result['seconds'] for result in eager)
+        lazy_time = statistics.median(result['seconds'] for result in lazy)
+        print(f"{dag_file:<68} {eager_time:>10.3f} {lazy_time:>10.3f} {eager_time / lazy_time:>8.1f}  "
+              f"{', '.join(lazy[-1]['heavy']) or '-'}")
+
+
+if __name__ == '__main__':
+    main()
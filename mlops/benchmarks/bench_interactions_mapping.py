@@ -0,0 +1,114 @@
+'''
+filename: bench_interactions_mapping.py
+Benchmarks the matrix based interaction aggregation used by interactions_mapping
+against the previous melt/merge/pivot_table implementation.
+
+usage: python benchmarks/bench_interactions_mapping.py --rows 100000 1000000
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Lead_scoring_data_pipeline.utils import apply_interactions_mapping, collapse_categorical_levels
+
+PIPELINE_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                  'Lead_scoring_data_pipeline')
+SAMPLE_FILE = os.path.join(PIPELINE_DIRECTORY, 'data', 'leadscoring_inference.csv')
+INTERACTION_MAPPING_FILE = os.path.join(PIPELINE_DIRECTORY, 'mapping', 'interaction_mapping.csv')
+ID_COLUMNS = ['created_date', 'first_platform_c', 'first_utm_medium_c', 'first_utm_source_c',
+              'total_leads_droppped', 'city_tier', 'referred_lead', 'app_complete_flag']
+
+
+###############################################################################
+# Define the previous implementation of the aggregation
+# ##############################################################################
+
+def legacy_interactions_mapping(df, interaction_mapping_df):
+    '''
+    melt/merge/pivot_table aggregation as it was implemented in
+    interactions_mapping before the matrix version.
+    '''
+    df_unpivot = pd.melt(df, id_vars=ID_COLUMNS, var_name='interaction_type', value_name='interaction_value')
+    df_unpivot['interaction_value'] = df_unpivot['interaction_value'].fillna(0)
+    df = pd.merge(df_unpivot, interaction_mapping_df, on='interaction_type', how='left')
+    df = df.drop(['interaction_type'], axis=1)
+    df_pivot = df.pivot_table(
+            values='interaction_value', index=['created_date', 'city_tier', 'first_platform_c',
+           'first_utm_medium_c', 'first_utm_source_c', 'total_leads_droppped',
+           'referred_lead', 'app_complete_flag'], columns='interaction_mapping', aggfunc='sum',
+            observed=True)
+    return df, df_pivot.reset_index()
+
+
+###############################################################################
+# Define the benchmark
+# ##############################################################################
+
+def make_frame(rows, interaction_columns, density=0.05, seed=0):
+    '''
+    Samples 'rows' leads from the inference data and fills the interaction
+    columns with sparse 0/1 flags, as categorical_variables_mapped holds them.
+    '''
+    sample = pd.read_csv(SAMPLE_FILE, usecols=['created_date', 'first_platform_c', 'first_utm_medium_c',
+                                               'first_utm_source_c', 'total_leads_droppped', 'referred_lead'])
+    rng = np.random.default_rng(seed)
+    df = sample.iloc[rng.integers(0, len(sample), rows)].reset_index(drop=True)
+    df = collapse_categorical_levels(df)
+    df['total_leads_droppped'] = df['total_leads_droppped'].fillna(0)
+    df['referred_lead'] = df['referred_lead'].fillna(0)
+    df['city_tier'] = rng.integers(1, 4, rows).astype('float64')
+    df['app_complete_flag'] = rng.integers(0, 2, rows)
+    for column in interaction_columns:
+        df[column] = np.where(rng.random(rows) < density, 1.0, np.nan)
+    return df
+
+
+def measure(func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / 2**20, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--legacy-max-rows', type=int, default=1000000,
+                        help='skip the legacy implementation above this many rows')
+    args = parser.parse_args()
+
+    warnings.simplefilter('ignore')
+    interaction_mapping_df = pd.read_csv(INTERACTION_MAPPING_FILE)
+    interaction_columns = interaction_mapping_df['interaction_type'].tolist()
+
+    print(f"{'rows':>10} {'impl':>8} {'time (s)':>10} {'peak (MiB)':>12}")
+    for rows in args.rows:
+        df = make_frame(rows, interaction_columns)
+        matrix_time, matrix_peak, (_, matrix_result) = measure(apply_interactions_mapping, df, interaction_mapping_df)
+        if rows <= args.legacy_max_rows:
+            legacy_time, legacy_peak, (_, legacy_result) = measure(legacy_interactions_mapping, df, interaction_mapping_df)
+            pd.testing.assert_frame_equal(matrix_result.astype({col: object for col in ID_COLUMNS[1:4]}),
+                                          legacy_result.astype({col: object for col in ID_COLUMNS[1:4]}),
+                                          check_names=False, check_column_type=False)
+            print(f"{rows:>10} {'legacy':>8} {legacy_time:>10.3f} {legacy_peak:>12.1f}")
+        print(f"{rows:>10} {'matrix':>8} {matrix_time:>10.3f} {matrix_peak:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
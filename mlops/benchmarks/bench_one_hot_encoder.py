@@ -0,0 +1,109 @@
+'''
+filename: bench_one_hot_encoder.py
+Benchmarks the compiled one hot encoder used by encode_features, dense and
+sparse, against the previous get_dummies/concat/column assignment loop, and
+checks that they give the same values.
+
+usage: python benchmarks/bench_one_hot_encoder.py --rows 1000000 10000000
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import argparse
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Lead_scoring_common.one_hot_encoder import compile_one_hot_encoder, encode_features_frame, one_hot_encode
+from Lead_scoring_data_pipeline.utils import collapse_categorical_levels
+from Lead_scoring_training_pipeline.constants import ONE_HOT_ENCODED_FEATURES, FEATURES_TO_ENCODE
+
+SAMPLE_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           'Lead_scoring_data_pipeline', 'data', 'leadscoring_inference.csv')
+
+
+###############################################################################
+# Define the previous implementation of the encoding
+# ##############################################################################
+
+def legacy_encode(df):
+    '''
+    get_dummies/concat/column assignment loop as it was implemented in
+    encode_features before the compiled encoder.
+    '''
+    encoded_df = pd.DataFrame(columns=ONE_HOT_ENCODED_FEATURES)
+    placeholder_df = pd.DataFrame()
+    for f in FEATURES_TO_ENCODE:
+        if f in df.columns:
+            encoded = pd.get_dummies(df[f])
+            encoded = encoded.add_prefix(f + '_')
+            placeholder_df = pd.concat([placeholder_df, encoded], axis=1)
+    for feature in encoded_df.columns:
+        if feature in df.columns:
+            encoded_df[feature] = df[feature]
+        if feature in placeholder_df.columns:
+            encoded_df[feature] = placeholder_df[feature]
+    encoded_df.fillna(0, inplace=True)
+    return encoded_df
+
+
+###############################################################################
+# Define the benchmark
+# ##############################################################################
+
+def make_frame(rows, seed=0):
+    '''
+    Samples 'rows' leads from the inference data, with their levels collapsed
+    and a city tier, as 'model_input' holds them.
+    '''
+    sample = pd.read_csv(SAMPLE_FILE, usecols=FEATURES_TO_ENCODE + ['total_leads_droppped', 'referred_lead'])
+    rng = np.random.default_rng(seed)
+    df = collapse_categorical_levels(sample.iloc[rng.integers(0, len(sample), rows)].reset_index(drop=True))
+    df[FEATURES_TO_ENCODE] = df[FEATURES_TO_ENCODE].astype(str)
+    df['city_tier'] = rng.integers(1, 4, rows).astype('float64')
+    return df
+
+
+def time_call(func, df, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(df)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000000, 10000000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    warnings.simplefilter('ignore')
+    encoder = compile_one_hot_encoder(ONE_HOT_ENCODED_FEATURES, FEATURES_TO_ENCODE)
+    print(f"{'rows':>10} {'legacy (s)':>12} {'dense (s)':>10} {'speedup':>8} {'CSR (s)':>8} "
+          f"{'dense MiB':>10} {'CSR MiB':>8}")
+    for rows in args.rows:
+        df = make_frame(rows)
+        legacy_time, legacy = time_call(legacy_encode, df, args.repeat)
+        dense_time, dense = time_call(lambda df: encode_features_frame(df, encoder), df, args.repeat)
+        sparse_time, sparse = time_call(lambda df: one_hot_encode(df, encoder, sparse=True), df, args.repeat)
+
+        assert list(legacy.columns) == list(dense.columns)
+        assert np.array_equal(legacy.to_numpy(dtype=np.float32), dense.to_numpy())
+        assert np.array_equal(sparse.toarray(), dense.to_numpy())
+        sparse_bytes = sparse.data.nbytes + sparse.indices.nbytes + sparse.indptr.nbytes
+        print(f"{rows:>10} {legacy_time:>12.3f} {dense_time:>10.3f} {legacy_time / dense_time:>7.1f}x "
+              f"{sparse_time:>8.3f} {dense.to_numpy().nbytes / 2**20:>10.1f} {sparse_bytes / 2**20:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
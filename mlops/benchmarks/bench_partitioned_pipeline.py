@@ -0,0 +1,83 @@
+'''
+filename: bench_partitioned_pipeline.py
+Scaling curve of the partitioned fused runner: maps the same leads with the
+city tier, categorical and interaction mappings using 1 to N worker processes
+and checks that every run gives the same 'model_input' as the serial one.
+
+usage: python benchmarks/bench_partitioned_pipeline.py --rows 1000000 --workers 1 2 4 8 16
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import argparse
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Lead_scoring_data_pipeline.utils import (
+    apply_dtype_policy,
+    fill_null_lead_counts,
+    transform_leads,
+    transform_leads_in_partitions
+)
+
+PIPELINE_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                  'Lead_scoring_data_pipeline')
+SAMPLE_FILE = os.path.join(PIPELINE_DIRECTORY, 'data', 'leadscoring_inference.csv')
+INTERACTION_MAPPING_FILE = os.path.join(PIPELINE_DIRECTORY, 'mapping', 'interaction_mapping.csv')
+
+
+###############################################################################
+# Define the benchmark
+# ##############################################################################
+
+def make_frame(rows, seed=0):
+    '''
+    Samples 'rows' leads from the inference data, as loaded_data holds them.
+    '''
+    sample = fill_null_lead_counts(pd.read_csv(SAMPLE_FILE))
+    rng = np.random.default_rng(seed)
+    df = sample.iloc[rng.integers(0, len(sample), rows)].reset_index(drop=True)
+    df['app_complete_flag'] = rng.integers(0, 2, rows)
+    return apply_dtype_policy(df)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--partition-key', choices=['month', 'hash'], default='hash')
+    parser.add_argument('--partitions', type=int, default=16, help='buckets of the hash partition key')
+    args = parser.parse_args()
+
+    warnings.simplefilter('ignore')
+    interaction_mapping_df = pd.read_csv(INTERACTION_MAPPING_FILE)
+    df = make_frame(args.rows)
+    print(f"{os.cpu_count()} CPU(s), {args.rows} rows, partition key {args.partition_key}")
+
+    start = time.perf_counter()
+    expected = transform_leads(df, interaction_mapping_df)[3]
+    serial_time = time.perf_counter() - start
+    print(f"{'workers':>8} {'time (s)':>10} {'speedup':>8}")
+    print(f"{'serial':>8} {serial_time:>10.3f} {1.0:>8.2f}")
+
+    for workers in args.workers:
+        start = time.perf_counter()
+        actual = transform_leads_in_partitions(df, interaction_mapping_df, workers=workers,
+                                               partition_key=args.partition_key,
+                                               partitions=args.partitions)[3]
+        elapsed = time.perf_counter() - start
+        pd.testing.assert_frame_equal(actual, expected)
+        print(f"{workers:>8} {elapsed:>10.3f} {serial_time / elapsed:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+'''
+filename: bench_pipeline_scaling.py
+Runs every stage from load_data_into_db to get_models_prediction on synthetic
+leads (see generate_leads.py) at one or more scales, records the wall time and
+the peak RSS of every stage and compares them with a stored baseline.
+
+Every stage runs in a fresh process, as an Airflow task does, so that its peak
+RSS is its own. The data pipeline writes to a db of the work directory, the
+model is trained on CPU, logged to an mlflow sqlite store of the work directory
+and moved to the 'Production' stage, and the inference pipeline runs on a copy
+of the db without the training tables.
+
+A stage whose time or peak RSS exceeds the baseline by more than the tolerance
+is flagged as a REGRESSION and the exit code is 1. The baseline depends on the
+machine: record one with --update-baseline on the machine the benchmark is run on.
+
+usage: python benchmarks/bench_pipeline_scaling.py --rows 100000 1000000 --tolerance 0.25
+       python benchmarks/bench_pipeline_scaling.py --rows 100000 1000000 --update-baseline
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIRECTORY))
+
+from generate_leads import write_leads_csv
+
+PIPELINE_DIRECTORY = os.path.join(os.path.dirname(BENCHMARK_DIRECTORY), 'Lead_scoring_data_pipeline')
+INTERACTION_MAPPING_FILE = os.path.join(PIPELINE_DIRECTORY, 'mapping', 'interaction_mapping.csv')
+BASELINE_FILE = os.path.join(BENCHMARK_DIRECTORY, 'baseline.json')
+
+DATA_DB_FILE_NAME = 'lead_scoring_data_cleaning.db'
+INFERENCE_DB_FILE_NAME = 'lead_scoring_inference.db'
+
+# stages in the order they run, with the module that defines them and the
+# table every run must leave non empty, several stages print and swallow
+# their exceptions
+STAGED_DATA_STAGES = [
+    ('load_data_into_db', 'Lead_scoring_data_pipeline.utils', 'loaded_data'),
+    ('map_city_tier', 'Lead_scoring_data_pipeline.utils', 'city_tier_mapped'),
+    ('map_categorical_vars', 'Lead_scoring_data_pipeline.utils', 'categorical_variables_mapped'),
+    ('interactions_mapping', 'Lead_scoring_data_pipeline.utils', 'model_input'),
+]
+FUSED_DATA_STAGES = [
+    ('load_data_into_db', 'Lead_scoring_data_pipeline.utils', 'loaded_data'),
+    ('run_fused_data_pipeline', 'Lead_scoring_data_pipeline.utils', 'model_input'),
+]
+MODEL_STAGES = [
+    ('train_encode_features', 'Lead_scoring_training_pipeline.utils', 'features'),
+    ('get_trained_model', 'Lead_scoring_training_pipeline.utils', None),
+    ('inference_encode_features', 'Lead_scoring_inference_pipeline.utils', 'features'),
+    ('get_models_prediction', 'Lead_scoring_inference_pipeline.utils', 'predictions'),
+]
+
+
+###############################################################################
+# Define the function run in the process of a stage
+# ##############################################################################
+
+def run_stage(stage, module_name, output_table, work_directory, device):
+    '''
+    Runs one stage with the constants of its module pointed at the work
+    directory and returns its wall time and the peak RSS of the process. The
+    output of the stage is appended to stages.log of the work directory.
+    '''
+    import importlib
+    import warnings
+    warnings.simplefilter('ignore')
+    os.environ.setdefault('MLFLOW_DISABLE_AGENT_HINT', '1')
+    os.chdir(work_directory)
+
+    module = importlib.import_module(module_name)
+    module.DB_PATH = work_directory
+    module.DB_FILE_NAME = INFERENCE_DB_FILE_NAME if 'inference' in module_name else DATA_DB_FILE_NAME
+    if 'data_pipeline' in module_name:
+        module.DATA_DIRECTORY = work_directory
+        module.INTERACTION_MAPPING = INTERACTION_MAPPING_FILE
+    else:
+        module.TRACKING_URI = f"sqlite:///{os.path.join(work_directory, 'mlflow.db')}"
+    if hasattr(module, 'model_config'):
+        module.model_config = dict(module.model_config, device=device)
+        module.DATASET_CACHE_DIRECTORY = os.path.join(work_directory, 'lgb_dataset_cache')
+    function = getattr(module, stage.replace('train_', '').replace('inference_', ''))
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    with open(os.path.join(work_directory, 'stages.log'), 'a') as log, \
+            contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        print(f"##### {stage}")
+        start = time.perf_counter()
+        function()
+        seconds = time.perf_counter() - start
+
+        if stage == 'get_trained_model':
+            # the inference pipeline loads the model of the 'Production' stage
+            from mlflow import MlflowClient
+            client = MlflowClient(module.TRACKING_URI)
+            version = max(int(v.version) for v in client.search_model_versions("name='LightGBM'"))
+            client.transition_model_version_stage('LightGBM', str(version), 'Production')
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    if output_table is not None:
+        with sqlite3.connect(os.path.join(module.DB_PATH, module.DB_FILE_NAME)) as conn:
+            try:
+                rows = conn.execute(f'SELECT COUNT(*) FROM {output_table}').fetchone()[0]
+            except sqlite3.Error:
+                rows = 0
+        if rows == 0:
+            raise RuntimeError(f"{stage} didn't write '{output_table}', see {work_directory}/stages.log")
+    return {'seconds': round(seconds, 3), 'peak_rss_mb': round(peak_rss_mb, 1),
+            'import_rss_mb': round(rss_before, 1)}
+
+
+def prepare_inference_db(work_directory):
+    '''
+    Copies the db of the data pipeline for the inference pipeline, without the
+    tables written by the training pipeline.
+    '''
+    inference_db = os.path.join(work_directory, INFERENCE_DB_FILE_NAME)
+    shutil.copyfile(os.path.join(work_directory, DATA_DB_FILE_NAME), inference_db)
+    with sqlite3.connect(inference_db) as conn:
+        for table in ('features', 'target', 'predictions'):
+            conn.execute(f'DROP TABLE IF EXISTS {table}')
+
+
+###############################################################################
+# Define the benchmark
+# ##############################################################################
+
+def run_scale(rows, work_directory, fused=False, device='cpu', seed=0):
+    '''
+    Generates 'rows' leads in an empty work directory and runs every stage on
+    them, each in a process of its own. Returns the results by stage.
+    '''
+    shutil.rmtree(work_directory, ignore_errors=True)
+    start = time.perf_counter()
+    write_leads_csv(os.path.join(work_directory, 'leadscoring.csv'), rows, seed=seed)
+    print(f"\n{rows} leads generated in {time.perf_counter() - start:.1f}s")
+    print(f"{'stage':<28} {'time (s)':>10} {'peak RSS (MiB)':>15}")
+
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for stage, module_name, output_table in (FUSED_DATA_STAGES if fused else STAGED_DATA_STAGES) + MODEL_STAGES:
+        if stage == 'inference_encode_features':
+            prepare_inference_db(work_directory)
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results[stage] = executor.submit(run_stage, stage, module_name, output_table,
+                                             work_directory, device).result()
+        print(f"{stage:<28} {results[stage]['seconds']:>10.3f} {results[stage]['peak_rss_mb']:>15.1f}")
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance, min_seconds):
+    '''
+    Prints the change of every stage against the baseline and returns the
+    list of (rows, stage, metric) that regressed by more than the tolerance.
+    Time differences below 'min_seconds' are ignored as noise.
+    '''
+    regressions = []
+    print(f"\n{'rows':>9} {'stage':<28} {'time':>18} {'peak RSS':>18}")
+    for rows, stages in results.items():
+        for stage, current in stages.items():
+            previous = baseline.get(rows, {}).get(stage)
+            if previous is None:
+                print(f"{rows:>9} {stage:<28} {'no baseline':>18}")
+                continue
+            cells, flags = [], []
+            for metric, slack in (('seconds', min_seconds), ('peak_rss_mb', 0)):
+                change = current[metric] / previous[metric] - 1 if previous[metric] else 0
+                cells.append(f"{previous[metric]:.1f}->{current[metric]:.1f} ({change:+.0%})")
+                if change > tolerance and current[metric] - previous[metric] > slack:
+                    regressions.append((rows, stage, metric))
+                    flags.append(metric)
+            print(f"{rows:>9} {stage:<28} {cells[0]:>18} {cells[1]:>18}"
+                  + (f"  REGRESSION ({', '.join(flags)})" if flags else ''))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--fused', action='store_true', help='run the fused data pipeline instead of the stages')
+    parser.add_argument('--device', default='cpu', help='LightGBM device of the model config')
+    parser.add_argument('--work-directory', default=None, help='defaults to a temporary directory')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--tolerance', type=float, default=0.25, help='relative increase flagged as a regression')
+    parser.add_argument('--min-seconds', type=float, default=0.5, help='time increase always ignored')
+    parser.add_argument('--update-baseline', action='store_true', help='save the results as the baseline')
+    args = parser.parse_args()
+
+    work_root = args.work_directory or tempfile.mkdtemp(prefix='bench_pipeline_scaling_')
+    print(f"{os.cpu_count()} CPU(s), work directory {work_root}")
+    results = {str(rows): run_scale(rows, os.path.join(work_root, str(rows)), args.fused, args.device)
+               for rows in args.rows}
+    if args.work_directory is None:
+        shutil.rmtree(work_root, ignore_errors=True)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    if args.update_baseline:
+        baseline.setdefault('results', {}).update(results)
+        baseline['machine'] = {'platform': platform.platform(), 'processor': platform.processor(),
+                               'cpu_count': os.cpu_count(), 'python': platform.python_version()}
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+        return
+
+    regressions = compare_with_baseline(results, baseline.get('results', {}), args.tolerance, args.min_seconds)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) above {args.tolerance:.0%}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
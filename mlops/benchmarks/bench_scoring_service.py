@@ -0,0 +1,158 @@
+'''
+filename: bench_scoring_service.py
+Load test of the scoring service, offline: a model is trained on synthetic
+leads (see generate_leads.py) and saved as a native LightGBM file, unless one
+is given, and the service is started on it in a subprocess for every batching
+configuration. Concurrent clients send single-lead requests over keep-alive
+connections, and the client latency percentiles and throughput are reported
+with the batching counters of the service.
+
+usage: python benchmarks/bench_scoring_service.py --clients 64 --requests 50
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+MLOPS_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, MLOPS_DIRECTORY)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generate_leads import SAMPLE_FILE, fit_lead_profile, generate_leads
+
+# (max batch size, max wait in ms) of the service, 1 lead without waiting is
+# one prediction per request
+BATCHING_CONFIGS = [(1, 0), (256, 0), (256, 2), (256, 5)]
+
+
+###############################################################################
+# Define the functions of the clients
+# ##############################################################################
+
+def train_model(leads, path):
+    '''
+    Trains a booster on the features the service computes from the leads and
+    saves it as a native model file.
+    '''
+    import lightgbm as lgb
+    from Lead_scoring_inference_pipeline.scoring_service import score_leads
+
+    class Features:
+        def predict(self, matrix):
+            return matrix
+
+    X = score_leads(leads.to_dict('records'), Features())
+    params = {'objective': 'binary', 'verbosity': -1}
+    lgb.train(params, lgb.Dataset(X, label=leads['app_complete_flag']), num_boost_round=100).save_model(path)
+
+
+async def request(reader, writer, method, path, payload=None):
+    body = json.dumps(payload).encode() if payload is not None else b''
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    await reader.readline()
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        if line.lower().startswith(b'content-length:'):
+            length = int(line.split(b':')[1])
+    return json.loads(await reader.readexactly(length))
+
+
+async def run_client(port, leads, latencies):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    for lead in leads:
+        start = time.perf_counter()
+        await request(reader, writer, 'POST', '/score', lead)
+        latencies.append(time.perf_counter() - start)
+    writer.close()
+
+
+async def load_test(port, leads, clients):
+    '''
+    Sends the leads from 'clients' concurrent connections, one lead per
+    request, and returns the client latencies, the wall time and the metrics
+    of the service.
+    '''
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[run_client(port, leads[client::clients], latencies) for client in range(clients)])
+    seconds = time.perf_counter() - start
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    metrics = await request(reader, writer, 'GET', '/metrics')
+    writer.close()
+    return np.array(latencies), seconds, metrics
+
+
+async def wait_until_listening(port, timeout=60):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+###############################################################################
+# Define the benchmark
+# ##############################################################################
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model-file', help='native LightGBM model file, trained on synthetic leads if not given')
+    parser.add_argument('--clients', type=int, default=64, help='concurrent connections')
+    parser.add_argument('--requests', type=int, default=50, help='requests of every connection')
+    parser.add_argument('--port', type=int, default=18080)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    profile = fit_lead_profile(pd.read_csv(SAMPLE_FILE, index_col=0))
+    work_directory = tempfile.mkdtemp(prefix='bench_scoring_')
+    model_file = args.model_file
+    if model_file is None:
+        model_file = os.path.join(work_directory, 'model.txt')
+        train_model(generate_leads(profile, 20000, rng), model_file)
+    leads = generate_leads(profile, args.clients * args.requests, rng).drop(columns=['app_complete_flag'])
+    leads = json.loads(leads.to_json(orient='records'))
+
+    print(f"{args.clients} clients x {args.requests} single-lead requests")
+    print(f"{'batch':>6} {'wait ms':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'batches':>8} {'leads/batch':>12}")
+    for max_batch_size, max_wait_ms in BATCHING_CONFIGS:
+        service = subprocess.Popen(
+            [sys.executable, '-m', 'Lead_scoring_inference_pipeline.scoring_service', '--model-file', model_file,
+             '--host', '127.0.0.1', '--port', str(args.port), '--max-batch-size', str(max_batch_size),
+             '--max-wait-ms', str(max_wait_ms)],
+            cwd=MLOPS_DIRECTORY, stdout=subprocess.DEVNULL, env=dict(os.environ, MLFLOW_DISABLE_AGENT_HINT='1'))
+        try:
+            asyncio.run(wait_until_listening(args.port))
+            latencies, seconds, metrics = asyncio.run(load_test(args.port, leads, args.clients))
+        finally:
+            service.terminate()
+            service.wait()
+        p50, p95, p99 = np.percentile(latencies * 1000, [50, 95, 99])
+        print(f"{max_batch_size:>6} {max_wait_ms:>8} {len(latencies) / seconds:>8.0f} {p50:>8.1f} {p95:>8.1f} "
+              f"{p99:>8.1f} {metrics['batches']:>8} {metrics['mean_batch_items']:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
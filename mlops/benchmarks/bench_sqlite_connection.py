@@ -0,0 +1,85 @@
+'''
+filename: bench_sqlite_connection.py
+Benchmarks the tuned connections of Lead_scoring_common.sqlite_connection
+against default sqlite3 connections on the to_sql/read_sql heavy work of the
+pipeline stages: replacing a table, reading it back and the small committed
+writes of the stage cache and watermark tables.
+
+usage: python benchmarks/bench_sqlite_connection.py --rows 100000 500000
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Lead_scoring_common.sqlite_connection import connect
+
+PIPELINE_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                  'Lead_scoring_data_pipeline')
+SAMPLE_FILE = os.path.join(PIPELINE_DIRECTORY, 'data', 'leadscoring_inference.csv')
+
+
+###############################################################################
+# Define the benchmark
+# ##############################################################################
+
+def make_frame(rows, seed=0):
+    '''
+    Samples 'rows' leads from the inference data, as loaded_data holds them.
+    '''
+    sample = pd.read_csv(SAMPLE_FILE)
+    rng = np.random.default_rng(seed)
+    return sample.iloc[rng.integers(0, len(sample), rows)].reset_index(drop=True)
+
+
+def run_stage(conn, df, commits):
+    '''
+    Replaces a table with the frame, reads it back and makes 'commits' small
+    committed upserts. Returns the time taken by each of the three steps.
+    '''
+    start = time.perf_counter()
+    df.to_sql('loaded_data', conn, if_exists='replace', index=False)
+    written = time.perf_counter()
+    pd.read_sql('SELECT * FROM loaded_data', conn)
+    read = time.perf_counter()
+    conn.execute('CREATE TABLE IF NOT EXISTS stage_cache (stage TEXT PRIMARY KEY, runs INTEGER)')
+    for i in range(commits):
+        conn.execute('INSERT INTO stage_cache VALUES (?, 1) ON CONFLICT(stage) DO UPDATE SET runs = runs + 1',
+                     (f'stage_{i % 10}',))
+        conn.commit()
+    return written - start, read - written, time.perf_counter() - read
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000, 500000])
+    parser.add_argument('--commits', type=int, default=500, help='small committed writes per run')
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'connection':>11} {'to_sql (s)':>11} {'read_sql (s)':>13} {'commits (s)':>12}")
+    for rows in args.rows:
+        df = make_frame(rows)
+        for name, open_connection in (('default', sqlite3.connect), ('tuned', connect)):
+            with tempfile.TemporaryDirectory() as directory:
+                conn = open_connection(os.path.join(directory, 'bench.db'))
+                try:
+                    write_time, read_time, commit_time = run_stage(conn, df, args.commits)
+                finally:
+                    conn.close()
+            print(f"{rows:>10} {name:>11} {write_time:>11.3f} {read_time:>13.3f} {commit_time:>12.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+'''
+filename: generate_leads.py
+Generates a synthetic leadscoring.csv of any size with the columns of
+raw_data_schema in schema.py. Every column other than 'created_date' and
+'app_complete_flag' is drawn from its empirical distribution in a sample file
+(nulls included), which reproduces the level frequencies of the first_*_c
+columns, the city distribution and the sparsity of the interaction columns.
+'created_date' is drawn uniformly over the dates of the sample and
+'app_complete_flag' from a logistic model of the platform, source and
+referral of the lead, so that the model has a signal to learn.
+
+usage: python benchmarks/generate_leads.py --rows 1000000 --output /tmp/leads/leadscoring.csv
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Lead_scoring_data_pipeline.schema import raw_data_schema
+
+PIPELINE_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                  'Lead_scoring_data_pipeline')
+SAMPLE_FILE = os.path.join(PIPELINE_DIRECTORY, 'data', 'leadscoring_inference.csv')
+
+# columns whose levels drive the probability of 'app_complete_flag'
+FLAG_DRIVERS = ['first_platform_c', 'first_utm_source_c', 'referred_lead']
+
+
+###############################################################################
+# Define the functions that fit and sample the distributions
+# ##############################################################################
+
+def fit_lead_profile(sample, positive_rate=None, seed=0):
+    '''
+    This function fits the distributions the synthetic leads are drawn from.
+
+
+    INPUTS
+        sample : dataframe read from a leadscoring csv file
+        positive_rate : share of leads with 'app_complete_flag' 1, defaults to
+                        the share in the sample or 0.5 if it has no flag
+        seed : seed of the effects of the levels on the flag
+
+
+    OUTPUT
+        dictionary with the range of 'created_date', the values and
+        probabilities of every other column and the effects of FLAG_DRIVERS
+
+
+    SAMPLE USAGE
+        profile = fit_lead_profile(pd.read_csv(SAMPLE_FILE))
+    '''
+    rng = np.random.default_rng(seed)
+    created_date = pd.to_datetime(sample['created_date'])
+    profile = {'created_date': (created_date.min(), created_date.max()), 'columns': {}, 'effects': {}}
+    for column in raw_data_schema:
+        if column in ('created_date', 'app_complete_flag'):
+            continue
+        frequencies = sample[column].value_counts(dropna=False, normalize=True)
+        profile['columns'][column] = (frequencies.index.to_numpy(dtype=object), frequencies.to_numpy())
+
+    if positive_rate is None:
+        positive_rate = sample['app_complete_flag'].mean() if 'app_complete_flag' in sample.columns else 0.5
+    profile['intercept'] = np.log(positive_rate / (1 - positive_rate))
+    for column in FLAG_DRIVERS:
+        values, _ = profile['columns'][column]
+        profile['effects'][column] = dict(zip(values, rng.normal(0, 1, len(values))))
+    return profile
+
+
+def generate_leads(profile, rows, rng):
+    '''
+    Draws 'rows' synthetic leads from the profile and returns them as a
+    dataframe with the columns of raw_data_schema.
+    '''
+    start, end = profile['created_date']
+    seconds = rng.integers(0, int((end - start).total_seconds()) + 1, rows)
+    df = {'created_date': (start + pd.to_timedelta(seconds, unit='s')).astype(str)}
+    for column, (values, probabilities) in profile['columns'].items():
+        df[column] = values[rng.choice(len(values), size=rows, p=probabilities)]
+        if all(isinstance(value, float) for value in values):
+            df[column] = df[column].astype('float64')
+    df = pd.DataFrame(df)
+
+    # the effects of the levels are centered so that the rate stays close
+    logit = np.full(rows, profile['intercept'])
+    for column, effects in profile['effects'].items():
+        column_effects = df[column].map(effects).fillna(0).to_numpy()
+        logit += column_effects - column_effects.mean()
+    df['app_complete_flag'] = (rng.random(rows) < 1 / (1 + np.exp(-logit))).astype('int64')
+    return df[raw_data_schema]
+
+
+def write_leads_csv(output, rows, chunksize=500000, seed=0, sample_file=SAMPLE_FILE, positive_rate=None):
+    '''
+    This function writes 'rows' synthetic leads to a csv file in chunks of
+    'chunksize' rows, so the memory used doesn't depend on the number of
+    rows. The same seed always gives the same file.
+
+
+    INPUTS
+        output : path of the csv file written, its directory is created
+        rows : number of leads
+        chunksize : number of leads generated and written at a time
+        seed : seed of the random generator
+        sample_file : csv file the distributions are fitted on
+        positive_rate : share of leads with 'app_complete_flag' 1, see
+                        fit_lead_profile
+
+
+    OUTPUT
+        path of the csv file
+
+
+    SAMPLE USAGE
+        write_leads_csv('/tmp/leads/leadscoring.csv', 1000000)
+    '''
+    profile = fit_lead_profile(pd.read_csv(sample_file), positive_rate, seed)
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    for start in range(0, rows, chunksize):
+        chunk = generate_leads(profile, min(chunksize, rows - start), rng)
+        chunk.to_csv(output, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--output', required=True, help='path of the csv file written')
+    parser.add_argument('--chunksize', type=int, default=500000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--sample', default=SAMPLE_FILE, help='csv file the distributions are fitted on')
+    parser.add_argument('--positive-rate', type=float, default=None)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    write_leads_csv(args.output, args.rows, args.chunksize, args.seed, args.sample, args.positive_rate)
+    print(f"Wrote {args.rows} leads to {args.output} in {time.perf_counter() - start:.1f}s "
+          f"({os.path.getsize(args.output) / 2**20:.1f} MiB).")
+
+
+if __name__ == '__main__':
+    main()
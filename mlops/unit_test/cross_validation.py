@@ -0,0 +1,180 @@
+'''
+filename: cross_validation.py
+functions: fold_assignments, cross_validate
+K-fold evaluation of the booster, run by get_trained_model when
+CV_ENABLED is set, with the folds trained concurrently and their results
+cached by the fingerprint of the data and the configuration.
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import lightgbm as lgb
+import numpy as np
+from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score, roc_auc_score
+from sklearn.model_selection import StratifiedKFold
+
+# files of the results of a configuration, in its cache directory
+PREDICTIONS_FILE_NAME = 'oof_predictions.npy'
+FOLDS_FILE_NAME = 'folds.json'
+
+# features and target of the folds, set once in every worker of the pool
+_fold_data = {}
+
+
+###############################################################################
+# Define the function to assign the folds
+# ##############################################################################
+
+def fold_assignments(y, n_folds, seed=100):
+    '''
+    Returns the fold of every row, stratified by the target so that every
+    fold has the share of positive leads of the whole data.
+    '''
+    folds = np.empty(len(y), dtype=np.int64)
+    splitter = StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=seed)
+    for fold, (_, test_indices) in enumerate(splitter.split(np.zeros(len(y)), y)):
+        folds[test_indices] = fold
+    return folds
+
+
+###############################################################################
+# Define the functions running the folds in the pool
+# ##############################################################################
+
+def _init_fold_worker(features_path, y, folds):
+    # read only memory map: the pages of the matrix are shared by the workers
+    _fold_data.update(X=np.load(features_path, mmap_mode='r'), y=y, folds=folds)
+
+
+def _run_fold(fold, params, num_boost_round):
+    '''
+    Trains a booster on the rows out of the fold and returns its predictions
+    and metrics on the rows of the fold.
+    '''
+    start = time.perf_counter()
+    X, y, folds = _fold_data['X'], _fold_data['y'], _fold_data['folds']
+    train_indices, test_indices = np.flatnonzero(folds != fold), np.flatnonzero(folds == fold)
+    train_set = lgb.Dataset(X[train_indices], label=y[train_indices], params=params)
+    booster = lgb.train(params, train_set, num_boost_round=num_boost_round)
+    predictions = booster.predict(X[test_indices])
+    y_test, y_pred = y[test_indices], (predictions > 0.5).astype(int)
+    metrics = {
+        'auc': float(roc_auc_score(y_test, predictions)),
+        'accuracy': float(accuracy_score(y_test, y_pred)),
+        'precision': float(precision_score(y_test, y_pred, average='macro', zero_division=0)),
+        'recall': float(recall_score(y_test, y_pred, average='macro', zero_division=0)),
+        'f1': float(f1_score(y_test, y_pred, average='macro', zero_division=0)),
+    }
+    return {'fold': fold, 'rows': len(test_indices), 'metrics': metrics,
+            'seconds': time.perf_counter() - start, 'predictions': predictions}
+
+
+###############################################################################
+# Define the function to cross validate the booster
+# ##############################################################################
+
+def cross_validate(X, y, params, num_boost_round, n_folds, cache_directory, fingerprint, workers=None, seed=100):
+    '''
+    This function evaluates the booster by stratified k-fold cross
+    validation. The features are written once as a float32 .npy file that
+    every worker of the pool maps read only, so the folds share a single
+    copy of the matrix, and the folds are trained concurrently with their
+    number of threads capped so that the pool doesn't oversubscribe the
+    cores.
+
+    The out-of-fold predictions and the metrics of every fold are saved in
+    '<cache_directory>/<fingerprint>': a later call with the same
+    fingerprint, e.g. a re-triggered DAG run, loads them and trains nothing.
+
+
+    INPUTS
+        X : dataframe or array of the features
+        y : dataframe, series or array of the target
+        params : parameters of lgb.train
+        num_boost_round : boosting rounds of every fold
+        n_folds : number of folds
+        cache_directory : directory of the results, created if needed
+        fingerprint : fingerprint of the data and of the configuration,
+                      e.g. of the rows, the parameters, the number of folds
+                      and the seed
+        workers : number of processes of the pool, defaults to the number of
+                  cores
+        seed : seed of the assignment of the folds
+
+
+    OUTPUT
+        dictionary with the cache status ('hit' or 'miss'), the out-of-fold
+        prediction of every row, its fold, the metrics and seconds of every
+        fold, the mean and standard deviation of every metric over the folds
+        and the AUC of the out-of-fold predictions
+
+
+    SAMPLE USAGE
+        results = cross_validate(X, y, params, 100, 5, CV_CACHE_DIRECTORY, fingerprint)
+        print(results['mean']['auc'], results['oof_auc'])
+    '''
+    y = np.asarray(y).reshape(len(X), -1)[:, 0].astype(np.int64)
+    folds = fold_assignments(y, n_folds, seed)
+    result_directory = os.path.join(cache_directory, fingerprint)
+    predictions_path = os.path.join(result_directory, PREDICTIONS_FILE_NAME)
+    folds_path = os.path.join(result_directory, FOLDS_FILE_NAME)
+
+    if os.path.exists(predictions_path) and os.path.exists(folds_path):
+        status = 'hit'
+        with open(folds_path) as folds_file:
+            fold_results = json.load(folds_file)['folds']
+        predictions = np.load(predictions_path)
+    else:
+        status = 'miss'
+        cores = os.cpu_count() or 1
+        workers = min(workers or cores, n_folds)
+        # n_jobs is the alias of num_threads the model config sets
+        fold_params = dict(params, n_jobs=max(1, cores // workers))
+
+        os.makedirs(cache_directory, exist_ok=True)
+        shared_directory = tempfile.mkdtemp(dir=cache_directory)
+        try:
+            features_path = os.path.join(shared_directory, 'features.npy')
+            np.save(features_path, np.asarray(X, dtype=np.float32))
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_fold_worker,
+                                     initargs=(features_path, y, folds)) as pool:
+                fold_results = list(pool.map(_run_fold, range(n_folds), [fold_params] * n_folds,
+                                             [num_boost_round] * n_folds))
+        finally:
+            shutil.rmtree(shared_directory)
+
+        predictions = np.empty(len(y), dtype=np.float64)
+        for fold_result in fold_results:
+            predictions[folds == fold_result['fold']] = fold_result.pop('predictions')
+
+        # the folds file is written last, the results are complete once it exists
+        os.makedirs(result_directory, exist_ok=True)
+        np.save(predictions_path + '.tmp.npy', predictions)
+        os.replace(predictions_path + '.tmp.npy', predictions_path)
+        with open(folds_path + '.tmp', 'w') as folds_file:
+            json.dump({'folds': fold_results}, folds_file)
+        os.replace(folds_path + '.tmp', folds_path)
+
+    metrics = [fold_result['metrics'] for fold_result in fold_results]
+    results = {
+        'status': status,
+        'predictions': predictions,
+        'folds': folds,
+        'fold_results': fold_results,
+        'mean': {name: float(np.mean([m[name] for m in metrics])) for name in metrics[0]},
+        'std': {name: float(np.std([m[name] for m in metrics])) for name in metrics[0]},
+        'oof_auc': float(roc_auc_score(y, predictions)),
+        'predictions_path': predictions_path,
+    }
+    print(f"Cross validation {status}: {n_folds} folds, AUC {results['mean']['auc']:.4f} "
+          f"+/- {results['std']['auc']:.4f}, out-of-fold AUC {results['oof_auc']:.4f}")
+    return results
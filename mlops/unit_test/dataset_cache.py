@@ -0,0 +1,139 @@
+'''
+filename: dataset_cache.py
+functions: row_hashes, rows_fingerprint, load_or_build_dataset
+Cache of the binned LightGBM Dataset of the training features, kept between
+the monthly runs of the training pipeline.
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import hashlib
+import json
+import os
+import time
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+
+# files of the cache in the cache directory
+DATASET_FILE_NAME = 'features.bin'
+METADATA_FILE_NAME = 'features.json'
+
+
+###############################################################################
+# Define the functions to fingerprint the rows
+# ##############################################################################
+
+def row_hashes(X, y):
+    '''
+    Returns the uint64 hash of every row of the features and the target, from
+    their values only, so that the fingerprint of any prefix of the rows is
+    cheap to compute.
+    '''
+    rows = pd.concat([X.reset_index(drop=True), y.reset_index(drop=True)], axis=1)
+    return pd.util.hash_pandas_object(rows, index=False).to_numpy()
+
+
+def rows_fingerprint(hashes, columns):
+    '''
+    Returns the sha256 hex digest of the row hashes and the column names.
+    '''
+    digest = hashlib.sha256(repr(list(columns)).encode())
+    digest.update(np.ascontiguousarray(hashes).tobytes())
+    return digest.hexdigest()
+
+
+###############################################################################
+# Define the function to load or build the dataset
+# ##############################################################################
+
+def load_or_build_dataset(X, y, params, cache_directory, max_growth=0.5):
+    '''
+    This function returns the constructed LightGBM Dataset of all the rows of
+    the features and target, reusing the binary Dataset saved by the previous
+    run, bin mappers included:
+
+      'hit'      the rows are the rows of the cache: the binary file is loaded
+                 and nothing is binned
+      'extended' the rows of the cache are the first rows, followed by new
+                 ones: all the rows are binned with the bin mappers of the
+                 cache, so the bin boundaries are not searched again and stay
+                 the same. The rows must be at most (1 + 'max_growth') times
+                 the rows the bin mappers were computed from, which an
+                 extension doesn't change, so that chained extensions can't
+                 keep the first bins forever
+      'miss'     anything else: the bin mappers are computed from the rows
+
+    After an 'extended' or a 'miss' the Dataset is saved as the new cache.
+    Subsets of the returned Dataset (Dataset.subset) share its bin mappers.
+
+
+    INPUTS
+        X : dataframe of the features
+        y : dataframe or series of the target
+        params : parameters of the booster, those of the binning must be the
+                 same as the cache's, they are part of its key
+        cache_directory : directory of the cache, created if needed
+        max_growth : share of rows added since the bins were computed above
+                     which they are recomputed, so that they follow the
+                     distribution of the data
+
+
+    OUTPUT
+        tuple (dataset, status, construct_seconds)
+
+
+    SAMPLE USAGE
+        dataset, status, seconds = load_or_build_dataset(X_train, y_train, params, DATASET_CACHE_DIRECTORY)
+        booster = lgb.train(params, dataset)
+    '''
+    y = y.iloc[:, 0] if isinstance(y, pd.DataFrame) else y
+    hashes = row_hashes(X, y)
+    params_key = json.dumps(params, sort_keys=True, default=str)
+    dataset_path = os.path.join(cache_directory, DATASET_FILE_NAME)
+    metadata_path = os.path.join(cache_directory, METADATA_FILE_NAME)
+
+    metadata = None
+    if os.path.exists(dataset_path) and os.path.exists(metadata_path):
+        with open(metadata_path) as metadata_file:
+            metadata = json.load(metadata_file)
+        if metadata['params'] != params_key or metadata['columns'] != list(X.columns):
+            metadata = None
+
+    # rows the bin mappers of the cache were computed from
+    binned_rows = metadata.get('binned_rows', metadata['rows']) if metadata is not None else None
+
+    start = time.perf_counter()
+    if metadata is not None and metadata['rows'] == len(X) \
+            and metadata['fingerprint'] == rows_fingerprint(hashes, X.columns):
+        status = 'hit'
+        dataset = lgb.Dataset(dataset_path, params=params).construct()
+    elif metadata is not None and metadata['rows'] < len(X) <= binned_rows * (1 + max_growth) \
+            and metadata['fingerprint'] == rows_fingerprint(hashes[:metadata['rows']], X.columns):
+        status = 'extended'
+        reference = lgb.Dataset(dataset_path, params=params).construct()
+        dataset = lgb.Dataset(X, label=y, reference=reference, params=params).construct()
+    else:
+        status = 'miss'
+        dataset = lgb.Dataset(X, label=y, params=params).construct()
+        binned_rows = len(X)
+    construct_seconds = time.perf_counter() - start
+
+    if status != 'hit':
+        os.makedirs(cache_directory, exist_ok=True)
+        # the metadata is removed first and written last, so that a failed
+        # run never leaves a dataset with the metadata of another one
+        if os.path.exists(metadata_path):
+            os.remove(metadata_path)
+        dataset.save_binary(dataset_path + '.tmp')
+        os.replace(dataset_path + '.tmp', dataset_path)
+        with open(metadata_path + '.tmp', 'w') as metadata_file:
+            json.dump({'rows': len(X), 'binned_rows': binned_rows, 'columns': list(X.columns),
+                       'params': params_key, 'fingerprint': rows_fingerprint(hashes, X.columns)},
+                      metadata_file)
+        os.replace(metadata_path + '.tmp', metadata_path)
+    print(f"LightGBM dataset cache {status}: {len(X)} rows constructed in {construct_seconds:.3f}s.")
+    return dataset, status, construct_seconds
@@ -0,0 +1,208 @@
+'''
+filename: instrumentation.py
+functions: record_io, read_disk_io, cpu_time, task_context, instrument_task, write_task_metrics
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import contextlib
+import functools
+import os
+import resource
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from sqlite_connection import get_connection
+
+# set to False to run the tasks without recording their metrics
+INSTRUMENTATION_ENABLED = True
+
+# table of the db of every pipeline the metrics of its tasks are written to
+METRICS_TABLE_NAME = 'pipeline_metrics'
+
+# environment variables Airflow sets in the process of a task, the metrics of
+# a task run outside of Airflow, and outside of task_context, are tagged with
+# the dag 'local' and the name of the function
+AIRFLOW_CONTEXT_VARIABLES = {
+    'dag_id': 'AIRFLOW_CTX_DAG_ID',
+    'task_id': 'AIRFLOW_CTX_TASK_ID',
+    'run_id': 'AIRFLOW_CTX_DAG_RUN_ID',
+}
+
+# metrics of the instrumented functions running in this thread, innermost last
+_running_tasks = threading.local()
+
+
+###############################################################################
+# Define the functions that collect the metrics
+# ##############################################################################
+
+def record_io(read=None, written=None):
+    '''
+    Adds the rows and in-memory bytes of a dataframe read from or written to a
+    table to the metrics of every instrumented function running in this
+    thread. Called by the storage backends, it does nothing, and doesn't
+    measure the dataframe, outside of an instrumented function.
+    '''
+    stack = getattr(_running_tasks, 'stack', None)
+    if not stack:
+        return
+    for df, rows_key, bytes_key in ((read, 'rows_read', 'bytes_read'), (written, 'rows_written', 'bytes_written')):
+        if df is None:
+            continue
+        rows, size = len(df), int(df.memory_usage(index=False, deep=True).sum())
+        for metrics in stack:
+            metrics[rows_key] += rows
+            metrics[bytes_key] += size
+
+
+def read_disk_io():
+    '''
+    Returns the bytes this process read from and wrote to disk so far, which
+    covers the pages of the db files that missed the page cache, as a tuple
+    (read_bytes, write_bytes), or (None, None) where /proc/self/io is not
+    available.
+    '''
+    try:
+        with open('/proc/self/io') as io_file:
+            counters = dict(line.split(': ') for line in io_file.read().splitlines())
+        return int(counters['read_bytes']), int(counters['write_bytes'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def cpu_time():
+    '''
+    Returns the user and system CPU time of this process and of its children
+    which have exited, e.g. the workers of a process pool.
+    '''
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+@contextlib.contextmanager
+def task_context(dag_id, task_id, run_id=None):
+    '''
+    Tags the metrics of the instrumented functions called in this thread, in
+    the with block, with the dag, task and run ids in place of the Airflow
+    environment variables, which are shared by the threads of a process. Used
+    by the local runner, see local_runner.py.
+    '''
+    previous = getattr(_running_tasks, 'context', None)
+    _running_tasks.context = {'dag_id': dag_id, 'task_id': task_id, 'run_id': run_id}
+    try:
+        yield
+    finally:
+        _running_tasks.context = previous
+
+
+###############################################################################
+# Define the decorator applied to the tasks
+# ##############################################################################
+
+def instrument_task(get_db_path):
+    '''
+    This decorator records the wall time, CPU time, peak RSS, rows and bytes
+    read and written through the storage backend, and bytes read and written
+    to disk of every call of the decorated function. The metrics are written to
+    the METRICS_TABLE_NAME table of the db, tagged with the dag, task and run
+    ids of the Airflow task, and a summary is printed. The call is recorded
+    whether it succeeds or fails, and a failure to write the metrics never
+    fails the task.
+
+    When an instrumented function calls another one, the rows and bytes of the
+    inner call are counted in both, and the metrics of both are written once
+    the outer call returns, so that the metrics are never written while the
+    outer call holds a transaction.
+
+
+    INPUTS
+        get_db_path : function returning the path of the db file the metrics
+                      are written to, called when they are written so that it
+                      follows the constants of the pipeline
+
+
+    OUTPUT
+        decorator to apply to the task functions
+
+
+    SAMPLE USAGE
+        @instrument_task(lambda: os.path.join(DB_PATH, DB_FILE_NAME))
+        def load_data_into_db():
+            ...
+    '''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not INSTRUMENTATION_ENABLED:
+                return function(*args, **kwargs)
+            stack = _running_tasks.__dict__.setdefault('stack', [])
+            finished = _running_tasks.__dict__.setdefault('finished', [])
+
+            metrics = {'function_name': function.__name__, 'rows_read': 0, 'rows_written': 0,
+                       'bytes_read': 0, 'bytes_written': 0}
+            started_at = datetime.now().isoformat(timespec='seconds')
+            disk_read_start, disk_write_start = read_disk_io()
+            cpu_start = cpu_time()
+            wall_start = time.perf_counter()
+            stack.append(metrics)
+            status = 'failed'
+            try:
+                result = function(*args, **kwargs)
+                status = 'success'
+                return result
+            finally:
+                wall_time = time.perf_counter() - wall_start
+                stack.pop()
+                disk_read_end, disk_write_end = read_disk_io()
+                context = getattr(_running_tasks, 'context', None) or {
+                    key: os.environ.get(variable) for key, variable in AIRFLOW_CONTEXT_VARIABLES.items()}
+                metrics.update(
+                    dag_id=context['dag_id'] or 'local',
+                    task_id=context['task_id'] or function.__name__,
+                    run_id=context['run_id'],
+                    status=status,
+                    started_at=started_at,
+                    wall_time=wall_time,
+                    cpu_time=cpu_time() - cpu_start,
+                    # ru_maxrss is the peak of the whole process, in KiB on linux.
+                    # Airflow runs every task in a process of its own
+                    peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                    disk_read_bytes=None if disk_read_start is None else disk_read_end - disk_read_start,
+                    disk_write_bytes=None if disk_write_start is None else disk_write_end - disk_write_start)
+                print(f"Task metrics of {function.__name__}: {status}, {wall_time:.3f}s wall, "
+                      f"{metrics['cpu_time']:.3f}s CPU, {metrics['peak_rss_mb']:.0f} MiB peak RSS, "
+                      f"{metrics['rows_read']} row(s) read, {metrics['rows_written']} row(s) written.")
+                finished.append(metrics)
+                if not stack:
+                    write_task_metrics(get_db_path(), list(finished))
+                    finished.clear()
+        return wrapper
+    return decorator
+
+
+def write_task_metrics(db_path, task_metrics):
+    '''
+    Appends the metrics of the finished calls to the metrics table of the db.
+    Errors are printed and not raised, the metrics are best effort.
+    '''
+    columns = ['dag_id', 'task_id', 'run_id', 'function_name', 'status', 'started_at', 'wall_time',
+               'cpu_time', 'peak_rss_mb', 'rows_read', 'rows_written', 'bytes_read', 'bytes_written',
+               'disk_read_bytes', 'disk_write_bytes']
+    try:
+        with get_connection(db_path, report=False) as conn:
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {METRICS_TABLE_NAME} '
+                         '(dag_id TEXT, task_id TEXT, run_id TEXT, function_name TEXT, status TEXT, '
+                         'started_at TEXT, wall_time REAL, cpu_time REAL, peak_rss_mb REAL, '
+                         'rows_read INTEGER, rows_written INTEGER, bytes_read INTEGER, '
+                         'bytes_written INTEGER, disk_read_bytes INTEGER, disk_write_bytes INTEGER)')
+            conn.executemany(f'INSERT INTO {METRICS_TABLE_NAME} ({", ".join(columns)}) '
+                             f'VALUES ({", ".join("?" * len(columns))})',
+                             [tuple(metrics[column] for column in columns) for metrics in task_metrics])
+    except sqlite3.Error as e:
+        print(f"Could not write the task metrics to {db_path}: {e}")
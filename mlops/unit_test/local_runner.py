@@ -0,0 +1,336 @@
+'''
+filename: local_runner.py
+functions: airflow_shims, load_dags, task_order, run_dag, print_waterfall, main
+Runs the DAGs of the pipelines in process, without an Airflow scheduler. The
+DAG files stay the only definition of the task graphs: they are imported with
+stand-ins of the airflow modules they use, which record the tasks and their
+dependencies, and the tasks run as soon as their upstream tasks succeeded,
+independent tasks concurrently in a thread or process pool.
+
+usage: python Lead_scoring_common/local_runner.py Lead_scoring_data_pipeline/lead_scoring_data_pipeline.py
+           Lead_scoring_training_pipeline/lead_scoring_training_pipeline.py --executor process --workers 4
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import argparse
+import concurrent.futures
+import importlib.util
+import os
+import subprocess
+import sys
+import time
+import traceback
+import types
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+# width in characters of the bars of the timing waterfall
+WATERFALL_WIDTH = 50
+
+# directory of the pipeline packages the DAG files import, put on the path
+# when the runner is run as a script
+MLOPS_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+###############################################################################
+# Define the stand-ins of the airflow classes used by the DAG files
+# ##############################################################################
+
+class LocalDAG:
+    '''
+    Stand-in of airflow.DAG, which keeps the tasks created with dag=self in
+    the order they are defined.
+    '''
+    def __init__(self, dag_id, default_args=None, **kwargs):
+        self.dag_id = dag_id
+        self.default_args = default_args or {}
+        self.tasks = {}
+
+    def __enter__(self):
+        LocalOperator.current_dag = self
+        return self
+
+    def __exit__(self, *exc_info):
+        LocalOperator.current_dag = None
+
+
+class LocalOperator:
+    '''
+    Stand-in of an airflow operator. The dependencies set with >> and << are
+    kept as the task ids of the upstream tasks.
+    '''
+    current_dag = None
+
+    def __init__(self, task_id, dag=None, retries=None, retry_delay=None, **kwargs):
+        self.dag = dag or LocalOperator.current_dag
+        default_args = self.dag.default_args if self.dag is not None else {}
+        self.task_id = task_id
+        self.retries = retries if retries is not None else default_args.get('retries', 0)
+        self.retry_delay = retry_delay if retry_delay is not None else default_args.get('retry_delay',
+                                                                                      timedelta(0))
+        self.upstream_task_ids = []
+        if self.dag is not None:
+            self.dag.tasks[task_id] = self
+
+    def set_downstream(self, others):
+        for other in others if isinstance(others, (list, tuple)) else [others]:
+            if self.task_id not in other.upstream_task_ids:
+                other.upstream_task_ids.append(self.task_id)
+
+    def __rshift__(self, others):
+        self.set_downstream(others)
+        return others
+
+    def __lshift__(self, others):
+        for other in others if isinstance(others, (list, tuple)) else [others]:
+            other.set_downstream(self)
+        return others
+
+    def __rrshift__(self, others):
+        self.__lshift__(others)
+        return self
+
+    def __rlshift__(self, others):
+        self.set_downstream(others)
+        return self
+
+
+class LocalPythonOperator(LocalOperator):
+    '''
+    Stand-in of airflow.operators.python.PythonOperator.
+    '''
+    def __init__(self, task_id, python_callable, op_args=None, op_kwargs=None, **kwargs):
+        super().__init__(task_id, **kwargs)
+        self.python_callable = python_callable
+        self.op_args = list(op_args or [])
+        self.op_kwargs = dict(op_kwargs or {})
+
+
+class LocalBashOperator(LocalOperator):
+    '''
+    Stand-in of airflow.operators.bash.BashOperator.
+    '''
+    def __init__(self, task_id, bash_command, env=None, **kwargs):
+        super().__init__(task_id, **kwargs)
+        self.python_callable = run_bash_command
+        self.op_args = [bash_command, env]
+        self.op_kwargs = {}
+
+
+def run_bash_command(bash_command, env=None):
+    '''
+    Runs the command of a bash task and raises an error if it fails.
+    '''
+    subprocess.run(['bash', '-c', bash_command], env=env, check=True)
+
+
+@contextmanager
+def airflow_shims():
+    '''
+    Replaces the airflow modules imported by the DAG files with the stand-ins
+    while the DAG files are imported, whether or not Airflow is installed.
+    '''
+    shims = {
+        'airflow': types.ModuleType('airflow'),
+        'airflow.operators': types.ModuleType('airflow.operators'),
+        'airflow.operators.python': types.ModuleType('airflow.operators.python'),
+        'airflow.operators.bash': types.ModuleType('airflow.operators.bash'),
+    }
+    shims['airflow'].DAG = LocalDAG
+    shims['airflow'].operators = shims['airflow.operators']
+    shims['airflow.operators'].python = shims['airflow.operators.python']
+    shims['airflow.operators'].bash = shims['airflow.operators.bash']
+    shims['airflow.operators.python'].PythonOperator = LocalPythonOperator
+    shims['airflow.operators.bash'].BashOperator = LocalBashOperator
+
+    previous = {name: sys.modules.get(name) for name in shims}
+    sys.modules.update(shims)
+    try:
+        yield
+    finally:
+        for name, module in previous.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+
+
+###############################################################################
+# Define the functions to load and order the DAGs
+# ##############################################################################
+
+def load_dags(dag_file):
+    '''
+    This function imports a DAG file with the stand-ins of the airflow modules
+    and returns the DAGs it defines.
+
+
+    INPUTS
+        dag_file : path of the DAG file
+
+
+    OUTPUT
+        list of LocalDAG, in the order they are defined in the file
+
+
+    SAMPLE USAGE
+        dags = load_dags('Lead_scoring_data_pipeline/lead_scoring_data_pipeline.py')
+    '''
+    module_name = 'local_dag_' + os.path.splitext(os.path.basename(dag_file))[0]
+    spec = importlib.util.spec_from_file_location(module_name, dag_file)
+    module = importlib.util.module_from_spec(spec)
+    with airflow_shims():
+        spec.loader.exec_module(module)
+    return [value for value in vars(module).values() if isinstance(value, LocalDAG)]
+
+
+def task_order(dag):
+    '''
+    Returns the task ids of the DAG in an order in which every task comes
+    after its upstream tasks, the tasks that are ready first taken in the
+    order they are defined. Raises a ValueError if the dependencies have a
+    cycle.
+    '''
+    order, done = [], set()
+    while len(order) < len(dag.tasks):
+        ready = [task_id for task_id, task in dag.tasks.items()
+                 if task_id not in done and all(upstream in done for upstream in task.upstream_task_ids)]
+        if not ready:
+            raise ValueError(f"The tasks of {dag.dag_id} have a cycle: "
+                             f"{sorted(set(dag.tasks) - done)}")
+        order += ready
+        done.update(ready)
+    return order
+
+
+###############################################################################
+# Define the functions to run a DAG
+# ##############################################################################
+
+def execute_task(dag_id, task_id, run_id, python_callable, op_args, op_kwargs, retries, retry_delay):
+    '''
+    Runs the callable of a task with its retries, in a worker thread or
+    process, and returns a dictionary with its status, attempts, start and
+    end times and, if it failed, the traceback of the last attempt.
+    '''
+    from instrumentation import task_context
+    start = time.time()
+    for attempt in range(1, retries + 2):
+        try:
+            with task_context(dag_id, task_id, run_id):
+                python_callable(*op_args, **op_kwargs)
+            return {'status': 'success', 'attempts': attempt, 'start': start, 'end': time.time()}
+        except Exception:
+            error = traceback.format_exc()
+            if attempt <= retries:
+                print(f"{task_id} failed, retrying in {retry_delay.total_seconds():.0f}s")
+                time.sleep(retry_delay.total_seconds())
+    return {'status': 'failed', 'attempts': attempt, 'start': start, 'end': time.time(), 'error': error}
+
+
+def run_dag(dag, executor='thread', workers=4, retries=None):
+    '''
+    This function runs the tasks of a DAG in dependency order. Each task is
+    submitted to the pool as soon as all its upstream tasks succeeded, so
+    independent tasks run concurrently. The tasks downstream of a failed task
+    are not run and get the status 'upstream_failed'.
+
+
+    INPUTS
+        dag : LocalDAG returned by load_dags
+        executor : 'thread' or 'process'. The tasks of a process pool run in
+                   processes of their own, as Airflow runs them
+        workers : maximum number of tasks running at the same time
+        retries : number of retries of a failed task, defaults to the retries
+                  of the task, i.e. of the default_args of the DAG
+
+
+    OUTPUT
+        dictionary mapping the task ids to the results of execute_task, in the
+        order the tasks started
+
+
+    SAMPLE USAGE
+        results = run_dag(load_dags('Lead_scoring_data_pipeline/lead_scoring_data_pipeline.py')[0])
+    '''
+    run_id = 'local__' + datetime.now().isoformat(timespec='seconds')
+    task_order(dag)
+    pool_class = (concurrent.futures.ProcessPoolExecutor if executor == 'process'
+                  else concurrent.futures.ThreadPoolExecutor)
+    results, running = {}, {}
+    with pool_class(max_workers=workers) as pool:
+        while len(results) < len(dag.tasks):
+            for task_id, task in dag.tasks.items():
+                if task_id in results or task_id in running.values():
+                    continue
+                upstream_status = [results.get(upstream, {}).get('status') for upstream in task.upstream_task_ids]
+                if any(status in ('failed', 'upstream_failed') for status in upstream_status):
+                    results[task_id] = {'status': 'upstream_failed', 'attempts': 0}
+                elif all(status == 'success' for status in upstream_status):
+                    print(f"Running {dag.dag_id}.{task_id}")
+                    future = pool.submit(execute_task, dag.dag_id, task_id, run_id, task.python_callable,
+                                         task.op_args, task.op_kwargs,
+                                         task.retries if retries is None else retries, task.retry_delay)
+                    running[future] = task_id
+            if not running:
+                continue
+            finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                task_id = running.pop(future)
+                results[task_id] = future.result()
+                if results[task_id]['status'] == 'failed':
+                    print(f"{dag.dag_id}.{task_id} failed:\n{results[task_id]['error']}")
+    return dict(sorted(results.items(), key=lambda item: item[1].get('start', float('inf'))))
+
+
+def print_waterfall(dag, results, width=WATERFALL_WIDTH):
+    '''
+    Prints the start, duration and status of every task of a run, with a bar
+    showing when the task ran within the run.
+    '''
+    started = [result for result in results.values() if 'start' in result]
+    if not started:
+        return
+    run_start = min(result['start'] for result in started)
+    run_time = max(result['end'] for result in started) - run_start
+    scale = width / run_time if run_time > 0 else 0
+    print(f"\n{dag.dag_id}: {run_time:.2f}s")
+    print(f"{'task':<32} {'start (s)':>10} {'time (s)':>10}  {'status':<16} timeline")
+    for task_id, result in results.items():
+        if 'start' not in result:
+            print(f"{task_id:<32} {'':>10} {'':>10}  {result['status']:<16}")
+            continue
+        offset, duration = result['start'] - run_start, result['end'] - result['start']
+        bar = (' ' * int(offset * scale) + '#' * max(1, round(duration * scale)))[:width]
+        print(f"{task_id:<32} {offset:>10.2f} {duration:>10.2f}  {result['status']:<16} |{bar:<{width}}|")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('dag_files', nargs='+', help='DAG files, run one after the other')
+    parser.add_argument('--executor', choices=['thread', 'process'], default='thread')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--retries', type=int, default=None, help='overrides the retries of the tasks')
+    parser.add_argument('--list', action='store_true', help='print the tasks in order without running them')
+    args = parser.parse_args()
+    if MLOPS_DIRECTORY not in sys.path:
+        sys.path.insert(0, MLOPS_DIRECTORY)
+
+    # the DAGs of the later files use the tables of the earlier ones, they are
+    # not run once a DAG failed
+    for dag_file in args.dag_files:
+        for dag in load_dags(dag_file):
+            if args.list:
+                print(f"{dag.dag_id}: {' -> '.join(task_order(dag))}")
+                continue
+            results = run_dag(dag, args.executor, args.workers, args.retries)
+            print_waterfall(dag, results)
+            if any(result['status'] != 'success' for result in results.values()):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+'''
+filename: model_cache.py
+functions: resolve_model_version, load_cached_model, prune_versions, record_model_load
+Local cache of the registered LightGBM models, keyed by their registry
+version, so that the inference pipeline downloads a model once per version
+and reloads it only when the version of the stage changed.
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import json
+import os
+import shutil
+import threading
+import time
+
+# native LightGBM model of a version, in '<cache>/<model name>/<version>/'
+MODEL_FILE_NAME = 'model.txt'
+
+# boosters of the versions loaded by this process, by (model name, version)
+_loaded_models = {}
+_loaded_models_lock = threading.Lock()
+
+
+###############################################################################
+# Define the function to resolve the version of a stage
+# ##############################################################################
+
+def resolve_model_version(model_name, stage, cache_directory, client=None):
+    '''
+    Returns the version of the model in the stage, as a string, from a
+    single lookup of the registry metadata, and records it in the cache as
+    the last known version of the stage. If the registry can't be reached
+    the last known version is returned, so that the cached model still
+    serves, and the error is raised if there is none.
+    '''
+    import mlflow
+    pointer_path = os.path.join(cache_directory, model_name, f'{stage}.json')
+    try:
+        client = client or mlflow.tracking.MlflowClient()
+        versions = client.get_latest_versions(model_name, stages=[stage])
+        if not versions:
+            raise LookupError(f"No version of the model {model_name} in the stage {stage}")
+        version = str(versions[0].version)
+    except Exception as e:
+        if not os.path.exists(pointer_path):
+            raise
+        with open(pointer_path) as pointer_file:
+            version = json.load(pointer_file)['version']
+        print(f"Model registry lookup failed ({e}), using the last known version {version} of {stage}")
+        return version
+
+    os.makedirs(os.path.dirname(pointer_path), exist_ok=True)
+    with open(pointer_path + '.tmp', 'w') as pointer_file:
+        json.dump({'version': version, 'resolved_at': time.time()}, pointer_file)
+    os.replace(pointer_path + '.tmp', pointer_path)
+    return version
+
+
+###############################################################################
+# Define the function to load a model through the cache
+# ##############################################################################
+
+def load_cached_model(model_name, stage, cache_directory, keep_versions=2, client=None):
+    '''
+    This function returns the booster of the model in the stage. The version
+    of the stage is looked up in the registry (see resolve_model_version),
+    then the booster is taken from, in order:
+
+      'memory'   the boosters already loaded by this process, a long running
+                 process reloads the model only when the version changed
+      'disk'     the native model file of the version in the cache directory,
+                 nothing is downloaded from the registry
+      'download' the registry, the model is then saved in the cache
+
+    Only the 'keep_versions' most recently used versions are kept on disk and
+    in memory.
+
+
+    INPUTS
+        model_name : name of the registered model
+        stage : stage of the model, e.g. 'Production'
+        cache_directory : directory of the cache, created if needed
+        keep_versions : number of versions kept in the cache
+        client : MlflowClient of the registry, defaults to the tracking uri
+                 set with mlflow.set_tracking_uri
+
+
+    OUTPUT
+        tuple (booster, version, status, load_seconds)
+
+
+    SAMPLE USAGE
+        model, version, status, seconds = load_cached_model('LightGBM', 'Production', MODEL_CACHE_DIRECTORY)
+    '''
+    import lightgbm as lgb
+    start = time.perf_counter()
+    version = resolve_model_version(model_name, stage, cache_directory, client)
+    version_directory = os.path.join(cache_directory, model_name, version)
+    model_path = os.path.join(version_directory, MODEL_FILE_NAME)
+
+    with _loaded_models_lock:
+        booster = _loaded_models.get((model_name, version))
+    if booster is not None:
+        status = 'memory'
+    elif os.path.exists(model_path):
+        status = 'disk'
+        booster = lgb.Booster(model_file=model_path)
+    else:
+        import mlflow.lightgbm
+        status = 'download'
+        model = mlflow.lightgbm.load_model(f"models:/{model_name}/{version}")
+        # a model registered as an LGBMClassifier is cached as its booster
+        booster = getattr(model, 'booster_', model)
+        os.makedirs(version_directory, exist_ok=True)
+        booster.save_model(model_path + '.tmp')
+        os.replace(model_path + '.tmp', model_path)
+
+    with _loaded_models_lock:
+        # the versions of this model other than the new one are dropped
+        for key in [key for key in _loaded_models if key[0] == model_name and key[1] != version]:
+            del _loaded_models[key]
+        _loaded_models[(model_name, version)] = booster
+    os.utime(version_directory)
+    prune_versions(os.path.join(cache_directory, model_name), keep_versions)
+
+    load_seconds = time.perf_counter() - start
+    print(f"Model {model_name} version {version} ({stage}) loaded from {status} in {load_seconds:.3f}s")
+    return booster, version, status, load_seconds
+
+
+def prune_versions(model_directory, keep_versions):
+    '''
+    Removes the cached versions of the model except the 'keep_versions' most
+    recently used ones.
+    '''
+    versions = [entry for entry in os.scandir(model_directory) if entry.is_dir()]
+    versions.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in versions[keep_versions:]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+
+###############################################################################
+# Define the function to record the loads
+# ##############################################################################
+
+def record_model_load(conn, table_name, model_name, version, status, load_seconds):
+    '''
+    Appends the load of a model, with its version, cache status and load
+    time, to the table of the model loads of the db.
+    '''
+    conn.execute(f'CREATE TABLE IF NOT EXISTS {table_name} '
+                 '(model_name TEXT, version TEXT, status TEXT, load_seconds REAL, loaded_at TEXT)')
+    conn.execute(f"INSERT INTO {table_name} VALUES (?, ?, ?, ?, datetime('now'))",
+                 (model_name, version, status, load_seconds))
+    conn.commit()
@@ -13,3 +13,12 @@ list_medium = [
 list_source = [
     'Level2', 'Level0', 'Level7', 'Level4', 'Level6', 'Level16', 'Level5', 'Level14'
 ]
+
+
+# significant levels of every categorical column, all the other levels are
+# collapsed into a single level called others
+significant_levels = {
+    'first_platform_c': list_platform,
+    'first_utm_medium_c': list_medium,
+    'first_utm_source_c': list_source
+}
@@ -0,0 +1,314 @@
+'''
+filename: storage.py
+classes: SQLiteStorage, ParquetStorage
+functions: get_storage
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import glob
+import os
+import shutil
+import tempfile
+
+import pandas as pd
+
+from instrumentation import record_io
+
+
+###############################################################################
+# Define the sqlite backend
+# ##############################################################################
+
+class SQLiteStorage:
+    '''
+    Stores the tables of the pipelines in their sqlite db. This is the default
+    backend, every method takes the open sqlite3 connection of the task.
+    '''
+
+    def exists(self, conn, table_name):
+        query = "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?"
+        return conn.execute(query, (table_name,)).fetchone() is not None
+
+    def count(self, conn, table_name):
+        return conn.execute(f'SELECT COUNT(*) FROM "{table_name}"').fetchone()[0]
+
+    def columns(self, conn, table_name):
+        return [col[1] for col in conn.execute(f'PRAGMA table_info("{table_name}")').fetchall()]
+
+    def max_value(self, conn, table_name, column):
+        return conn.execute(f'SELECT MAX("{column}") FROM "{table_name}"').fetchone()[0]
+
+    def create_index(self, conn, table_name, column):
+        conn.execute(f'CREATE INDEX IF NOT EXISTS "ix_{table_name}_{column}" ON "{table_name}" ("{column}")')
+        conn.commit()
+
+    def read(self, conn, table_name, columns=None, created_after=None):
+        '''
+        Reads the table, or only the given columns of it, into a dataframe. If
+        'created_after' is given only the rows with a newer 'created_date' are
+        read.
+        '''
+        projection = ', '.join(f'"{col}"' for col in columns) if columns else '*'
+        query = f'SELECT {projection} FROM "{table_name}"'
+        if created_after is None:
+            df = pd.read_sql(query, conn)
+        else:
+            df = pd.read_sql(query + ' WHERE created_date > ?', conn, params=(created_after,))
+        record_io(read=df)
+        return df
+
+    def read_chunks(self, conn, table_name, chunksize, columns=None):
+        '''
+        Yields the table, or only the given columns of it, as dataframes of at
+        most 'chunksize' rows so that the table is never held in memory.
+        '''
+        projection = ', '.join(f'"{col}"' for col in columns) if columns else '*'
+        for chunk in pd.read_sql(f'SELECT {projection} FROM "{table_name}"', conn, chunksize=chunksize):
+            record_io(read=chunk)
+            yield chunk
+
+    def write(self, conn, df, table_name, if_exists='replace'):
+        df.to_sql(table_name, conn, if_exists=if_exists, index=False)
+        record_io(written=df)
+
+    def write_chunks(self, conn, chunks, table_name, if_exists='replace'):
+        '''
+        Writes an iterable of dataframes to the table inside a single
+        transaction, so readers either see the previous table or the complete
+        new one. The table is created from the first chunk the same way to_sql
+        does when it is replaced. Returns the number of rows written.
+        '''
+        rows = 0
+        insert_query = None
+        cursor = conn.cursor()
+        cursor.execute('BEGIN')
+        try:
+            if if_exists == 'replace':
+                cursor.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+            for chunk in chunks:
+                if insert_query is None:
+                    if not self.exists(conn, table_name):
+                        cursor.execute(pd.io.sql.get_schema(chunk, table_name, con=conn))
+                    columns = ', '.join(f'"{col}"' for col in chunk.columns)
+                    placeholders = ', '.join('?' * len(chunk.columns))
+                    insert_query = f'INSERT INTO "{table_name}" ({columns}) VALUES ({placeholders})'
+                values = chunk.astype(object).where(chunk.notna(), None)
+                cursor.executemany(insert_query, values.itertuples(index=False, name=None))
+                record_io(written=chunk)
+                rows += len(chunk)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+        return rows
+
+
+###############################################################################
+# Define the parquet backend
+# ##############################################################################
+
+class ParquetStorage:
+    '''
+    Stores the tables listed in 'tables' as parquet datasets, one directory of
+    part files per table under 'directory', and delegates every other table
+    to the sqlite db. Reads are memory mapped and only decode the requested
+    columns. pyarrow is only needed when this backend is selected.
+    '''
+
+    def __init__(self, directory, tables):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError("The parquet storage backend requires pyarrow, install it with "
+                              "'pip install pyarrow' or set STORAGE_BACKEND = 'sqlite'") from e
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.directory = directory
+        self.tables = set(tables)
+        self.sqlite = SQLiteStorage()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, table_name):
+        return os.path.join(self.directory, table_name)
+
+    def parts(self, table_name):
+        return sorted(glob.glob(os.path.join(self.path(table_name), 'part-*.parquet')))
+
+    def exists(self, conn, table_name):
+        if table_name not in self.tables:
+            return self.sqlite.exists(conn, table_name)
+        return len(self.parts(table_name)) > 0
+
+    def count(self, conn, table_name):
+        if table_name not in self.tables:
+            return self.sqlite.count(conn, table_name)
+        # row counts come from the footers, no data page is read
+        return sum(self.pq.ParquetFile(part).metadata.num_rows for part in self.parts(table_name))
+
+    def columns(self, conn, table_name):
+        if table_name not in self.tables:
+            return self.sqlite.columns(conn, table_name)
+        parts = self.parts(table_name)
+        return self.pq.read_schema(parts[0]).names if parts else []
+
+    def max_value(self, conn, table_name, column):
+        if table_name not in self.tables:
+            return self.sqlite.max_value(conn, table_name, column)
+        values = self.pq.read_table(self.path(table_name), columns=[column], memory_map=True).column(column)
+        return self.pa.compute.max(values).as_py()
+
+    def create_index(self, conn, table_name, column):
+        if table_name not in self.tables:
+            self.sqlite.create_index(conn, table_name, column)
+
+    def read(self, conn, table_name, columns=None, created_after=None):
+        '''
+        Reads the table, or only the given columns of it, into a dataframe. If
+        'created_after' is given only the rows with a newer 'created_date' are
+        read, the filter is pushed down to the row groups.
+        '''
+        if table_name not in self.tables:
+            return self.sqlite.read(conn, table_name, columns, created_after)
+        filters = [('created_date', '>', created_after)] if created_after is not None else None
+        table = self.pq.read_table(self.path(table_name), columns=columns, filters=filters, memory_map=True)
+        df = table.to_pandas()
+        record_io(read=df)
+        return df
+
+    def read_chunks(self, conn, table_name, chunksize, columns=None):
+        '''
+        Yields the table, or only the given columns of it, as dataframes of at
+        most 'chunksize' rows decoded one record batch at a time.
+        '''
+        if table_name not in self.tables:
+            yield from self.sqlite.read_chunks(conn, table_name, chunksize, columns)
+            return
+        for part in self.parts(table_name):
+            parquet_file = self.pq.ParquetFile(part, memory_map=True)
+            for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+                chunk = batch.to_pandas()
+                record_io(read=chunk)
+                yield chunk
+
+    def write(self, conn, df, table_name, if_exists='replace'):
+        if table_name not in self.tables:
+            return self.sqlite.write(conn, df, table_name, if_exists)
+        self.write_chunks(conn, [df], table_name, if_exists)
+
+    def writer_schema(self, chunk, table):
+        '''
+        Returns the schema of a new part file from its first chunk. Categorical
+        columns get the same index width in every chunk, and the columns the
+        first chunk has no type for, all null or categorical without any
+        category, are typed as strings so that the later chunks fill them.
+        '''
+        fields = []
+        for field in table.schema:
+            if self.pa.types.is_dictionary(field.type):
+                value_type = field.type.value_type
+                if len(chunk[field.name].cat.categories) == 0:
+                    value_type = self.pa.string()
+                field = self.pa.field(field.name, self.pa.dictionary(self.pa.int32(), value_type))
+            elif self.pa.types.is_null(field.type):
+                field = self.pa.field(field.name, self.pa.string())
+            fields.append(field)
+        return self.pa.schema(fields, metadata=table.schema.metadata)
+
+    def write_chunks(self, conn, chunks, table_name, if_exists='replace'):
+        '''
+        Writes an iterable of dataframes as the row groups of a new part file.
+        When the table is replaced the part file is written to a temporary
+        directory which is swapped in once complete, so readers either see the
+        previous table or the complete new one. Returns the number of rows
+        written.
+        '''
+        if table_name not in self.tables:
+            return self.sqlite.write_chunks(conn, chunks, table_name, if_exists)
+
+        path = self.path(table_name)
+        existing_parts = self.parts(table_name)
+        if if_exists == 'append' and existing_parts:
+            # appended parts keep the schema of the table
+            target = path
+            schema = self.pq.read_schema(existing_parts[0])
+            part_file = os.path.join(path, f'part-{len(existing_parts):05d}.parquet')
+        else:
+            target = tempfile.mkdtemp(prefix=f'.{table_name}-', dir=self.directory)
+            schema = None
+            part_file = os.path.join(target, 'part-00000.parquet')
+
+        rows = 0
+        writer = None
+        try:
+            for chunk in chunks:
+                table = self.pa.Table.from_pandas(chunk, preserve_index=False)
+                if schema is None:
+                    schema = self.writer_schema(chunk, table)
+                # every chunk is cast to the schema of the part file, a column
+                # whose dtype differs from the first chunk's is converted
+                table = table.cast(schema)
+                if writer is None:
+                    writer = self.pq.ParquetWriter(part_file, schema)
+                writer.write_table(table)
+                record_io(written=chunk)
+                rows += len(chunk)
+            if writer is not None:
+                writer.close()
+                writer = None
+        except Exception:
+            if writer is not None:
+                writer.close()
+            if target == path:
+                if os.path.exists(part_file):
+                    os.remove(part_file)
+            else:
+                shutil.rmtree(target, ignore_errors=True)
+            raise
+
+        if target != path:
+            # swap the new table in place of the previous one
+            previous = None
+            if os.path.exists(path):
+                previous = tempfile.mkdtemp(prefix=f'.{table_name}-old-', dir=self.directory)
+                os.rename(path, os.path.join(previous, table_name))
+            os.rename(target, path)
+            if previous is not None:
+                shutil.rmtree(previous, ignore_errors=True)
+        return rows
+
+
+###############################################################################
+# Define the function to select the backend
+# ##############################################################################
+
+def get_storage(backend='sqlite', parquet_directory=None, parquet_tables=()):
+    '''
+    Returns the storage backend selected in the constants of a pipeline.
+
+
+    INPUTS
+        backend : 'sqlite' (default) or 'parquet'
+        parquet_directory : directory holding the parquet datasets
+        parquet_tables : tables stored as parquet when the backend is 'parquet',
+                         all the other tables stay in the sqlite db
+
+
+    OUTPUT
+        SQLiteStorage or ParquetStorage object
+
+
+    SAMPLE USAGE
+        storage = get_storage(STORAGE_BACKEND, PARQUET_DIRECTORY, PARQUET_TABLES)
+        df = storage.read(conn, 'model_input', columns=['city_tier'])
+    '''
+    if backend == 'sqlite':
+        return SQLiteStorage()
+    if backend == 'parquet':
+        return ParquetStorage(parquet_directory, parquet_tables)
+    raise ValueError(f"Unknown storage backend '{backend}', expected 'sqlite' or 'parquet'")
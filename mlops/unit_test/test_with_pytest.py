@@ -10,6 +10,20 @@ import importlib
 import pandas as pd
 from city_tier_mapping import city_tier_mapping
 from significant_categorical_level import *
+from storage import get_storage
+from sqlite_connection import get_connection
+from instrumentation import instrument_task
+from local_runner import load_dags, run_dag
+from one_hot_encoder import compile_one_hot_encoder, one_hot_encode, encode_features_frame
+from dataset_cache import load_or_build_dataset
+from tuning import sample_candidates, successive_halving
+from cross_validation import cross_validate
+import incremental
+from model_cache import load_cached_model
+from micro_batching import MicroBatcher
+from data_validation_checks import validate_chunks
+from schema import raw_data_expectations
+import level_frequencies
 
 from constants import (
     DB_PATH,
@@ -114,6 +128,54 @@ def test_load_data_into_db(override_constants):
     
     
 
+def test_load_data_into_db_streaming(override_constants):
+    """_summary_
+    This function checks if the streaming mode of load_data_into_db loads the
+    same data as the default mode while reading the csv in several chunks, and
+    if both modes record the rows of the csv read in the metrics of the task.
+
+    INPUTS
+        UNIT_TEST_DB_FILE_NAME: Name of the test database file 'unit_test_cases.db'
+        UNIT_TEST_DATA_FILE_NAME: Name of the test csv file 'leadscoring_test.csv'
+
+    SAMPLE USAGE
+        output=test_load_data_into_db_streaming()
+    """
+    db_full_path = os.path.join(UNIT_TEST_DB_PATH, UNIT_TEST_DB_FILE_NAME)
+
+    # Load the data in one go and keep it as the expected output
+    utils.load_data_into_db()
+    conn = sqlite3.connect(db_full_path)
+    try:
+        expected_data = pd.read_sql_query(f"SELECT * FROM {UNIT_TEST_DB_DATA_TABLE_NAME}", conn)
+    finally:
+        conn.close()
+    rows = len(expected_data)
+
+    # Reload the same csv in chunks of 30 rows
+    streamed_rows, streamed_chunks = utils.load_data_into_db(streaming=True, chunksize=30)
+    conn = sqlite3.connect(db_full_path)
+    try:
+        actual_data = pd.read_sql_query(f"SELECT * FROM {UNIT_TEST_DB_DATA_TABLE_NAME}", conn)
+    finally:
+        conn.close()
+
+    assert streamed_rows == rows
+    assert streamed_chunks == -(-rows // 30)
+    pd.testing.assert_frame_equal(actual_data, expected_data)
+
+    # Both loads record the rows of the csv they read, the load in one go is
+    # run again as the first one may be skipped by the stage cache
+    utils.load_data_into_db()
+    conn = sqlite3.connect(db_full_path)
+    try:
+        metrics = pd.read_sql_query("SELECT rows_read FROM pipeline_metrics "
+                                    "WHERE function_name = 'load_data_into_db'", conn)
+    finally:
+        conn.close()
+    assert metrics['rows_read'].tolist()[-2:] == [rows, rows]
+
+
 ###############################################################################
 # Write test cases for map_city_tier() function
 # ##############################################################################
@@ -214,6 +276,32 @@ def test_map_categorical_vars(override_constants):
         conn.close()
     
 
+def test_collapse_categorical_levels():
+    """_summary_
+    This function checks if collapse_categorical_levels keeps the rows in their
+    original order, emits Categorical columns and maps the insignificant levels
+    and the nulls to "others".
+
+    SAMPLE USAGE
+        output=test_collapse_categorical_levels()
+    """
+    df = pd.DataFrame({
+        'first_platform_c': ['Level3', 'Level99', None, 'Level0'],
+        'first_utm_medium_c': ['Level0', 'Level2', 'Level77', 'Level43'],
+        'first_utm_source_c': ['Level55', 'Level2', 'Level0', None],
+        'total_leads_droppped': [1.0, 2.0, 3.0, 4.0]
+    })
+
+    collapsed = utils.collapse_categorical_levels(df)
+
+    assert list(collapsed.index) == list(df.index)
+    assert all(isinstance(collapsed[col].dtype, pd.CategoricalDtype) for col in significant_levels)
+    assert collapsed['first_platform_c'].tolist() == ['Level3', 'others', 'others', 'Level0']
+    assert collapsed['first_utm_medium_c'].tolist() == ['Level0', 'Level2', 'others', 'Level43']
+    assert collapsed['first_utm_source_c'].tolist() == ['others', 'Level2', 'Level0', 'others']
+    pd.testing.assert_series_equal(collapsed['total_leads_droppped'], df['total_leads_droppped'])
+
+
 ###############################################################################
 # Write test cases for interactions_mapping() function
 # ##############################################################################    
@@ -258,3 +346,1057 @@ def test_interactions_mapping(override_constants):
     finally:
         # Close the database connections
         conn.close()   
+
+
+###############################################################################
+# Write test cases for run_fused_data_pipeline() function
+# ##############################################################################
+def test_run_fused_data_pipeline(override_constants):
+    """_summary_
+    This function checks if run_fused_data_pipeline produces the same
+    'model_input' table as running map_city_tier, map_categorical_vars and
+    interactions_mapping one after the other.
+
+    INPUTS
+        UNIT_TEST_DB_FILE_NAME: Name of the test database file 'unit_test_cases.db'
+
+    SAMPLE USAGE
+        output=test_run_fused_data_pipeline()
+    """
+    utils.load_data_into_db()
+    utils.map_city_tier()
+    utils.map_categorical_vars()
+    utils.interactions_mapping()
+
+    conn = sqlite3.connect(f"{UNIT_TEST_DB_PATH}/{UNIT_TEST_DB_FILE_NAME}")
+    try:
+        expected_data = pd.read_sql_query("SELECT * FROM model_input", conn)
+
+        utils.run_fused_data_pipeline()
+        actual_data = pd.read_sql_query("SELECT * FROM model_input", conn)
+    finally:
+        conn.close()
+
+    pd.testing.assert_frame_equal(actual_data, expected_data)
+
+
+###############################################################################
+# Write test cases for apply_interactions_mapping() function
+# ##############################################################################
+def test_apply_interactions_mapping():
+    """_summary_
+    This function checks if apply_interactions_mapping sums the interaction
+    columns into their groups and aggregates the rows sharing the same index
+    columns, the way the previous melt/pivot_table implementation did.
+
+    SAMPLE USAGE
+        output=test_apply_interactions_mapping()
+    """
+    interaction_mapping_df = pd.DataFrame({
+        'interaction_type': ['careers', 'chat_clicked', 'syllabus', 'companies'],
+        'interaction_mapping': ['career_interaction', 'assistance_interaction',
+                                'syllabus_interaction', 'assistance_interaction']
+    })
+    df = pd.DataFrame({
+        'created_date': ['2021-07-02 10:00:00', '2021-07-01 10:00:00', '2021-07-01 10:00:00'],
+        'first_platform_c': ['Level0', 'Level3', 'Level3'],
+        'first_utm_medium_c': ['Level0', 'Level2', 'Level2'],
+        'first_utm_source_c': ['others', 'Level2', 'Level2'],
+        'total_leads_droppped': [1.0, 2.0, 2.0],
+        'city_tier': [1.0, 3.0, 3.0],
+        'referred_lead': [0.0, 0.0, 0.0],
+        'app_complete_flag': [1, 0, 0],
+        'careers': [1.0, None, 1.0],
+        'chat_clicked': [None, 1.0, 1.0],
+        'syllabus': [None, None, None],
+        'companies': [1.0, 1.0, None]
+    })
+
+    df_mapped, df_model_input = utils.apply_interactions_mapping(df, interaction_mapping_df)
+
+    assert df_mapped['assistance_interaction'].tolist() == [1.0, 2.0, 1.0]
+    assert df_mapped['career_interaction'].tolist() == [1.0, 0.0, 1.0]
+    assert df_model_input['created_date'].tolist() == ['2021-07-01 10:00:00', '2021-07-02 10:00:00']
+    assert list(df_model_input.columns[-3:]) == ['assistance_interaction', 'career_interaction', 'syllabus_interaction']
+    assert df_model_input['assistance_interaction'].tolist() == [3.0, 1.0]
+    assert df_model_input['career_interaction'].tolist() == [1.0, 1.0]
+    assert df_model_input['syllabus_interaction'].tolist() == [0.0, 0.0]
+
+
+###############################################################################
+# Write test cases for the incremental mode of the pipeline
+# ##############################################################################
+def test_incremental_processing(override_constants, tmp_path, monkeypatch):
+    """_summary_
+    This function checks if processing a new drop of leads incrementally, on
+    top of a full run over the older leads, gives the same 'model_input' table
+    as a full rebuild over all the leads.
+
+    INPUTS
+        UNIT_TEST_DB_FILE_NAME: Name of the test database file 'unit_test_cases.db'
+        UNIT_TEST_DATA_FILE_NAME: Name of the test csv file 'leadscoring_test.csv'
+
+    SAMPLE USAGE
+        output=test_incremental_processing()
+    """
+    leads = pd.read_csv(os.path.join(UNIT_TEST_DATA_DIRECTORY, UNIT_TEST_DATA_FILE_NAME))
+    leads = leads.sort_values('created_date')
+    old_leads = leads.iloc[:60]
+    monkeypatch.setattr(utils, 'DATA_DIRECTORY', str(tmp_path))
+
+    def run_pipeline(incremental):
+        utils.load_data_into_db(incremental=incremental)
+        utils.map_city_tier(incremental=incremental)
+        utils.map_categorical_vars(incremental=incremental)
+        utils.interactions_mapping(incremental=incremental)
+        conn = sqlite3.connect(f"{UNIT_TEST_DB_PATH}/{UNIT_TEST_DB_FILE_NAME}")
+        try:
+            return pd.read_sql_query("SELECT * FROM model_input", conn)
+        finally:
+            conn.close()
+
+    # Full rebuild over all the leads
+    leads.to_csv(tmp_path / UNIT_TEST_DATA_FILE_NAME, index=False)
+    expected_data = run_pipeline(incremental=False)
+
+    # Full run over the older leads followed by an incremental run over all of them
+    old_leads.to_csv(tmp_path / UNIT_TEST_DATA_FILE_NAME, index=False)
+    run_pipeline(incremental=False)
+    leads.to_csv(tmp_path / UNIT_TEST_DATA_FILE_NAME, index=False)
+    actual_data = run_pipeline(incremental=True)
+
+    pd.testing.assert_frame_equal(actual_data, expected_data)
+
+    # Running again without new leads doesn't change anything
+    pd.testing.assert_frame_equal(run_pipeline(incremental=True), expected_data)
+
+
+###############################################################################
+# Write test cases for the stage cache
+# ##############################################################################
+def test_stage_cache(override_constants, capsys):
+    """_summary_
+    This function checks if a stage is skipped when its inputs are unchanged
+    since its last run, and runs again once an upstream table changes.
+
+    INPUTS
+        UNIT_TEST_DB_FILE_NAME: Name of the test database file 'unit_test_cases.db'
+
+    SAMPLE USAGE
+        output=test_stage_cache()
+    """
+    utils.load_data_into_db()
+    utils.map_city_tier()
+    capsys.readouterr()
+
+    # Nothing changed, both stages are skipped
+    assert utils.load_data_into_db() == (0, 0)
+    utils.map_city_tier()
+    assert 'Stage cache hit for map_city_tier' in capsys.readouterr().out
+
+    # Reloading the data with other options changes 'loaded_data's fingerprint
+    utils.load_data_into_db(streaming=True, chunksize=40)
+    utils.map_city_tier()
+    assert 'Stage cache miss for map_city_tier' in capsys.readouterr().out
+
+    conn = sqlite3.connect(f"{UNIT_TEST_DB_PATH}/{UNIT_TEST_DB_FILE_NAME}")
+    try:
+        hits, misses = conn.execute("SELECT hits, misses FROM stage_cache WHERE stage = 'map_city_tier'").fetchone()
+    finally:
+        conn.close()
+    assert hits >= 1 and misses >= 2
+
+
+###############################################################################
+# Write test cases for the parquet storage backend
+# ##############################################################################
+def test_parquet_storage_backend(override_constants, tmp_path, monkeypatch):
+    """_summary_
+    This function checks if the pipeline produces the same 'model_input' when
+    'loaded_data' and 'model_input' are stored as parquet datasets, and if the
+    reads of the parquet backend project columns and filter on 'created_date'.
+
+    INPUTS
+        UNIT_TEST_DB_FILE_NAME: Name of the test database file 'unit_test_cases.db'
+
+    SAMPLE USAGE
+        output=test_parquet_storage_backend()
+    """
+    utils.load_data_into_db()
+    utils.run_fused_data_pipeline()
+    conn = sqlite3.connect(f"{UNIT_TEST_DB_PATH}/{UNIT_TEST_DB_FILE_NAME}")
+    try:
+        expected_data = pd.read_sql_query("SELECT * FROM model_input", conn)
+
+        storage = get_storage('parquet', str(tmp_path), [UNIT_TEST_DB_DATA_TABLE_NAME, 'model_input'])
+        monkeypatch.setattr(utils, 'STORAGE', storage)
+        utils.load_data_into_db(streaming=True, chunksize=40)
+        utils.run_fused_data_pipeline()
+
+        actual_data = storage.read(conn, 'model_input')
+        assert storage.count(conn, 'model_input') == len(expected_data)
+        assert storage.columns(conn, 'model_input') == list(expected_data.columns)
+
+        cutoff = expected_data['created_date'].sort_values().iloc[len(expected_data) // 2]
+        newer = storage.read(conn, 'model_input', columns=['created_date'], created_after=cutoff)
+    finally:
+        conn.close()
+
+    pd.testing.assert_frame_equal(actual_data.astype(str), expected_data.astype(str))
+    assert list(newer.columns) == ['created_date']
+    assert len(newer) == (expected_data['created_date'] > cutoff).sum()
+
+
+def test_parquet_write_chunks_schema(tmp_path):
+    """_summary_
+    This function checks if the parquet backend writes chunks whose dtypes
+    differ from the first chunk's, such as columns that are all null in the
+    first chunk and filled in a later one, with the schema of the first
+    chunk.
+
+    SAMPLE USAGE
+        output=test_parquet_write_chunks_schema(tmp_path)
+    """
+    first = pd.DataFrame({
+        'city_mapped': pd.Series([None, None], dtype=object).astype('category'),
+        'created_date': pd.Series([None, None], dtype=object),
+        'referred_lead': pd.Series([None, None], dtype='UInt8'),
+    })
+    second = pd.DataFrame({
+        'city_mapped': pd.Series(['Mumbai', 'Pune']).astype('category'),
+        'created_date': ['2021-07-01 01:42:41', '2021-07-02 10:00:00'],
+        'referred_lead': pd.Series([0, 1], dtype='uint8'),
+    })
+    storage = get_storage('parquet', str(tmp_path), ['loaded_data'])
+    assert storage.write_chunks(None, [first, second], 'loaded_data') == 4
+    storage.write_chunks(None, [second], 'loaded_data', if_exists='append')
+
+    df = storage.read(None, 'loaded_data')
+    assert df['city_mapped'].astype(object).tolist()[2:] == ['Mumbai', 'Pune', 'Mumbai', 'Pune']
+    assert df['created_date'].isna().sum() == 2 and df['created_date'].iloc[3] == '2021-07-02 10:00:00'
+    assert df['referred_lead'].tolist()[2:] == [0, 1, 0, 1]
+
+
+###############################################################################
+# Write test cases for the shared sqlite connection
+# ##############################################################################
+def test_get_connection(tmp_path):
+    """_summary_
+    This function checks if get_connection applies the pragmas, reuses the
+    open connection when nested, commits on success and rolls back on error.
+
+    SAMPLE USAGE
+        output=test_get_connection()
+    """
+    db_path = str(tmp_path / 'connection_test.db')
+    with get_connection(db_path) as conn:
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1
+        with get_connection(db_path) as inner_conn:
+            assert inner_conn is conn
+        conn.execute('CREATE TABLE leads (lead_id INTEGER)')
+        conn.execute('INSERT INTO leads VALUES (1)')
+
+    with pytest.raises(ValueError):
+        with get_connection(db_path) as conn:
+            conn.execute('INSERT INTO leads VALUES (2)')
+            raise ValueError('failed task')
+
+    conn = sqlite3.connect(db_path)
+    try:
+        assert conn.execute('SELECT lead_id FROM leads').fetchall() == [(1,)]
+    finally:
+        conn.close()
+
+
+###############################################################################
+# Write test cases for the streaming data validation
+# ##############################################################################
+def test_validate_chunks():
+    """_summary_
+    This function checks if validating the raw data chunk by chunk gives the
+    same report as validating it at once, and if the columns breaking their
+    expectations fail with the right issues.
+
+    INPUTS
+        UNIT_TEST_DATA_FILE_NAME: Name of the test csv file 'leadscoring_test.csv'
+
+    SAMPLE USAGE
+        output=test_validate_chunks()
+    """
+    csv_file_path = f"{UNIT_TEST_DATA_DIRECTORY}/{UNIT_TEST_DATA_FILE_NAME}"
+    df = pd.read_csv(csv_file_path)
+
+    expected_report = validate_chunks([df], raw_data_expectations)
+    actual_report = validate_chunks(pd.read_csv(csv_file_path, chunksize=7), raw_data_expectations)
+    pd.testing.assert_frame_equal(actual_report, expected_report)
+    assert (expected_report['status'] == 'pass').all()
+    assert expected_report.set_index('column_name').loc['referred_lead', 'rows'] == len(df)
+
+    # Break some of the expectations
+    df.loc[0, 'referred_lead'] = 5
+    df.loc[:59, 'first_platform_c'] = 'Level999'
+    df['created_date'] = None
+    report = validate_chunks([df.drop(columns=['app_complete_flag'])], raw_data_expectations)
+    report = report.set_index('column_name')
+    assert report.loc['referred_lead', 'issues'] == 'max 5.0 above 1'
+    assert report.loc['first_platform_c', 'issues'].startswith('level coverage')
+    assert report.loc['created_date', 'issues'].startswith('null rate 1.000')
+    assert report.loc['app_complete_flag', 'issues'] == 'missing column'
+    assert (report['status'] == 'fail').sum() == 4
+
+
+###############################################################################
+# Write test cases for apply_dtype_policy() function
+# ##############################################################################
+def test_apply_dtype_policy():
+    """_summary_
+    This function checks if apply_dtype_policy converts the columns to the
+    compact dtypes without changing their values, and leaves the columns
+    whose values don't fit unchanged.
+
+    INPUTS
+        UNIT_TEST_DATA_FILE_NAME: Name of the test csv file 'leadscoring_test.csv'
+
+    SAMPLE USAGE
+        output=test_apply_dtype_policy()
+    """
+    df = utils.fill_null_lead_counts(pd.read_csv(f"{UNIT_TEST_DATA_DIRECTORY}/{UNIT_TEST_DATA_FILE_NAME}"))
+    df = utils.apply_city_tier_mapping(df)
+    df.loc[0, 'syllabus_expand'] = 3
+    df.loc[1, 'whatsapp_chat_click'] = 1.5
+    compact_df = utils.apply_dtype_policy(df)
+
+    assert isinstance(compact_df['first_platform_c'].dtype, pd.CategoricalDtype)
+    assert compact_df['city_tier'].dtype == 'uint8'
+    assert compact_df['total_leads_droppped'].dtype == 'uint16'
+    assert compact_df['syllabus_expand'].dtype == 'UInt16'
+    assert compact_df['whatsapp_chat_click'].dtype == 'float64'
+    assert compact_df['created_date'].dtype == df['created_date'].dtype
+    assert compact_df.memory_usage(deep=True).sum() < df.memory_usage(deep=True).sum() / 2
+    pd.testing.assert_frame_equal(compact_df.astype(object).where(compact_df.notna(), None),
+                                  df.astype(object).where(df.notna(), None), check_dtype=False)
+
+
+###############################################################################
+# Write test cases for transform_leads_in_partitions() function
+# ##############################################################################
+@pytest.mark.parametrize('partition_key', ['month', 'hash'])
+def test_transform_leads_in_partitions(partition_key):
+    """_summary_
+    This function checks if mapping the leads partition by partition in a
+    process pool gives the same 'model_input' and 'interactions_mapped' as
+    mapping them serially.
+
+    INPUTS
+        UNIT_TEST_DATA_FILE_NAME: Name of the test csv file 'leadscoring_test.csv'
+
+    SAMPLE USAGE
+        output=test_transform_leads_in_partitions('month')
+    """
+    df = utils.fill_null_lead_counts(pd.read_csv(f"{UNIT_TEST_DATA_DIRECTORY}/{UNIT_TEST_DATA_FILE_NAME}"))
+    df = pd.concat([df, df.iloc[:10]], ignore_index=True)
+    interaction_mapping_df = pd.read_csv(utils.INTERACTION_MAPPING)
+
+    _, _, expected_mapped, expected_model_input = utils.transform_leads(df, interaction_mapping_df, True)
+    _, _, actual_mapped, actual_model_input = utils.transform_leads_in_partitions(
+        df, interaction_mapping_df, True, workers=2, partition_key=partition_key, partitions=4)
+
+    pd.testing.assert_frame_equal(actual_model_input, expected_model_input)
+    pd.testing.assert_frame_equal(actual_mapped, expected_mapped)
+
+
+###############################################################################
+# Write test cases for drop_duplicate_rows() function
+# ##############################################################################
+def test_drop_duplicate_rows(tmp_path):
+    """_summary_
+    This function checks if drop_duplicate_rows drops the same rows as
+    drop_duplicates whatever the dtypes of the columns, if the chunks
+    deduplicated on a connection are deduplicated against each other until
+    it is reset, and if a streaming load with deduplication loads the rows of
+    drop_duplicates.
+
+    INPUTS
+        UNIT_TEST_DATA_FILE_NAME: Name of the test csv file 'leadscoring_test.csv'
+
+    SAMPLE USAGE
+        output=test_drop_duplicate_rows(tmp_path)
+    """
+    df = utils.fill_null_lead_counts(pd.read_csv(f"{UNIT_TEST_DATA_DIRECTORY}/{UNIT_TEST_DATA_FILE_NAME}"))
+    df = pd.concat([df, df.iloc[:10]], ignore_index=True)
+
+    pd.testing.assert_frame_equal(utils.drop_duplicate_rows(df), df.drop_duplicates())
+    assert (utils.row_hashes(utils.apply_dtype_policy(df)) == utils.row_hashes(df)).all()
+
+    with utils.get_connection(str(tmp_path / 'row_hashes.db')) as conn:
+        first_chunk = utils.drop_duplicate_rows(df.iloc[:60], conn, reset=True)
+        second_chunk = utils.drop_duplicate_rows(df.iloc[50:], conn)
+        next_load = utils.drop_duplicate_rows(df.iloc[50:], conn, reset=True)
+
+    assert len(first_chunk) == 60
+    pd.testing.assert_frame_equal(second_chunk, df.iloc[60:100].drop_duplicates())
+    pd.testing.assert_frame_equal(next_load, df.iloc[50:].drop_duplicates())
+
+    csv_path = str(tmp_path / 'duplicated_leads.csv')
+    df.to_csv(csv_path, index=False)
+    with utils.get_connection(str(tmp_path / 'load.db')) as conn:
+        rows, chunks = utils.load_data_in_chunks(csv_path, conn, 'loaded_data', 30, deduplicate=True)
+        assert conn.execute("SELECT name FROM sqlite_temp_master WHERE name = 'load_row_hashes'").fetchone() is None
+    assert chunks == 4 and rows == len(df.drop_duplicates())
+
+
+###############################################################################
+# Write test cases for lookup_city_tiers() function
+# ##############################################################################
+def test_lookup_city_tiers():
+    """_summary_
+    This function checks if lookup_city_tiers resolves the cities irrespective
+    of their case and whitespace, assigns the unmapped and null cities to tier
+    3.0 and reports the unmapped cities with their number of leads.
+
+    INPUTS
+        UNIT_TEST_DATA_FILE_NAME: Name of the test csv file 'leadscoring_test.csv'
+
+    SAMPLE USAGE
+        output=test_lookup_city_tiers()
+    """
+    cities = pd.Series([' Mumbai', 'PUNE  ', 'vasco  da gama', 'Vasco da Gama', None, 'agra'])
+    for values in (cities, cities.astype('category')):
+        tiers, unmapped = utils.lookup_city_tiers(values)
+        assert tiers.tolist() == [1.0, 1.0, 3.0, 3.0, 3.0, 2.0]
+        assert unmapped.to_dict('list') == {'city_mapped': ['vasco da gama'], 'leads': [2]}
+
+    df = pd.read_csv(f"{UNIT_TEST_DATA_DIRECTORY}/{UNIT_TEST_DATA_FILE_NAME}")
+    tiers, unmapped = utils.lookup_city_tiers(df['city_mapped'])
+    expected = df['city_mapped'].map(utils.city_tier_mapping).astype('float64').fillna(3.0)
+    assert tiers.tolist() == expected.tolist()
+    assert unmapped['leads'].sum() == (~df['city_mapped'].isin(list(utils.city_tier_mapping)) & df['city_mapped'].notna()).sum()
+
+
+###############################################################################
+# Write test cases for the level frequencies
+# ##############################################################################
+@pytest.mark.parametrize('sketch_size', [None, 3])
+def test_refresh_significant_levels(tmp_path, sketch_size):
+    """_summary_
+    This function checks if the level counts updated batch by batch give the
+    same significant levels as the rule of the data cleaning notebook applied
+    to all the leads, and if the Misra-Gries sketch keeps at most
+    'sketch_size' counters that underestimate the counts by at most the error
+    it reports.
+
+    INPUTS
+        UNIT_TEST_DATA_FILE_NAME: Name of the test csv file 'leadscoring_test.csv'
+
+    SAMPLE USAGE
+        output=test_refresh_significant_levels(tmp_path, None)
+    """
+    df = pd.read_csv(f"{UNIT_TEST_DATA_DIRECTORY}/{UNIT_TEST_DATA_FILE_NAME}")
+    column = 'first_utm_medium_c'
+
+    with get_connection(str(tmp_path / 'levels.db')) as conn:
+        for start in range(0, len(df), 30):
+            level_frequencies.update_level_counts(conn, df.iloc[start:start + 30], reset=start == 0,
+                                                  sketch_size=sketch_size)
+        counts = level_frequencies.read_level_counts(conn, column)
+        rows, non_null, max_error = conn.execute('SELECT rows, non_null, max_error FROM level_count_totals '
+                                                 'WHERE column_name = ?', (column,)).fetchone()
+        levels = level_frequencies.refresh_significant_levels(conn)
+        loaded_levels = level_frequencies.load_significant_levels(conn)
+        default_levels = level_frequencies.current_significant_levels(conn, refreshed=False)
+
+    exact_counts = df[column].value_counts()
+    assert (rows, non_null) == (len(df), exact_counts.sum())
+    assert loaded_levels == levels
+    assert default_levels == significant_levels
+    if sketch_size is None:
+        assert max_error == 0
+        assert counts.sort_index().equals(exact_counts.rename_axis('level').rename(None).sort_index())
+        shares = (exact_counts.sort_index().sort_values(ascending=False, kind='stable') / non_null).cumsum()
+        assert levels[column] == list(shares[shares <= 0.9].index)
+    else:
+        assert len(counts) <= sketch_size
+        assert max_error <= non_null / (sketch_size + 1)
+        for level, count in counts.items():
+            assert exact_counts[level] - max_error <= count <= exact_counts[level]
+        assert set(exact_counts[exact_counts > max_error].index) <= set(counts.index)
+
+
+###############################################################################
+# Write test cases for instrument_task() decorator
+# ##############################################################################
+def test_instrument_task(tmp_path, monkeypatch):
+    """_summary_
+    This function checks if instrument_task records the rows read and written
+    through the storage backend, tags the metrics with the Airflow context,
+    records nested and failed calls and re-raises the error of a failed call.
+
+    SAMPLE USAGE
+        output=test_instrument_task(tmp_path, monkeypatch)
+    """
+    db_path = str(tmp_path / 'metrics_test.db')
+    storage = get_storage('sqlite')
+    monkeypatch.setenv('AIRFLOW_CTX_DAG_ID', 'Lead_scoring_data_engineering_pipeline')
+    monkeypatch.setenv('AIRFLOW_CTX_TASK_ID', 'loading_data')
+    monkeypatch.setenv('AIRFLOW_CTX_DAG_RUN_ID', 'manual__2024-01-01')
+
+    @instrument_task(lambda: db_path)
+    def copy_leads(fail=False):
+        with get_connection(db_path) as conn:
+            df = storage.read(conn, 'leads')
+            if fail:
+                raise ValueError('failed task')
+            storage.write(conn, df, 'leads_copy')
+
+    @instrument_task(lambda: db_path)
+    def load_leads():
+        with get_connection(db_path) as conn:
+            storage.write(conn, pd.DataFrame({'lead_id': range(10)}), 'leads')
+        copy_leads()
+
+    load_leads()
+    with pytest.raises(ValueError):
+        copy_leads(fail=True)
+
+    with get_connection(db_path) as conn:
+        metrics = pd.read_sql('SELECT * FROM pipeline_metrics', conn)
+    assert metrics['function_name'].tolist() == ['copy_leads', 'load_leads', 'copy_leads']
+    assert metrics['status'].tolist() == ['success', 'success', 'failed']
+    assert metrics['rows_read'].tolist() == [10, 10, 10]
+    assert metrics['rows_written'].tolist() == [10, 20, 0]
+    assert (metrics['dag_id'] == 'Lead_scoring_data_engineering_pipeline').all()
+    assert (metrics['run_id'] == 'manual__2024-01-01').all()
+    assert (metrics['wall_time'] >= 0).all() and (metrics['peak_rss_mb'] > 0).all()
+
+
+###############################################################################
+# Write test cases for run_dag() function of the local runner
+# ##############################################################################
+def test_run_dag(tmp_path):
+    """_summary_
+    This function checks if the local runner loads a DAG file without Airflow,
+    runs the independent tasks concurrently, after their upstream tasks, and
+    doesn't run the tasks downstream of a failed task, and if importing the
+    runner leaves sys.path unchanged.
+
+    SAMPLE USAGE
+        output=test_run_dag(tmp_path)
+    """
+    import sys
+    import local_runner
+    path = list(sys.path)
+    importlib.reload(local_runner)
+    assert sys.path == path
+
+    dag_file = tmp_path / 'diamond_dag.py'
+    dag_file.write_text(
+        "import threading\n"
+        "from datetime import datetime\n"
+        "from airflow import DAG\n"
+        "from airflow.operators.python import PythonOperator\n"
+        "\n"
+        "both_branches = threading.Barrier(2, timeout=10)\n"
+        "def fail():\n"
+        "    raise ValueError('failed task')\n"
+        "\n"
+        "dag = DAG(dag_id='diamond', default_args={'start_date': datetime(2024, 1, 1), 'retries': 0})\n"
+        "start = PythonOperator(task_id='start', python_callable=lambda: None, dag=dag)\n"
+        "left = PythonOperator(task_id='left', python_callable=both_branches.wait, dag=dag)\n"
+        "right = PythonOperator(task_id='right', python_callable=both_branches.wait, dag=dag)\n"
+        "join = PythonOperator(task_id='join', python_callable=fail, dag=dag)\n"
+        "end = PythonOperator(task_id='end', python_callable=lambda: None, dag=dag)\n"
+        "start >> [left, right] >> join >> end\n")
+
+    dag, = load_dags(str(dag_file))
+    results = run_dag(dag, executor='thread', workers=2)
+
+    status = {task_id: result['status'] for task_id, result in results.items()}
+    assert status == {'start': 'success', 'left': 'success', 'right': 'success',
+                      'join': 'failed', 'end': 'upstream_failed'}
+    assert results['left']['start'] >= results['start']['end']
+    assert results['join']['start'] >= max(results['left']['end'], results['right']['end'])
+    assert 'failed task' in results['join']['error']
+
+
+###############################################################################
+# Write test cases for one_hot_encode() function
+# ##############################################################################
+def test_one_hot_encode():
+    """_summary_
+    This function checks if the compiled one hot encoder gives the values of
+    pd.get_dummies restricted to the output columns, with a column of 0 for a
+    missing column and no indicator for nulls and unknown levels, and if the
+    sparse output has the same values as the dense one.
+
+    SAMPLE USAGE
+        output=test_one_hot_encode()
+    """
+    output_columns = ['total_leads_droppped', 'city_tier', 'referred_lead',
+                      'first_platform_c_Level0', 'first_platform_c_others',
+                      'first_utm_source_c_Level2', 'first_utm_source_c_Level4']
+    df = pd.DataFrame({
+        'total_leads_droppped': [1.0, None, 3.0, 0.0],
+        'city_tier': [1.0, 2.0, 3.0, 1.0],
+        'first_platform_c': ['Level0', 'others', 'Level0', 'Level9'],
+        'first_utm_source_c': ['Level4', None, 'Level2', 'Level4'],
+    })
+    encoder = compile_one_hot_encoder(output_columns, ['first_platform_c', 'first_utm_source_c'])
+
+    encoded = encode_features_frame(df, encoder)
+    expected = pd.DataFrame({
+        'total_leads_droppped': [1, 0, 3, 0],
+        'city_tier': [1, 2, 3, 1],
+        'referred_lead': [0, 0, 0, 0],
+        'first_platform_c_Level0': [1, 0, 1, 0],
+        'first_platform_c_others': [0, 1, 0, 0],
+        'first_utm_source_c_Level2': [0, 0, 1, 0],
+        'first_utm_source_c_Level4': [1, 0, 0, 1],
+    }, dtype='float32')
+    pd.testing.assert_frame_equal(encoded, expected)
+
+    sparse = one_hot_encode(df, encoder, sparse=True)
+    assert sparse.format == 'csr' and sparse.dtype == 'float32'
+    assert (sparse.toarray() == expected.to_numpy()).all()
+
+
+###############################################################################
+# Write test cases for load_or_build_dataset() function
+# ##############################################################################
+def test_load_or_build_dataset(tmp_path):
+    """_summary_
+    This function checks if the LightGBM dataset cache is built on the first
+    run, loaded when the rows are unchanged, extended with the cached bins
+    when rows are appended, rebuilt once the rows grew by more than max_growth
+    since the bins were computed, whatever the number of extensions since, and
+    rebuilt when a cached row changed, and if a model trained on the cached
+    dataset is the one trained without cache.
+
+    SAMPLE USAGE
+        output=test_load_or_build_dataset(tmp_path)
+    """
+    import lightgbm as lgb
+    import numpy as np
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.random((5000, 4)), columns=['a', 'b', 'c', 'd'])
+    y = pd.DataFrame({'app_complete_flag': (X['a'] + rng.random(5000) > 1).astype(int)})
+    params = {'objective': 'binary', 'verbosity': -1, 'num_threads': 1}
+    cache_directory = str(tmp_path / 'lgb_dataset_cache')
+
+    dataset, status, _ = load_or_build_dataset(X.iloc[:1000], y.iloc[:1000], params, cache_directory)
+    assert status == 'miss' and dataset.num_data() == 1000
+    dataset, status, _ = load_or_build_dataset(X.iloc[:1000], y.iloc[:1000], params, cache_directory)
+    assert status == 'hit' and dataset.num_data() == 1000
+    cached_model = lgb.train(params, dataset, num_boost_round=5)
+    fresh_model = lgb.train(params, lgb.Dataset(X.iloc[:1000], label=y.iloc[:1000, 0], params=params),
+                            num_boost_round=5)
+    assert np.allclose(cached_model.predict(X), fresh_model.predict(X))
+
+    dataset, status, _ = load_or_build_dataset(X.iloc[:1200], y.iloc[:1200], params, cache_directory)
+    assert status == 'extended' and dataset.num_data() == 1200
+    assert (dataset.get_label() == y['app_complete_flag'].to_numpy()[:1200]).all()
+
+    # 40% more rows every run, the bins are recomputed every other run
+    statuses = []
+    for rows in (1400, 1960, 2744, 3841, 5000):
+        dataset, status, _ = load_or_build_dataset(X.iloc[:rows], y.iloc[:rows], params, cache_directory)
+        assert dataset.num_data() == rows
+        statuses.append(status)
+    assert statuses == ['extended', 'miss', 'extended', 'miss', 'extended']
+
+    X.loc[0, 'a'] = 2.0
+    _, status, _ = load_or_build_dataset(X, y, params, cache_directory)
+    assert status == 'miss'
+
+
+###############################################################################
+# Write test cases for successive_halving() function
+# ##############################################################################
+def test_successive_halving():
+    """_summary_
+    This function checks if the successive halving search keeps the best
+    third of the candidates at every rung, with three times as many boosting
+    rounds, logs every rung once and returns the parameters of the candidate
+    with the best validation AUC of the last rung.
+
+    SAMPLE USAGE
+        output=test_successive_halving()
+    """
+    import numpy as np
+    rng = np.random.default_rng(0)
+    X = rng.random((600, 4))
+    y = (X[:, 0] + rng.random(600) > 1).astype(int)
+    base_params = {'objective': 'binary', 'verbosity': -1, 'n_jobs': 1}
+    search_space = {'num_leaves': ('int', 4, 16), 'learning_rate': ('log_uniform', 0.05, 0.3),
+                    'boosting_type': ['gbdt']}
+
+    candidates = sample_candidates(search_space, 9, seed=1)
+    assert candidates == sample_candidates(search_space, 9, seed=1)
+    assert all(4 <= c['num_leaves'] <= 16 and 0.05 <= c['learning_rate'] <= 0.3 for c in candidates)
+
+    rungs = []
+    best_params, rounds, trials = successive_halving(
+        X[:400], y[:400], X[400:], y[400:], base_params, search_space, n_candidates=9,
+        min_rounds=2, max_rounds=50, eta=3, workers=2, seed=1,
+        log_rung=lambda rung, rounds, rung_trials: rungs.append((rung, rounds, len(rung_trials))))
+    assert rungs == [(0, 2, 9), (1, 6, 3), (2, 18, 1)]
+    assert len(trials) == 13 and rounds == 18
+    last = [trial for trial in trials if trial['rung'] == 2][0]
+    assert best_params == dict(last['params'], n_jobs=1)
+
+
+###############################################################################
+# Write test cases for cross_validate() function
+# ##############################################################################
+def test_cross_validate(tmp_path):
+    """_summary_
+    This function checks if the cross validation predicts every row once,
+    out of its own fold, stratifies the folds by the target, saves its
+    results by fingerprint and loads them on the next call with the same
+    fingerprint instead of training the folds again.
+
+    SAMPLE USAGE
+        output=test_cross_validate(tmp_path)
+    """
+    import numpy as np
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.random((600, 4)), columns=['a', 'b', 'c', 'd'])
+    y = pd.DataFrame({'app_complete_flag': (X['a'] + rng.random(600) > 1).astype(int)})
+    params = {'objective': 'binary', 'verbosity': -1, 'n_jobs': 1}
+    cache_directory = str(tmp_path / 'cv_cache')
+
+    results = cross_validate(X, y, params, 10, 3, cache_directory, 'fingerprint', workers=2)
+    assert results['status'] == 'miss'
+    assert sorted(fold['fold'] for fold in results['fold_results']) == [0, 1, 2]
+    assert sum(fold['rows'] for fold in results['fold_results']) == 600
+    for fold in range(3):
+        assert abs(y['app_complete_flag'][results['folds'] == fold].mean() - y['app_complete_flag'].mean()) < 0.01
+    assert ((results['predictions'] > 0) & (results['predictions'] < 1)).all()
+    assert 0.5 < results['oof_auc'] <= 1 and 0.5 < results['mean']['auc'] <= 1
+    assert os.listdir(cache_directory) == ['fingerprint']
+
+    cached = cross_validate(X, y, params, 10, 3, cache_directory, 'fingerprint', workers=2)
+    assert cached['status'] == 'hit'
+    assert np.array_equal(cached['predictions'], results['predictions'])
+    assert cached['mean'] == results['mean'] and cached['oof_auc'] == results['oof_auc']
+
+
+###############################################################################
+# Write test cases for the incremental training of the Production model
+# ##############################################################################
+def test_train_incremental_model(tmp_path, monkeypatch):
+    """_summary_
+    This function checks, on a local sqlite model registry, if the Production
+    model is only continued when its run logged a training watermark, if it
+    is continued on the leads created after the watermark with the newest of
+    them held out, if the continued model is promoted when it ties with the
+    other candidate, if nothing is registered when the Production model stays
+    the best, and if nothing is trained without enough new leads.
+
+    SAMPLE USAGE
+        output=test_train_incremental_model(tmp_path, monkeypatch)
+    """
+    import lightgbm as lgb
+    import mlflow
+    import mlflow.lightgbm
+    import numpy as np
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.random((1000, 4)), columns=['a', 'b', 'c', 'd'])
+    y = pd.DataFrame({'app_complete_flag': (X['a'] + rng.random(1000) > 1).astype(int)})
+    created_dates = pd.Series(pd.date_range('2024-01-01', periods=1000, freq='h').strftime('%Y-%m-%d %H:%M:%S'))
+    created_dates = created_dates.sample(frac=1, random_state=0).reset_index(drop=True)
+    watermark = pd.Series(sorted(created_dates)).iloc[599]
+    old = np.flatnonzero((created_dates <= watermark).to_numpy())
+    params = {'objective': 'binary', 'verbosity': -1, 'num_threads': 1, 'device': 'cpu'}
+
+    mlflow.set_tracking_uri(f"sqlite:///{tmp_path / 'mlflow.db'}")
+    mlflow.set_experiment(experiment_id=mlflow.create_experiment(
+        'incremental', artifact_location=str(tmp_path / 'artifacts')))
+    client = mlflow.tracking.MlflowClient()
+    # the requirements of the logged models are not inferred, which takes seconds
+    monkeypatch.setattr(mlflow.models, 'infer_pip_requirements', lambda path, flavor, fallback=None: fallback)
+
+    def register(watermark=None):
+        classifier = lgb.LGBMClassifier(n_estimators=10, verbosity=-1, n_jobs=1)
+        classifier.fit(X.iloc[old], y.iloc[old, 0])
+        with mlflow.start_run():
+            if watermark is not None:
+                mlflow.log_param('training_watermark', watermark)
+            model_info = mlflow.lightgbm.log_model(classifier, artifact_path='LightGBM',
+                                                   registered_model_name='LightGBM')
+        client.transition_model_version_stage('LightGBM', str(model_info.registered_model_version), 'Production',
+                                              archive_existing_versions=True)
+
+    def production_version():
+        return int(client.get_latest_versions('LightGBM', stages=['Production'])[0].version)
+
+    # no Production model, then one without watermark: trained from scratch
+    assert incremental.get_production_model('LightGBM') is None
+    register()
+    assert incremental.get_production_model('LightGBM') is None
+
+    register(watermark)
+    production = incremental.get_production_model('LightGBM')
+    booster, version, production_watermark = production
+    assert isinstance(booster, lgb.Booster) and int(version) == 2 and production_watermark == watermark
+
+    # the 400 new leads, oldest first, the newest 80 held out
+    train_new, holdout = incremental.split_new_leads(created_dates, watermark, 0.2)
+    assert len(train_new) == 320 and len(holdout) == 80
+    new_dates = created_dates.iloc[np.concatenate([train_new, holdout])]
+    assert (new_dates > watermark).all() and new_dates.is_monotonic_increasing
+
+    # a tie with the full retrain promotes the continued model, the full
+    # retrain is binned without the held out leads
+    full_retrain_rows = []
+
+    def build_dataset(rows):
+        full_retrain_rows.append(rows)
+        return lgb.Dataset(X.iloc[rows], label=y.iloc[rows, 0], params=params)
+
+    monkeypatch.setattr(incremental, 'roc_auc_score', lambda y_true, y_score: 0.75)
+    with mlflow.start_run():
+        promoted = incremental.train_incremental_model(X, y, created_dates, params, 10, production, 'LightGBM',
+                                                       rounds=5, build_dataset=build_dataset)
+    assert promoted == 'incremental' and production_version() == 3
+    assert len(full_retrain_rows[0]) == 920 and not np.isin(holdout, full_retrain_rows[0]).any()
+    continued = incremental.get_production_model('LightGBM')
+    assert continued[2] == created_dates.iloc[train_new].max()
+    assert continued[0].current_iteration() == booster.current_iteration() + 5
+
+    # the Production model stays the best: nothing is registered
+    aucs = iter([0.7, 0.8])
+    monkeypatch.setattr(incremental, 'roc_auc_score', lambda y_true, y_score: next(aucs))
+    with mlflow.start_run():
+        promoted = incremental.train_incremental_model(X, y, created_dates, params, 10, continued,
+                                                       'LightGBM', rounds=5, compare_full_retrain=False)
+    assert promoted == 'production' and production_version() == 3
+
+    # no lead created after the watermark
+    latest = (booster, version, created_dates.max())
+    assert incremental.train_incremental_model(X, y, created_dates, params, 10, latest, 'LightGBM') is None
+
+
+###############################################################################
+# Write test cases for load_cached_model() function
+# ##############################################################################
+def test_load_cached_model(tmp_path):
+    """_summary_
+    This function checks if the model cache loads a cached version from disk
+    and then from memory without downloading it, reloads the model when the
+    version of the stage changed, keeps only the most recent versions and
+    serves the last known version when the registry can't be reached.
+
+    SAMPLE USAGE
+        output=test_load_cached_model(tmp_path)
+    """
+    import lightgbm as lgb
+    import numpy as np
+    from types import SimpleNamespace
+    rng = np.random.default_rng(0)
+    X = rng.random((200, 3))
+    params = {'objective': 'binary', 'verbosity': -1, 'num_threads': 1}
+    cache_directory = str(tmp_path / 'model_cache')
+    for version, rounds in (('3', 2), ('4', 4)):
+        booster = lgb.train(params, lgb.Dataset(X, label=(X[:, 0] > 0.5).astype(int)), num_boost_round=rounds)
+        os.makedirs(os.path.join(cache_directory, 'LightGBM', version))
+        booster.save_model(os.path.join(cache_directory, 'LightGBM', version, 'model.txt'))
+
+    class Registry:
+        version, reachable = '3', True
+
+        def get_latest_versions(self, name, stages):
+            if not self.reachable:
+                raise ConnectionError('registry down')
+            return [SimpleNamespace(version=self.version)]
+
+    registry = Registry()
+    model, version, status, _ = load_cached_model('LightGBM', 'Production', cache_directory, 1, registry)
+    assert (version, status, model.num_trees()) == ('3', 'disk', 2)
+    assert not os.path.exists(os.path.join(cache_directory, 'LightGBM', '4'))
+    model, version, status, _ = load_cached_model('LightGBM', 'Production', cache_directory, 1, registry)
+    assert (version, status) == ('3', 'memory')
+
+    registry.reachable = False
+    _, version, status, _ = load_cached_model('LightGBM', 'Production', cache_directory, 1, registry)
+    assert (version, status) == ('3', 'memory')
+
+    registry.version, registry.reachable = '5', True
+    os.makedirs(os.path.join(cache_directory, 'LightGBM', '5'))
+    booster.save_model(os.path.join(cache_directory, 'LightGBM', '5', 'model.txt'))
+    model, version, status, _ = load_cached_model('LightGBM', 'Production', cache_directory, 1, registry)
+    assert (version, status, model.num_trees()) == ('5', 'disk', 4)
+    assert sorted(os.listdir(os.path.join(cache_directory, 'LightGBM'))) == ['5', 'Production.json']
+
+
+def test_load_cached_model_download(tmp_path):
+    """_summary_
+    This function checks, on a local sqlite model registry, if the model
+    cache downloads a model registered as an LGBMClassifier, as the baseline
+    models are, and caches and returns its booster.
+
+    SAMPLE USAGE
+        output=test_load_cached_model_download(tmp_path)
+    """
+    import lightgbm as lgb
+    import mlflow
+    import mlflow.lightgbm
+    import numpy as np
+    rng = np.random.default_rng(0)
+    X = rng.random((200, 3))
+    classifier = lgb.LGBMClassifier(n_estimators=5, verbosity=-1, n_jobs=1)
+    classifier.fit(X, (X[:, 0] > 0.5).astype(int))
+
+    mlflow.set_tracking_uri(f"sqlite:///{tmp_path / 'mlflow.db'}")
+    mlflow.set_experiment(experiment_id=mlflow.create_experiment(
+        'model_cache', artifact_location=str(tmp_path / 'artifacts')))
+    with mlflow.start_run():
+        model_info = mlflow.lightgbm.log_model(classifier, artifact_path='LightGBM', pip_requirements=['lightgbm'],
+                                               registered_model_name='LightGBM_classifier')
+    mlflow.tracking.MlflowClient().transition_model_version_stage(
+        'LightGBM_classifier', str(model_info.registered_model_version), 'Production')
+
+    cache_directory = str(tmp_path / 'model_cache')
+    model, version, status, _ = load_cached_model('LightGBM_classifier', 'Production', cache_directory)
+    assert (version, status) == ('1', 'download') and isinstance(model, lgb.Booster)
+    assert os.path.exists(os.path.join(cache_directory, 'LightGBM_classifier', '1', 'model.txt'))
+    assert np.allclose(model.predict(X), classifier.predict_proba(X)[:, 1])
+    _, _, status, _ = load_cached_model('LightGBM_classifier', 'Production', cache_directory)
+    assert status == 'memory'
+
+
+###############################################################################
+# Write test cases for MicroBatcher class
+# ##############################################################################
+def test_micro_batcher():
+    """_summary_
+    This function checks if the micro-batcher coalesces concurrent requests
+    into batches bounded by their size, returns to every request the results
+    of its own items, counts the requests and batches, and raises the error
+    of a failed batch to its requests.
+
+    SAMPLE USAGE
+        output=test_micro_batcher()
+    """
+    import asyncio
+    batches = []
+
+    def predict(items):
+        batches.append(len(items))
+        if 'bad' in items:
+            raise ValueError('bad lead')
+        return [item * 2 for item in items]
+
+    async def run():
+        batcher = MicroBatcher(predict, max_batch_size=8, max_wait=0.05)
+        batcher.start()
+        results = await asyncio.gather(*[batcher.submit([i, i + 100]) for i in range(20)])
+        errors = await asyncio.gather(batcher.submit(['bad']), batcher.submit(['ok']), return_exceptions=True)
+        snapshot = batcher.stats.snapshot()
+        await batcher.stop()
+        return results, errors, snapshot
+
+    results, errors, snapshot = asyncio.run(run())
+    assert results == [[i * 2, (i + 100) * 2] for i in range(20)]
+    assert batches[:5] == [8, 8, 8, 8, 8] and sum(batches[:5]) == 40
+    assert all(isinstance(error, ValueError) for error in errors)
+    assert snapshot['requests'] == 22 and snapshot['errors'] == 2 and snapshot['batches'] == 6
+    assert snapshot['latency_ms']['p50'] <= snapshot['latency_ms']['p99'] <= snapshot['latency_ms']['max']
+
+
+###############################################################################
+# Write test cases for the scoring service
+# ##############################################################################
+def test_scoring_service(override_constants, tmp_path, monkeypatch):
+    """_summary_
+    This function checks if the scoring service scores the raw leads as the
+    batch inference path scores the rows of 'model_input', accepts a lead, a
+    list of leads or {"leads": [...]}, replies 400 to invalid payloads, 404
+    and 405 to unknown paths and methods, reports its counters on /metrics
+    and reports the version of the model that scored a batch when the model
+    is reloaded meanwhile.
+
+    INPUTS
+        UNIT_TEST_DATA_FILE_NAME: Name of the test csv file 'leadscoring_test.csv'
+
+    SAMPLE USAGE
+        output=test_scoring_service(tmp_path, monkeypatch)
+    """
+    import asyncio
+    import json
+    import lightgbm as lgb
+    import numpy as np
+    monkeypatch.syspath_prepend(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    scoring_service = importlib.import_module('Lead_scoring_inference_pipeline.scoring_service')
+
+    raw = pd.read_csv(f"{UNIT_TEST_DATA_DIRECTORY}/{UNIT_TEST_DATA_FILE_NAME}")
+    leads = json.loads(raw.drop(columns=['app_complete_flag']).to_json(orient='records'))
+
+    # a booster trained on the features the service computes from the leads
+    class Features:
+        def predict(self, features):
+            return features
+
+    params = {'objective': 'binary', 'verbosity': -1, 'num_threads': 1, 'min_data_in_leaf': 5}
+    model_file = str(tmp_path / 'model.txt')
+    lgb.train(params, lgb.Dataset(scoring_service.score_leads(leads, Features()), label=raw['app_complete_flag']),
+              num_boost_round=10).save_model(model_file)
+    booster = lgb.Booster(model_file=model_file)
+    scored = scoring_service.score_leads(leads, booster)
+
+    # the batch inference path predicts on the one hot encoded 'model_input'
+    utils.load_data_into_db()
+    utils.map_city_tier()
+    utils.map_categorical_vars()
+    utils.interactions_mapping()
+    conn = sqlite3.connect(f"{UNIT_TEST_DB_PATH}/{UNIT_TEST_DB_FILE_NAME}")
+    try:
+        model_input = pd.read_sql_query("SELECT * FROM model_input", conn)
+    finally:
+        conn.close()
+    batch = booster.predict(encode_features_frame(model_input, scoring_service.ONE_HOT_ENCODER))
+    assert len(model_input) == len(raw)
+    assert np.allclose(batch, pd.Series(scored, index=raw['created_date'])[model_input['created_date']].to_numpy())
+
+    async def run():
+        service = scoring_service.ScoringService(model_file, max_batch_size=64, max_wait_ms=1)
+        service.batcher.start()
+        replies = {
+            'lead': await service.route('POST', '/score', json.dumps(leads[0]).encode()),
+            'list': await service.route('POST', '/score', json.dumps(leads[:3]).encode()),
+            'leads': await service.route('POST', '/score', json.dumps({'leads': leads[:3]}).encode()),
+            'invalid': await service.route('POST', '/score', b'{"lead'),
+            'empty': await service.route('POST', '/score', b'[]'),
+            'not_leads': await service.route('POST', '/score', b'[1, 2]'),
+            'get_score': await service.route('GET', '/score', b''),
+            'unknown': await service.route('GET', '/unknown', b''),
+            'metrics': await service.route('GET', '/metrics', b''),
+        }
+
+        # the model is reloaded while a batch is scored
+        class ReloadedDuringBatch:
+            def predict(self, features):
+                service.served = (booster, 'reloaded')
+                return booster.predict(features)
+
+        service.served = (ReloadedDuringBatch(), 'before_reload')
+        replies['during_reload'] = await service.route('POST', '/score', json.dumps(leads[0]).encode())
+        replies['after_reload'] = await service.route('POST', '/score', json.dumps(leads[0]).encode())
+        await service.batcher.stop()
+        return replies
+
+    replies = asyncio.run(run())
+    status, payload = replies['lead']
+    assert status == 200 and payload['model_version'] == 'file:model.txt'
+    assert np.allclose(payload['probability'], scored[:1])
+    assert payload['app_complete_flag'] == (scored[:1] > 0.5).astype(int).tolist()
+    for shape in ('list', 'leads'):
+        status, payload = replies[shape]
+        assert status == 200 and np.allclose(payload['probability'], scored[:3])
+    assert [replies[name][0] for name in ('invalid', 'empty', 'not_leads', 'get_score', 'unknown')] == \
+        [400, 400, 400, 405, 404]
+    status, metrics = replies['metrics']
+    assert status == 200 and (metrics['requests'], metrics['items'], metrics['errors']) == (3, 7, 0)
+    assert metrics['max_batch_size'] == 64 and metrics['model_version'] == 'file:model.txt'
+    assert replies['during_reload'][1]['model_version'] == 'before_reload'
+    assert replies['after_reload'][1]['model_version'] == 'reloaded'